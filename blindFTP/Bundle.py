@@ -0,0 +1,127 @@
+#!/usr/local/bin/python
+# -*- coding: latin-1 -*-
+"""
+----------------------------------------------------------------------------
+Bundle: small files grouped in shared BFTP packets.
+----------------------------------------------------------------------------
+
+A small file sent alone costs a whole datagram (header and full path), a CRC
+pass, a session and the progress display of a send. In a bundle, each small
+file is only an entry (name, size, date and CRC32, then its content), and as
+many entries as fit in a datagram are sent in one packet: the header of the
+packet gives the number of files and the CRC32 of the whole bundle. The
+receiver writes each file of the bundle directly, without partial file nor
+journal.
+"""
+
+# === IMPORTS ==================================================================
+
+import struct
+
+# === CONSTANTES ===============================================================
+
+TAILLE_MAX_FICHIER = 4096  # Max size of a file sent in a bundle (bytes)
+
+# Entry of a file in a bundle, followed by its name (utf-8) and its content
+# (little endian):
+# - longueur du nom: uint16=H
+# - taille du fichier: uint16=H
+# - date du fichier: uint32=I
+# - CRC32 du fichier: int32=i (signe, comme dans l'entete des paquets)
+ENTREE = struct.Struct("<HHIi")
+
+# ------------------------------------------------------------------------------
+# classe Lot
+# -------------------
+
+
+class Lot:
+    """Bundle being built, sent as the data of one packet."""
+
+    def __init__(self, taille_max):
+        """Lot constructor.
+
+        taille_max: max size of the bundle (data of a packet, bytes)"""
+        self.taille_max = taille_max
+        self.morceaux = []
+        self.taille = 0
+        self.nb_fichiers = 0
+
+    def ajouter(self, nom, contenu, date, crc32):
+        """Add a file to the bundle (nom: name in utf-8, crc32: signed).
+        Return False if it does not fit in the bundle."""
+        taille = ENTREE.size + len(nom) + len(contenu)
+        if self.taille + taille > self.taille_max or len(contenu) > 0xFFFF:
+            return False
+        self.morceaux += (ENTREE.pack(len(nom), len(contenu), date, crc32), nom, contenu)
+        self.taille += taille
+        self.nb_fichiers += 1
+        return True
+
+    def octets(self):
+        "Return the data of the bundle."
+        return b"".join(self.morceaux)
+
+    def vider(self):
+        "Empty the bundle, once sent."
+        self.morceaux = []
+        self.taille = 0
+        self.nb_fichiers = 0
+
+
+def lire(donnees):
+    """Generate the files of the data of a bundle: (name in utf-8, date, CRC32,
+    content as a memoryview). Raise ValueError if the bundle is incorrect."""
+    donnees = memoryview(donnees)
+    position = 0
+    while position < len(donnees):
+        if position + ENTREE.size > len(donnees):
+            raise ValueError("lot tronque")
+        longueur_nom, taille, date, crc32 = ENTREE.unpack_from(donnees, position)
+        position += ENTREE.size
+        fin = position + longueur_nom + taille
+        if fin > len(donnees):
+            raise ValueError("lot tronque")
+        yield donnees[position : position + longueur_nom].tobytes(), date, crc32, donnees[position + longueur_nom : fin]
+        position = fin
+
+
+if __name__ == "__main__":
+    # nombre de fichiers par paquet et vitesse de construction et de lecture
+    # des lots, pour des fichiers de 100 octets a TAILLE_MAX_FICHIER
+    import sys, time, os, binascii
+
+    TAILLE_PAQUET = int(sys.argv[1]) if len(sys.argv) > 1 else 65500 - 48
+    NB_FICHIERS = 100000
+    for taille in (100, 1000, TAILLE_MAX_FICHIER):
+        contenu = os.urandom(taille)
+        noms = [("data/projet%03d/fichier%06d.txt" % (i % 1000, i)).encode() for i in range(NB_FICHIERS)]
+        lot = Lot(TAILLE_PAQUET)
+        lots = []
+        debut = time.time()
+        for nom in noms:
+            crc32 = binascii.crc32(contenu)
+            if crc32 > 0x7FFFFFFF:
+                crc32 -= 0x100000000
+            if not lot.ajouter(nom, contenu, 0, crc32):
+                lots.append(lot.octets())
+                lot.vider()
+                lot.ajouter(nom, contenu, 0, crc32)
+        lots.append(lot.octets())
+        duree_construction = time.time() - debut
+        debut = time.time()
+        nb = sum(1 for donnees in lots for fichier in lire(donnees))
+        duree_lecture = time.time() - debut
+        assert nb == NB_FICHIERS
+        print(
+            "fichiers de %4d octets: %3d par paquet, %d paquets au lieu de %d, construction %.0f fichiers/s, "
+            "lecture %.0f fichiers/s"
+            % (
+                taille,
+                NB_FICHIERS // len(lots),
+                len(lots),
+                NB_FICHIERS,
+                NB_FICHIERS / duree_construction,
+                NB_FICHIERS / duree_lecture,
+            )
+        )
@@ -0,0 +1,157 @@
+#!/usr/local/bin/python
+# -*- coding: latin-1 -*-
+"""
+----------------------------------------------------------------------------
+CRC: combination of CRC32 checksums computed on consecutive chunks.
+----------------------------------------------------------------------------
+
+The CRC32 of the concatenation A+B can be computed from crc32(A), crc32(B)
+and len(B) only, as zlib's crc32_combine() does: the receiver computes the
+CRC32 of each chunk when it arrives, and the CRC32 of the whole file is
+obtained at the end without reading the file again.
+
+CRC32 is linear on GF(2): appending n zero bytes to A multiplies its CRC
+register by a 32x32 bit matrix, and crc32(A+B) is that product XOR crc32(B).
+As the chunks of a file all have the same size, the matrix is computed once
+and applied with 4 lookup tables of 256 entries (one per byte of the CRC).
+
+The sender can also put the CRC32 of each chunk in its packet (extension of
+the PACKAGE_FILE_CRC packets): a corrupted payload is then dropped on
+arrival, instead of failing the check of the whole file. FEC parities and
+fountain symbols carry the CRC32 of their data the same way (after their
+own extension, PACKAGE_FEC_CRC and PACKAGE_FOUNTAIN_CRC packets), so that a
+corrupted one does not rebuild wrong chunks.
+"""
+
+# === IMPORTS ==================================================================
+
+import struct
+
+# === CONSTANTES ===============================================================
+
+POLYNOME = 0xEDB88320  # CRC32 polynomial (reflected), as binascii/zlib
+
+# Extension of the file packets with a checksum, between the file name and the data:
+# - CRC32 des donnees du paquet: uint32=I
+FORMAT_EXTENSION = "I"
+EXTENSION = struct.Struct(FORMAT_EXTENSION)
+TAILLE_EXTENSION = EXTENSION.size
+
+# ------------------------------------------------------------------------------
+# GF(2) matrices: a matrix is the list of the images of the 32 bits
+# -------------------
+
+
+def _appliquer(matrice, vecteur):
+    "Return the product of a matrix by a 32-bit vector."
+    resultat = 0
+    i = 0
+    while vecteur:
+        if vecteur & 1:
+            resultat ^= matrice[i]
+        vecteur >>= 1
+        i += 1
+    return resultat
+
+
+def _composer(a, b):
+    "Return the matrix of a applied after b."
+    return [_appliquer(a, colonne) for colonne in b]
+
+
+def _matrice_zeros(longueur):
+    "Return the matrix appending longueur zero bytes to the CRC register."
+    # un bit nul: decalage d'un bit, avec reduction par le polynome
+    puissance = [POLYNOME] + [1 << (i - 1) for i in range(1, 32)]
+    # un octet nul: 8 bits nuls
+    for i in range(3):
+        puissance = _composer(puissance, puissance)
+    resultat = [1 << i for i in range(32)]
+    while longueur:
+        if longueur & 1:
+            resultat = _composer(puissance, resultat)
+        longueur >>= 1
+        if longueur:
+            puissance = _composer(puissance, puissance)
+    return resultat
+
+
+# ------------------------------------------------------------------------------
+# classe Combinaison
+# -------------------
+
+
+class Combinaison:
+    """Combination of CRC32 with a fixed size of the second chunk."""
+
+    def __init__(self, longueur):
+        """Combinaison constructor.
+
+        longueur: size in bytes of the chunk appended (len(B))"""
+        self.longueur = longueur
+        matrice = _matrice_zeros(longueur)
+        self.tables = [[_appliquer(matrice, octet << (8 * j)) for octet in range(256)] for j in range(4)]
+
+    def combiner(self, crc1, crc2):
+        "Return crc32(A+B) from crc1 = crc32(A) and crc2 = crc32(B)."
+        t0, t1, t2, t3 = self.tables
+        crc1 &= 0xFFFFFFFF
+        return t0[crc1 & 0xFF] ^ t1[crc1 >> 8 & 0xFF] ^ t2[crc1 >> 16 & 0xFF] ^ t3[crc1 >> 24] ^ (crc2 & 0xFFFFFFFF)
+
+
+_combinaisons = {}
+
+
+def crc32_combine(crc1, crc2, longueur2):
+    """Return crc32(A+B) from crc1 = crc32(A), crc2 = crc32(B) and
+    longueur2 = len(B), like zlib's crc32_combine()."""
+    combinaison = _combinaisons.get(longueur2)
+    if combinaison is None:
+        combinaison = _combinaisons[longueur2] = Combinaison(longueur2)
+    return combinaison.combiner(crc1, crc2)
+
+
+def crc32_paquets(crcs, taille_paquet, taille_fichier):
+    """Return the CRC32 of a file from the CRC32 of its chunks (all of
+    taille_paquet bytes, except the last one)."""
+    if not crcs:
+        return 0
+    crc = crcs[0]
+    if len(crcs) == 1:
+        return crc
+    combinaison = Combinaison(taille_paquet)
+    combiner = combinaison.combiner
+    for n in range(1, len(crcs) - 1):
+        crc = combiner(crc, crcs[n])
+    return crc32_combine(crc, crcs[-1], taille_fichier - (len(crcs) - 1) * taille_paquet)
+
+
+if __name__ == "__main__":
+    # verification, et comparaison avec une relecture complete du fichier
+    import sys, os, time, binascii
+
+    for la, lb in ((0, 0), (1, 0), (0, 7), (100, 1), (65452, 65452), (3, 1000000)):
+        a, b = os.urandom(la), os.urandom(lb)
+        assert crc32_combine(binascii.crc32(a), binascii.crc32(b), lb) == binascii.crc32(a + b)
+
+    TAILLE_PAQUET = 65452
+    NB_PAQUETS = int(sys.argv[1]) if len(sys.argv) > 1 else 16000  # ~1 Go
+    paquet = os.urandom(TAILLE_PAQUET)
+    dernier = paquet[:1234]
+    crcs = [binascii.crc32(paquet)] * (NB_PAQUETS - 1) + [binascii.crc32(dernier)]
+    taille = TAILLE_PAQUET * (NB_PAQUETS - 1) + len(dernier)
+
+    debut = time.time()
+    crc = 0
+    for n in range(NB_PAQUETS - 1):
+        crc = binascii.crc32(paquet, crc)
+    crc = binascii.crc32(dernier, crc)
+    duree_lecture = time.time() - debut
+
+    debut = time.time()
+    assert crc32_paquets(crcs, TAILLE_PAQUET, taille) == crc
+    duree_combinaison = time.time() - debut
+    print(
+        "%d Mo: CRC32 sur les donnees %.2fs (sans les E/S), combinaison %.3fs"
+        % (taille // 1000000, duree_lecture, duree_combinaison)
+    )
@@ -0,0 +1,158 @@
+#!/usr/local/bin/python
+# -*- coding: latin-1 -*-
+"""
+----------------------------------------------------------------------------
+Codec: precompiled, zero-copy decoding of BFTP packets.
+----------------------------------------------------------------------------
+
+Used by bftp.py: the header format is compiled once with struct.Struct,
+decoded in place with unpack_from, and the file data is handed out as a
+memoryview on the received datagram instead of a copy. Debug lines are only formatted when tracing is enabled.
+"""
+
+# === IMPORTS ==================================================================
+
+import struct, time
+
+# === CONSTANTES ===============================================================
+
+# Names of the header fields (common to formats v3 and v4), in packing order
+CHAMPS_ENTETE = (
+    "type_paquet",
+    "longueur_nom",
+    "taille_donnees",
+    "offset",
+    "num_session",
+    "num_paquet_session",
+    "num_paquet",
+    "nb_paquets",
+    "taille_fichier",
+    "date_fichier",
+    "crc32",
+)
+
+# ------------------------------------------------------------------------------
+# classe Codec
+# -------------------
+
+
+class Codec:
+    """Decoder for the BFTP packet header, compiled once for a header format."""
+
+    def __init__(self, format_entete):
+        """Codec constructor.
+
+        format_entete: struct format of the header (cf. FORMAT_ENTETE)"""
+        self.entete = struct.Struct(format_entete)
+        self.taille_entete = self.entete.size
+
+    def decoder_entete(self, paquet, cible):
+        """Decode the header of the datagram paquet into the attributes of the
+        object cible (a Pack), without slicing the datagram."""
+        (
+            cible.type_paquet,
+            cible.longueur_nom,
+            cible.taille_donnees,
+            cible.offset,
+            cible.num_session,
+            cible.num_paquet_session,
+            cible.num_paquet,
+            cible.nb_paquets,
+            cible.taille_fichier,
+            cible.date_fichier,
+            cible.crc32,
+        ) = self.entete.unpack_from(paquet, 0)
+
+    def nom(self, paquet, longueur_nom):
+        """Return the file name field of the datagram (a small copy, as bytes)."""
+        return memoryview(paquet)[self.taille_entete : self.taille_entete + longueur_nom].tobytes()
+
+    def donnees(self, paquet, longueur_nom, taille_extension=0):
+        """Return the file data of the datagram as a memoryview (no copy).
+
+        taille_extension: size of the packet type extension following the name"""
+        return memoryview(paquet)[self.taille_entete + longueur_nom + taille_extension :]
+
+    def trace(self, cible):
+        """Return the debug lines describing a decoded header.
+        To be called only when tracing is enabled."""
+        return [
+            "type_paquet        = %d" % cible.type_paquet,
+            "longueur_nom       = %d" % cible.longueur_nom,
+            "taille_donnees     = %d" % cible.taille_donnees,
+            "offset             = %d" % cible.offset,
+            "num_session        = %d" % cible.num_session,
+            "num_paquet_session = %d" % cible.num_paquet_session,
+            "num_paquet         = %d" % cible.num_paquet,
+            "nb_paquets         = %d" % cible.nb_paquets,
+            "taille_fichier     = %d" % cible.taille_fichier,
+            "date_fichier       = %s" % time.strftime("%d/%m/%Y %H:%M:%S", time.localtime(cible.date_fichier)),
+            "CRC32              = %08X" % (cible.crc32 & 0xFFFFFFFF),
+        ]
+
+
+if __name__ == "__main__":
+    # micro-benchmark: paquets decodes par seconde, avant / apres
+    import sys
+
+    FORMAT = "BBHQIIIIQIi"
+    TAILLE_ENTETE = struct.calcsize(FORMAT)
+    MODE_DEBUG = False
+    nom = b"repertoire/sous-repertoire/fichier.iso"
+    data_size = 65500 - TAILLE_ENTETE - len(nom)
+    paquet = struct.pack(FORMAT, 0, len(nom), data_size, 0, 1, 2, 3, 4, 10**9, 1200000000, 5) + nom + b"x" * data_size
+    N = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    class Paquet:
+        pass
+
+    def debug(texte):
+        if MODE_DEBUG:
+            print("DEBUG:" + texte)
+
+    def avant(p, paquet):
+        entete = paquet[0:TAILLE_ENTETE]
+        (
+            p.type_paquet,
+            p.longueur_nom,
+            p.taille_donnees,
+            p.offset,
+            p.num_session,
+            p.num_paquet_session,
+            p.num_paquet,
+            p.nb_paquets,
+            p.taille_fichier,
+            p.date_fichier,
+            p.crc32,
+        ) = struct.unpack(FORMAT, entete)
+        debug("type_paquet        = %d" % p.type_paquet)
+        debug("longueur_nom       = %d" % p.longueur_nom)
+        debug("taille_donnees     = %d" % p.taille_donnees)
+        debug("offset             = %d" % p.offset)
+        debug("num_session        = %d" % p.num_session)
+        debug("num_paquet_session = %d" % p.num_paquet_session)
+        debug("num_paquet         = %d" % p.num_paquet)
+        debug("nb_paquets         = %d" % p.nb_paquets)
+        debug("taille_fichier     = %d" % p.taille_fichier)
+        debug("date_fichier       = %s" % time.strftime("%d/%m/%Y %H:%M:%S", time.localtime(p.date_fichier)))
+        debug("CRC32              = %08X" % p.crc32)
+        p.nom_fichier = paquet[TAILLE_ENTETE : TAILLE_ENTETE + p.longueur_nom]
+        p.donnees = paquet[TAILLE_ENTETE + p.longueur_nom : len(paquet)]
+
+    codec = Codec(FORMAT)
+
+    def apres(p, paquet):
+        codec.decoder_entete(paquet, p)
+        if MODE_DEBUG:
+            for ligne in codec.trace(p):
+                debug(ligne)
+        p.nom_fichier = codec.nom(paquet, p.longueur_nom)
+        p.donnees = codec.donnees(paquet, p.longueur_nom)
+
+    for fonction in (avant, apres):
+        p = Paquet()
+        debut = time.time()
+        for i in range(N):
+            fonction(p, paquet)
+        duree = time.time() - debut
+        print("%-6s: %9d paquets decodes/s" % (fonction.__name__, N / duree))
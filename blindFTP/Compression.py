@@ -0,0 +1,197 @@
+#!/usr/local/bin/python
+# -*- coding: latin-1 -*-
+"""
+----------------------------------------------------------------------------
+Compression: compressed transmission of BFTP files (zlib or lzma).
+----------------------------------------------------------------------------
+
+The sender compresses the whole file once (stream compression, to a
+temporary file), and sends the compressed stream instead of the file: the
+size, CRC32 and packets of the header are those of the compressed stream,
+so packets, FEC, fountain and checksums are unchanged. The compression
+method is flagged in the high bits of the packet type, and an extension
+gives the size of the original file. The receiver checks the compressed
+stream as any file, then decompresses it when putting it in place.
+
+Compressing is only worth it on compressible content (logs, XML...): a few
+samples of the file are compressed first, and content already compressed
+(zip, jpg, iso...) is sent raw.
+"""
+
+# === IMPORTS ==================================================================
+
+import struct, zlib, lzma, binascii
+
+# === CONSTANTES ===============================================================
+
+# Compression method, in the high bits of the packet type
+ZLIB = 0x40
+LZMA = 0x80
+MASQUE = ZLIB | LZMA
+METHODES = {"zlib": ZLIB, "lzma": LZMA}
+
+NIVEAU_ZLIB = 6  # zlib compression level
+PRESET_LZMA = 6  # lzma compression preset
+
+NB_ECHANTILLONS = 4  # Number of samples compressed to decide if a file is compressible
+TAILLE_ECHANTILLON = 64 * 1024  # Size of a sample (bytes)
+TAUX_MAX = 0.9  # Max ratio compressed/original size of the samples to compress a file
+TAILLE_BLOC = 1024 * 1024  # Size of the blocks read to compress or decompress (bytes)
+
+# Extension of the compressed file packets, between the file name and the
+# extension of the packet type (if any):
+# - taille du fichier original: Long Long=Q
+FORMAT_EXTENSION = "Q"
+EXTENSION = struct.Struct(FORMAT_EXTENSION)
+TAILLE_EXTENSION = EXTENSION.size
+
+# ------------------------------------------------------------------------------
+# compression / decompression
+# -------------------
+
+
+def compresseur(methode):
+    "Return a compressor object (compress/flush) for the method ZLIB or LZMA."
+    if methode == LZMA:
+        return lzma.LZMACompressor(lzma.FORMAT_XZ, preset=PRESET_LZMA)
+    return zlib.compressobj(NIVEAU_ZLIB)
+
+
+def decompresseur(methode):
+    "Return a decompressor object (decompress) for the method ZLIB or LZMA."
+    if methode == LZMA:
+        return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+    return zlib.decompressobj()
+
+
+def compressible(nom_fichier, taille_fichier):
+    """Return True if the file looks compressible: NB_ECHANTILLONS samples,
+    spread over the file, are compressed with zlib (fast level)."""
+    if taille_fichier <= NB_ECHANTILLONS * TAILLE_ECHANTILLON:
+        # petit fichier: un seul echantillon, le fichier entier
+        echantillons = [(0, taille_fichier)]
+    else:
+        pas = (taille_fichier - TAILLE_ECHANTILLON) // (NB_ECHANTILLONS - 1)
+        echantillons = [(i * pas, TAILLE_ECHANTILLON) for i in range(NB_ECHANTILLONS)]
+    taille = taille_compressee = 0
+    with open(nom_fichier, "rb") as f:
+        for position, longueur in echantillons:
+            f.seek(position)
+            echantillon = f.read(longueur)
+            taille += len(echantillon)
+            taille_compressee += len(zlib.compress(echantillon, 1))
+    return taille > 0 and taille_compressee <= TAUX_MAX * taille
+
+
+def compresser(source, destination, methode):
+    """Compress the file source into the file destination.
+    Return the size and the CRC32 of the compressed file."""
+    c = compresseur(methode)
+    taille = crc32 = 0
+    with open(source, "rb") as f, open(destination, "wb") as sortie:
+        while True:
+            bloc = f.read(TAILLE_BLOC)
+            donnees = c.compress(bloc) if bloc else c.flush()
+            crc32 = binascii.crc32(donnees, crc32)
+            taille += len(donnees)
+            sortie.write(donnees)
+            if not bloc:
+                break
+    return taille, crc32
+
+
+def decompresser(source, destination, methode):
+    """Decompress the file source into the file destination.
+    Return the size of the decompressed file, raise ValueError if the
+    compressed stream is incorrect or truncated."""
+    d = decompresseur(methode)
+    taille = 0
+    with open(source, "rb") as f, open(destination, "wb") as sortie:
+        try:
+            while True:
+                bloc = f.read(TAILLE_BLOC)
+                if not bloc:
+                    break
+                donnees = d.decompress(bloc)
+                taille += len(donnees)
+                sortie.write(donnees)
+        except (zlib.error, lzma.LZMAError) as e:
+            raise ValueError("donnees compressees incorrectes: %s" % e)
+    if not d.eof:
+        raise ValueError("donnees compressees tronquees")
+    return taille
+
+
+if __name__ == "__main__":
+    # taux de compression et vitesse sur des journaux, du XML et des donnees aleatoires
+    import sys, os, time, random, tempfile
+
+    TAILLE = int(sys.argv[1]) if len(sys.argv) > 1 else 16 * 1024 * 1024
+    alea = random.Random(1)
+    mots = ["INFO", "WARNING", "ERROR", "session", "paquet", "fichier", "recu", "envoi", "port", "debit"]
+
+    def journal(taille):
+        lignes = []
+        n = 0
+        while n < taille:
+            ligne = "2026-10-18 %02d:%02d:%02d,%03d - %s - %s %d\n" % (
+                alea.randrange(24),
+                alea.randrange(60),
+                alea.randrange(60),
+                alea.randrange(1000),
+                alea.choice(mots[:3]),
+                " ".join(alea.choice(mots) for i in range(6)),
+                alea.randrange(100000),
+            )
+            lignes.append(ligne)
+            n += len(ligne)
+        return "".join(lignes).encode()[:taille]
+
+    def xml(taille):
+        elements = []
+        n = 0
+        while n < taille:
+            e = '<file name="f%d.bin" size="%d" mtime="%d" crc="%08X"/>\n' % (
+                alea.randrange(10**6),
+                alea.randrange(10**9),
+                alea.randrange(2 * 10**9),
+                alea.getrandbits(32),
+            )
+            elements.append(e)
+            n += len(e)
+        return "".join(elements).encode()[:taille]
+
+    repertoire = tempfile.mkdtemp(prefix="BFTP_z_")
+    print("%d Mo par fichier" % (TAILLE // (1024 * 1024)))
+    print("contenu     compressible  methode  taux   compression   decompression")
+    for nom, contenu in (("journal", journal), ("xml", xml), ("aleatoire", os.urandom)):
+        source = os.path.join(repertoire, nom)
+        with open(source, "wb") as f:
+            f.write(contenu(TAILLE))
+        debut = time.time()
+        oui = compressible(source, TAILLE)
+        duree_echantillons = time.time() - debut
+        for methode in ("zlib", "lzma"):
+            compresse = source + "." + methode
+            debut = time.time()
+            taille, crc32 = compresser(source, compresse, METHODES[methode])
+            duree_compression = time.time() - debut
+            debut = time.time()
+            assert decompresser(compresse, source + ".dec", METHODES[methode]) == TAILLE
+            duree_decompression = time.time() - debut
+            print(
+                "%-10s %4s (%.1fms)  %-7s %5.1f%%  %6.1f Mo/s   %6.1f Mo/s"
+                % (
+                    nom,
+                    "oui" if oui else "non",
+                    1000 * duree_echantillons,
+                    methode,
+                    100 * taille / TAILLE,
+                    TAILLE / duree_compression / 1e6,
+                    TAILLE / duree_decompression / 1e6,
+                )
+            )
+            for f in (compresse, source + ".dec"):
+                os.remove(f)
+        os.remove(source)
+    os.rmdir(repertoire)
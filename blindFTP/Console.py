@@ -110,7 +110,7 @@ def Print_temp (chaine, taille_max=79, NL=False):
 	if lc > taille_max:
 		# si la chaine est trop longue, on la coupe en 2 et on ajoute
 		# "..." au milieu
-		l1 = (taille_max - 3) / 2
+		l1 = (taille_max - 3) // 2
 		l2 = taille_max - l1 - 3
 		chaine = chaine[0:l1] + "..." + chaine[lc-l2:lc]
 		lc = len(chaine)
@@ -0,0 +1,381 @@
+#!/usr/local/bin/python
+# -*- coding: latin-1 -*-
+"""
+----------------------------------------------------------------------------
+Dedup: content-defined chunking and chunk store for BFTP files.
+----------------------------------------------------------------------------
+
+The sender cuts a file in chunks whose boundaries depend on the content
+only: an insertion or a deletion moves the boundaries near the change, the
+other chunks are unchanged. Each chunk is sent once as a BFTP file of the
+chunk store (REPERTOIRE_MORCEAUX/ab/abcd..., named by its SHA-1), and the
+file itself as a recipe (REPERTOIRE_RECETTES/<file>: size, date, CRC32 and
+list of the chunks). The receiver assembles the file from its chunk store
+once all the chunks of the recipe are received, then deletes the recipe.
+
+The sender keeps the number of sends of each chunk (FICHIER_ENVOYES): as a
+whole file, a chunk is sent until it has been sent a minimum number of
+times (the link is one-way, no acknowledgement), then only the recipes of
+the files using it are sent, except on the last of the MinFileRedundancy
+sends of a recipe: all its chunks are sent again, for a receiver which
+missed one of them. On the other sends, versions of a VM image, rotated
+archives or renamed copies only cost their new chunks.
+
+The receiver keeps the chunks for the next versions: its store grows with
+each distinct chunk received. purger_magasin deletes the chunks that no
+waiting recipe references. The chunks of the next versions already sent are
+then only received on the last send of their recipes, unless the sender
+deletes FICHIER_ENVOYES.
+
+Boundaries: a rolling hash over the last FENETRE bytes, the sum of a fixed
+pseudo-random value per byte (as the weak checksum of rsync), and a boundary
+where its low BITS_FRONTIERE bits are zero. As in FastCDC, the first
+TAILLE_MIN bytes of a chunk are not hashed. A rolling hash computed byte by
+byte in Python would be far slower than the link: the sums of a block are
+computed at once instead (cf. sommes_glissantes), each byte spread to a
+lane of 4 bytes of a big integer, summed with its shifted copies. Runs of
+zeros (sparse images) never give a boundary and are cut at TAILLE_MAX.
+"""
+
+# === IMPORTS ==================================================================
+
+import os, struct, hashlib, binascii, threading
+
+# === CONSTANTES ===============================================================
+
+TAILLE_MIN = 128 * 1024  # Min size of a chunk (bytes)
+TAILLE_MAX = 2 * 1024 * 1024  # Max size of a chunk (bytes)
+FENETRE = 32  # Size of the window of the rolling hash (bytes, power of 2)
+BITS_FRONTIERE = 19  # Low bits of the rolling hash zero at a boundary (~512 KB between two boundaries)
+TAILLE_HACHAGE = 256 * 1024  # Size of the blocks whose rolling hashes are computed at once (bytes)
+TAILLE_LECTURE = 8 * 1024 * 1024  # Size of the blocks read from the file (bytes)
+
+# Directories of the chunk store and of the recipes, in the destination directory
+REPERTOIRE_MORCEAUX = ".bftp_store"
+REPERTOIRE_RECETTES = ".bftp_recipes"
+# Number of sends of each chunk, kept by the sender in its working directory
+FICHIER_ENVOYES = "BFTPchunks.idx"
+
+# Recipe: header, followed by one entry per chunk (little endian: the recipe
+# is read on another system)
+# - taille du fichier: Long Long=Q
+# - date du fichier: uint32=I
+# - CRC32 du fichier: int32=i (signe, comme dans l'entete des paquets)
+# - nombre de morceaux: uint32=I
+ENTETE_RECETTE = struct.Struct("<QIiI")
+# - SHA-1 du morceau: 20s
+# - taille du morceau: uint32=I
+MORCEAU_RECETTE = struct.Struct("<20sI")
+# Record of FICHIER_ENVOYES: SHA-1 and number of sends (added)
+ENREGISTREMENT_ENVOYES = struct.Struct("<20sB")
+
+# value of each byte in the rolling hash: 27 bits of its SHA-1, so that the sum of
+# FENETRE values fits in a lane of 4 bytes (fixed forever: the boundaries must not
+# change from one version to the other)
+VALEURS = [int.from_bytes(hashlib.sha1(bytes([i])).digest()[:4], "little") & 0x7FFFFFF for i in range(256)]
+# tables of bytes.translate giving each byte of the lanes
+OCTETS_VALEURS = [bytes((v >> (8 * k)) & 0xFF for v in VALEURS) for k in range(4)]
+# low bits of the last byte of the lanes tested for a boundary
+MASQUE_FRONTIERE = bytes(i & ((1 << BITS_FRONTIERE % 8) - 1) for i in range(256))
+
+# ------------------------------------------------------------------------------
+# decoupage
+# -------------------
+
+
+def sommes_glissantes(bloc):
+    """Return, for each byte of bloc, a byte which is zero if the rolling hash
+    of the FENETRE bytes ending with it gives a boundary (only meaningful from
+    the byte FENETRE - 1 on)."""
+    n = len(bloc)
+    couloirs = bytearray(4 * n)
+    for k in range(4):
+        couloirs[k::4] = bloc.translate(OCTETS_VALEURS[k])
+    # couloir i: somme des valeurs des octets i - FENETRE + 1 a i, par doublements
+    # (les sommes ne debordent pas d'un couloir sur le suivant)
+    sommes = int.from_bytes(couloirs, "little")
+    decalage = 32
+    while decalage < 32 * FENETRE:
+        sommes += sommes << decalage
+        decalage *= 2
+    couloirs = sommes.to_bytes(4 * (n + FENETRE), "little")
+    # BITS_FRONTIERE bits de poids faible de chaque couloir, reunis par un ou
+    octets, reste = divmod(BITS_FRONTIERE, 8)
+    frontieres = int.from_bytes(couloirs[octets : 4 * n : 4].translate(MASQUE_FRONTIERE), "little") if reste else 0
+    for k in range(octets):
+        frontieres |= int.from_bytes(couloirs[k : 4 * n : 4], "little")
+    return frontieres.to_bytes(n, "little")
+
+
+def taille_morceau(tampon):
+    """Return the size of the first chunk of tampon (more than TAILLE_MIN bytes):
+    up to the first boundary after TAILLE_MIN, at most TAILLE_MAX."""
+    fin = min(len(tampon), TAILLE_MAX)
+    debut = TAILLE_MIN
+    while debut < fin:
+        # taille du morceau si la fenetre finissant a l'octet j du bloc donne une frontiere:
+        # debut - FENETRE + j + 1
+        fin_bloc = min(debut + TAILLE_HACHAGE, fin)
+        j = sommes_glissantes(bytes(tampon[debut - FENETRE : fin_bloc])).find(b"\0", FENETRE - 1)
+        if j >= 0:
+            return debut - FENETRE + j + 1
+        debut = fin_bloc + 1
+    return fin
+
+
+def decouper(f):
+    """Generate the chunks of the file f (opened in binary mode, read up to
+    its end), as bytes."""
+    tampon = bytearray()
+    fin = False
+    while True:
+        while not fin and len(tampon) < TAILLE_MAX:
+            bloc = f.read(TAILLE_LECTURE)
+            if bloc:
+                tampon += bloc
+            else:
+                fin = True
+        if len(tampon) <= TAILLE_MIN:
+            if tampon:
+                yield bytes(tampon)
+            return
+        taille = taille_morceau(tampon)
+        yield bytes(tampon[:taille])
+        del tampon[:taille]
+
+
+def empreinte(morceau):
+    "Return the SHA-1 of a chunk."
+    return hashlib.sha1(morceau).digest()
+
+
+def chemin_morceau(sha1):
+    "Return the path of a chunk in the destination directory (with / separators)."
+    nom = sha1.hex()
+    return "%s/%s/%s" % (REPERTOIRE_MORCEAUX, nom[:2], nom)
+
+
+def chemin_recette(nom_fichier):
+    "Return the path of the recipe of a file in the destination directory."
+    return "%s/%s" % (REPERTOIRE_RECETTES, str(nom_fichier).replace("\\", "/"))
+
+
+def nom_recette(chemin):
+    "Return the file of a recipe path, or None if it is not a recipe."
+    prefixe = REPERTOIRE_RECETTES + "/"
+    chemin = chemin.replace("\\", "/")
+    if chemin.startswith(prefixe):
+        return chemin[len(prefixe) :]
+    return None
+
+
+def sha1_morceau(chemin):
+    "Return the SHA-1 of a chunk path, or None if it is not a chunk of the store."
+    parties = chemin.replace("\\", "/").split("/")
+    if len(parties) == 3 and parties[0] == REPERTOIRE_MORCEAUX:
+        try:
+            return bytes.fromhex(parties[2])
+        except ValueError:
+            pass
+    return None
+
+
+def est_interne(chemin):
+    "Return True if the path is in the chunk store or in the recipes."
+    return chemin.replace("\\", "/").split("/")[0] in (REPERTOIRE_MORCEAUX, REPERTOIRE_RECETTES)
+
+
+# ------------------------------------------------------------------------------
+# recettes
+# -------------------
+
+
+def ecrire_recette(nom, taille, date, crc32, morceaux):
+    """Write a recipe file.
+
+    morceaux: list of (SHA-1, size) of the chunks, in order"""
+    with open(nom, "wb") as f:
+        f.write(ENTETE_RECETTE.pack(taille, date, crc32, len(morceaux)))
+        for sha1, taille_morceau in morceaux:
+            f.write(MORCEAU_RECETTE.pack(sha1, taille_morceau))
+
+
+def lire_recette(nom):
+    """Read a recipe file: return (size, date, CRC32, list of (SHA-1, size)).
+    Raise ValueError if the recipe is incorrect."""
+    with open(nom, "rb") as f:
+        contenu = f.read()
+    if len(contenu) < ENTETE_RECETTE.size:
+        raise ValueError("recette tronquee")
+    taille, date, crc32, nb_morceaux = ENTETE_RECETTE.unpack_from(contenu, 0)
+    if len(contenu) != ENTETE_RECETTE.size + nb_morceaux * MORCEAU_RECETTE.size:
+        raise ValueError("taille de recette incorrecte")
+    morceaux = list(MORCEAU_RECETTE.iter_unpack(contenu[ENTETE_RECETTE.size :]))
+    if sum(m[1] for m in morceaux) != taille:
+        raise ValueError("recette incoherente")
+    return taille, date, crc32, morceaux
+
+
+def assembler(morceaux, repertoire, destination):
+    """Write the file destination from the chunks of the store of the
+    directory repertoire. Return its CRC32."""
+    crc32 = 0
+    with open(destination, "wb") as sortie:
+        for sha1, taille in morceaux:
+            with open(os.path.join(repertoire, chemin_morceau(sha1)), "rb") as f:
+                donnees = f.read()
+            if len(donnees) != taille:
+                raise ValueError("taille de morceau incorrecte")
+            crc32 = binascii.crc32(donnees, crc32)
+            sortie.write(donnees)
+    return crc32
+
+
+def purger_magasin(repertoire):
+    """Delete the chunks of the store of the directory repertoire that no
+    recipe (waiting for chunks) references. Return the number of chunks and
+    of bytes deleted."""
+    references = set()
+    for racine, repertoires, fichiers in os.walk(os.path.join(repertoire, REPERTOIRE_RECETTES)):
+        for nom in fichiers:
+            try:
+                references.update(sha1 for sha1, taille in lire_recette(os.path.join(racine, nom))[3])
+            except (OSError, ValueError):
+                # recette incorrecte: elle ne sera jamais assemblee
+                pass
+    nb_morceaux = octets = 0
+    for racine, repertoires, fichiers in os.walk(os.path.join(repertoire, REPERTOIRE_MORCEAUX)):
+        for nom in fichiers:
+            try:
+                if bytes.fromhex(nom) in references:
+                    continue
+            except ValueError:
+                pass
+            chemin = os.path.join(racine, nom)
+            try:
+                taille = os.path.getsize(chemin)
+                os.remove(chemin)
+            except OSError:
+                continue
+            nb_morceaux += 1
+            octets += taille
+    return nb_morceaux, octets
+
+
+# ------------------------------------------------------------------------------
+# classe Envoyes
+# -------------------
+
+
+class Envoyes:
+    """Number of sends of each chunk, kept by the sender in a file where each
+    send is added at the end (compacted when read)."""
+
+    def __init__(self, nom=FICHIER_ENVOYES):
+        """Envoyes constructor.
+
+        nom: file where the sends are recorded"""
+        self.nom = nom
+        self.compteurs = {}  # SHA-1 -> nombre d'envois
+        self.fichier = None
+        self.verrou = threading.Lock()
+        self.charger()
+
+    def charger(self):
+        "Read the recorded sends, then rewrite them compacted."
+        try:
+            with open(self.nom, "rb") as f:
+                contenu = f.read()
+        except OSError:
+            return
+        taille = ENREGISTREMENT_ENVOYES.size
+        # un enregistrement tronque (arret pendant l'ecriture) est ignore
+        fin = len(contenu) - len(contenu) % taille
+        for sha1, nb in ENREGISTREMENT_ENVOYES.iter_unpack(contenu[:fin]):
+            self.compteurs[sha1] = min(255, self.compteurs.get(sha1, 0) + nb)
+        if len(self.compteurs) * taille < len(contenu):
+            temp = self.nom + ".tmp"
+            with open(temp, "wb") as f:
+                for sha1, nb in self.compteurs.items():
+                    f.write(ENREGISTREMENT_ENVOYES.pack(sha1, nb))
+            os.replace(temp, self.nom)
+
+    def nb_envois(self, sha1):
+        "Return the number of sends of a chunk."
+        return self.compteurs.get(sha1, 0)
+
+    def compter(self, sha1):
+        "Record a send of a chunk."
+        with self.verrou:
+            self.compteurs[sha1] = min(255, self.compteurs.get(sha1, 0) + 1)
+            if self.fichier is None:
+                self.fichier = open(self.nom, "ab")
+            self.fichier.write(ENREGISTREMENT_ENVOYES.pack(sha1, 1))
+            self.fichier.flush()
+
+
+if __name__ == "__main__":
+    # decoupage d'une image et d'une nouvelle version (insertions, suppressions,
+    # modifications): octets a envoyer pour la nouvelle version, et vitesse; puis
+    # d'un journal texte avec une ligne inseree au debut
+    import sys, time, io, random
+
+    TAILLE = int(sys.argv[1]) if len(sys.argv) > 1 else 64 * 1024 * 1024
+    NB_MODIFICATIONS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    alea = random.Random(1)
+    # image: donnees aleatoires, texte repetitif et zones de zeros
+    parties = []
+    taille = 0
+    while taille < TAILLE:
+        genre = alea.randrange(3)
+        longueur = alea.randrange(64 * 1024, 4 * 1024 * 1024)
+        if genre == 0:
+            partie = os.urandom(longueur)
+        elif genre == 1:
+            partie = b"".join(b"ligne %d de journal: %d\n" % (i, alea.randrange(1000)) for i in range(longueur // 24))
+        else:
+            partie = bytes(longueur)
+        parties.append(partie)
+        taille += len(partie)
+    image = b"".join(parties)[:TAILLE]
+    nouvelle = bytearray(image)
+    for i in range(NB_MODIFICATIONS):
+        position = alea.randrange(len(nouvelle))
+        action = alea.randrange(3)
+        if action == 0:
+            nouvelle[position:position] = os.urandom(alea.randrange(1, 5000))
+        elif action == 1:
+            del nouvelle[position : position + alea.randrange(1, 5000)]
+        else:
+            nouvelle[position : position + 100] = os.urandom(100)
+
+    debut = time.time()
+    connus = set(empreinte(m) for m in decouper(io.BytesIO(image)))
+    duree = time.time() - debut
+    morceaux = list(decouper(io.BytesIO(bytes(nouvelle))))
+    nouveaux = [m for m in morceaux if empreinte(m) not in connus]
+    tailles = [len(m) for m in morceaux]
+    print("image de %d Mo: decoupage et SHA-1 a %.0f Mo/s" % (TAILLE // 1000000, TAILLE / duree / 1e6))
+    print(
+        "%d morceaux (min %d Ko, moyenne %d Ko, max %d Ko)"
+        % (len(morceaux), min(tailles) // 1024, sum(tailles) // len(tailles) // 1024, max(tailles) // 1024)
+    )
+    print(
+        "nouvelle version avec %d modifications: %d nouveaux morceaux, %.1f%% des octets a envoyer"
+        % (NB_MODIFICATIONS, len(nouveaux), 100 * sum(len(m) for m in nouveaux) / len(nouvelle))
+    )
+
+    journal = b"".join(
+        b"2024-01-%02d 12:%02d:%02d INFO session %d: %d octets recus de 10.0.%d.%d\n"
+        % (1 + i % 28, i % 60, i % 60, i, alea.randrange(100000), alea.randrange(256), alea.randrange(256))
+        for i in range(TAILLE // 64)
+    )
+    connus = set(empreinte(m) for m in decouper(io.BytesIO(journal)))
+    morceaux = list(decouper(io.BytesIO(b"2024-01-01 00:00:00 INFO demarrage\n" + journal)))
+    nouveaux = [m for m in morceaux if empreinte(m) not in connus]
+    taux = sum(len(m) for m in nouveaux) / len(journal)
+    print(
+        "journal de %d Mo, une ligne inseree au debut: %d morceaux (moyenne %d Ko), %.1f%% des octets a envoyer"
+        % (len(journal) // 1000000, len(morceaux), len(journal) // len(morceaux) // 1024, 100 * taux)
+    )
+    assert taux < 0.1, "pas de frontiere dans le texte"
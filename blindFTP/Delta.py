@@ -0,0 +1,293 @@
+#!/usr/local/bin/python
+# -*- coding: latin-1 -*-
+"""
+----------------------------------------------------------------------------
+Delta: block-delta updates of modified files.
+----------------------------------------------------------------------------
+
+The sender keeps the block signatures (hash of each block of TAILLE_BLOC
+bytes) of the versions of a file it has sent. When the file is modified,
+only the blocks which differ from those versions are sent, in a delta file
+(REPERTOIRE_DELTAS/<file>) carrying the signature of the new version. The
+receiver rebuilds the new version from its copy: each block is taken from
+its copy if its hash matches the signature, from the delta otherwise. The
+result is checked with the CRC32 of the new version, then the delta is
+deleted.
+
+The link is one-way: the sender does not know which version the receiver
+holds. It keeps the signatures of the last version sent MinFileRedundancy
+times (validated, assumed received) and of the versions sent since: the
+delta carries every block which differs from any of them, so it applies to
+whichever of them the receiver holds. A receiver which missed the validated
+version cannot apply the deltas: the last of the MinFileRedundancy sends of
+each version is the whole file.
+"""
+
+# === IMPORTS ==================================================================
+
+import os, struct, hashlib, binascii
+
+# === CONSTANTES ===============================================================
+
+TAILLE_BLOC = 64 * 1024  # Size of the blocks (bytes)
+TAILLE_EMPREINTE = 8  # Size of the hash of a block (bytes, BLAKE2b)
+TAUX_MAX = 0.5  # Max ratio of changed blocks to send a delta instead of the file
+NB_VERSIONS_MAX = 4  # Max number of versions not validated yet to send a delta
+
+# Directory of the deltas, in the destination directory
+REPERTOIRE_DELTAS = ".bftp_deltas"
+# Directory of the signatures of the versions sent, next to the synchro file of
+# the sender (BFTPsynchro.xml -> BFTPsynchro.sig)
+EXTENSION_SIGNATURES = ".sig"
+
+# Delta: header, signature of the new version (hash of each block), numbers
+# of the blocks sent, then the data of these blocks (little endian: the delta
+# is read on another system)
+# - taille du fichier: Long Long=Q
+# - date du fichier: uint32=I
+# - CRC32 du fichier: uint32=I
+# - taille d'un bloc: uint32=I
+# - nombre de blocs envoyes: uint32=I
+ENTETE_DELTA = struct.Struct("<QIIII")
+NUMERO_BLOC = struct.Struct("<I")
+# Signatures file: one record per version, followed by the hashes of its blocks
+# - version validee (envoyee MinFileRedundancy fois): uchar=B
+# - taille, date et CRC32 du fichier: Q, I, I
+ENTETE_VERSION = struct.Struct("<BQII")
+
+# ------------------------------------------------------------------------------
+# signatures
+# -------------------
+
+
+def empreinte(bloc):
+    "Return the hash of a block."
+    return hashlib.blake2b(bloc, digest_size=TAILLE_EMPREINTE).digest()
+
+
+def nb_blocs(taille):
+    "Return the number of blocks of a file of taille bytes."
+    return (taille + TAILLE_BLOC - 1) // TAILLE_BLOC
+
+
+def signer(nom_fichier):
+    "Return the signature (hashes of the blocks, as bytes) and the CRC32 of a file."
+    empreintes = []
+    crc32 = 0
+    with open(nom_fichier, "rb") as f:
+        while True:
+            bloc = f.read(TAILLE_BLOC)
+            if not bloc:
+                break
+            empreintes.append(empreinte(bloc))
+            crc32 = binascii.crc32(bloc, crc32)
+    return b"".join(empreintes), crc32
+
+
+def blocs_modifies(signature, anciennes):
+    """Return the list of the blocks of the signature which differ in one of
+    the signatures anciennes (or are beyond its end)."""
+    modifies = []
+    for i in range(0, len(signature), TAILLE_EMPREINTE):
+        e = signature[i : i + TAILLE_EMPREINTE]
+        for ancienne in anciennes:
+            if ancienne[i : i + TAILLE_EMPREINTE] != e:
+                modifies.append(i // TAILLE_EMPREINTE)
+                break
+    return modifies
+
+
+def chemin_delta(nom_fichier):
+    "Return the path of the delta of a file in the destination directory."
+    return "%s/%s" % (REPERTOIRE_DELTAS, str(nom_fichier).replace("\\", "/"))
+
+
+def nom_delta(chemin):
+    "Return the file of a delta path, or None if it is not a delta."
+    prefixe = REPERTOIRE_DELTAS + "/"
+    chemin = chemin.replace("\\", "/")
+    if chemin.startswith(prefixe):
+        return chemin[len(prefixe) :]
+    return None
+
+
+# ------------------------------------------------------------------------------
+# delta
+# -------------------
+
+
+def ecrire_delta(nom, nom_fichier, taille, date, crc32, signature, blocs):
+    """Write the delta of the file nom_fichier (version taille, date, crc32,
+    signature), with the data of the blocks listed in blocs."""
+    with open(nom_fichier, "rb") as f, open(nom, "wb") as sortie:
+        sortie.write(ENTETE_DELTA.pack(taille, date, crc32 & 0xFFFFFFFF, TAILLE_BLOC, len(blocs)))
+        sortie.write(signature)
+        for i in blocs:
+            sortie.write(NUMERO_BLOC.pack(i))
+        for i in blocs:
+            f.seek(i * TAILLE_BLOC)
+            sortie.write(f.read(TAILLE_BLOC))
+
+
+def lire_entete(nom):
+    "Return the size, date and CRC32 of the new version of a delta file."
+    with open(nom, "rb") as f:
+        entete = f.read(ENTETE_DELTA.size)
+    if len(entete) < ENTETE_DELTA.size:
+        raise ValueError("delta tronque")
+    return ENTETE_DELTA.unpack(entete)[:3]
+
+
+def appliquer(nom_delta, nom_fichier, destination):
+    """Write the file destination, new version of the file nom_fichier (may
+    not exist) from the delta nom_delta. Return the CRC32 of destination.
+    Raise ValueError if a block is neither in the delta nor in nom_fichier,
+    or if the delta is incorrect."""
+    with open(nom_delta, "rb") as delta:
+        taille, date, crc32, taille_bloc, nb_envoyes = ENTETE_DELTA.unpack(delta.read(ENTETE_DELTA.size))
+        if taille_bloc != TAILLE_BLOC:
+            raise ValueError("taille de bloc incorrecte")
+        n = nb_blocs(taille)
+        signature = delta.read(n * TAILLE_EMPREINTE)
+        numeros = delta.read(nb_envoyes * NUMERO_BLOC.size)
+        if len(signature) != n * TAILLE_EMPREINTE or len(numeros) != nb_envoyes * NUMERO_BLOC.size:
+            raise ValueError("delta tronque")
+        # position des donnees de chaque bloc envoye dans le delta
+        debut = ENTETE_DELTA.size + len(signature) + len(numeros)
+        positions = {}
+        for j, (i,) in enumerate(NUMERO_BLOC.iter_unpack(numeros)):
+            if i >= n:
+                raise ValueError("numero de bloc %d incorrect (%d blocs)" % (i, n))
+            positions[i] = debut + j * TAILLE_BLOC
+        try:
+            ancien = open(nom_fichier, "rb")
+        except FileNotFoundError:
+            ancien = None
+        crc = 0
+        try:
+            with open(destination, "wb") as sortie:
+                for i in range(n):
+                    longueur = min(TAILLE_BLOC, taille - i * TAILLE_BLOC)
+                    bloc = None
+                    if ancien is not None and i not in positions:
+                        ancien.seek(i * TAILLE_BLOC)
+                        bloc = ancien.read(longueur)
+                        if empreinte(bloc) != signature[i * TAILLE_EMPREINTE : (i + 1) * TAILLE_EMPREINTE]:
+                            bloc = None
+                    if bloc is None:
+                        if i not in positions:
+                            raise ValueError("bloc %d absent de la copie et du delta" % i)
+                        delta.seek(positions[i])
+                        bloc = delta.read(longueur)
+                    crc = binascii.crc32(bloc, crc)
+                    sortie.write(bloc)
+        finally:
+            if ancien is not None:
+                ancien.close()
+    return crc
+
+
+# ------------------------------------------------------------------------------
+# classe Signatures
+# -------------------
+
+
+class Signatures:
+    """Signatures of the versions of the files sent, one file per file sent
+    in a directory."""
+
+    def __init__(self, repertoire):
+        """Signatures constructor.
+
+        repertoire: directory of the signatures files"""
+        self.repertoire = repertoire
+
+    def chemin(self, nom_fichier):
+        cle = hashlib.sha1(str(nom_fichier).encode("utf_8")).hexdigest()
+        return os.path.join(self.repertoire, cle)
+
+    def lire(self, nom_fichier):
+        """Return the versions of a file: list of [validated, size, date, CRC32,
+        signature]."""
+        try:
+            with open(self.chemin(nom_fichier), "rb") as f:
+                contenu = f.read()
+        except OSError:
+            return []
+        versions = []
+        position = 0
+        while position + ENTETE_VERSION.size <= len(contenu):
+            validee, taille, date, crc32 = ENTETE_VERSION.unpack_from(contenu, position)
+            position += ENTETE_VERSION.size
+            longueur = nb_blocs(taille) * TAILLE_EMPREINTE
+            signature = contenu[position : position + longueur]
+            if len(signature) < longueur:
+                break
+            position += longueur
+            versions.append([bool(validee), taille, date, crc32, signature])
+        return versions
+
+    def ecrire(self, nom_fichier, versions):
+        """Write the versions of a file (cf. lire). Only the validated versions
+        and the last NB_VERSIONS_MAX + 1 other ones are kept."""
+        versions = [v for v in versions if v[0]] + [v for v in versions if not v[0]][-NB_VERSIONS_MAX - 1 :]
+        os.makedirs(self.repertoire, exist_ok=True)
+        chemin = self.chemin(nom_fichier)
+        with open(chemin + ".tmp", "wb") as f:
+            for validee, taille, date, crc32, signature in versions:
+                f.write(ENTETE_VERSION.pack(validee, taille, date, crc32 & 0xFFFFFFFF) + signature)
+        os.replace(chemin + ".tmp", chemin)
+
+
+if __name__ == "__main__":
+    # export de base de donnees modifie a quelques endroits: taille du delta,
+    # et temps de signature et d'application
+    import sys, time, tempfile, random
+
+    TAILLE = int(sys.argv[1]) if len(sys.argv) > 1 else 256 * 1024 * 1024
+    NB_MODIFICATIONS = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    alea = random.Random(1)
+    repertoire = tempfile.mkdtemp(prefix="BFTP_delta_")
+    v1 = os.path.join(repertoire, "v1")
+    v2 = os.path.join(repertoire, "v2")
+    with open(v1, "wb") as f:
+        f.write(os.urandom(TAILLE))
+    with open(v1, "rb") as f:
+        donnees = bytearray(f.read())
+    for i in range(NB_MODIFICATIONS):
+        position = alea.randrange(TAILLE - 1000)
+        donnees[position : position + 1000] = os.urandom(1000)
+    donnees += os.urandom(12345)
+    with open(v2, "wb") as f:
+        f.write(donnees)
+
+    debut = time.time()
+    signature1, crc1 = signer(v1)
+    signature2, crc2 = signer(v2)
+    duree_signature = (time.time() - debut) / 2
+    blocs = blocs_modifies(signature2, [signature1])
+    delta = os.path.join(repertoire, "delta")
+    ecrire_delta(delta, v2, len(donnees), 0, crc2, signature2, blocs)
+    debut = time.time()
+    resultat = os.path.join(repertoire, "resultat")
+    assert appliquer(delta, v1, resultat) == crc2
+    duree_application = time.time() - debut
+    with open(resultat, "rb") as f:
+        assert f.read() == donnees
+    print(
+        "%d Mo, %d modifications: %d blocs modifies, delta de %d Ko (%.2f%% du fichier)"
+        % (
+            TAILLE // 1000000,
+            NB_MODIFICATIONS,
+            len(blocs),
+            os.path.getsize(delta) // 1024,
+            100 * os.path.getsize(delta) / len(donnees),
+        )
+    )
+    print(
+        "signature %.0f Mo/s, application %.0f Mo/s"
+        % (TAILLE / duree_signature / 1e6, TAILLE / duree_application / 1e6)
+    )
+    for nom in (v1, v2, delta, resultat):
+        os.remove(nom)
+    os.rmdir(repertoire)
@@ -0,0 +1,138 @@
+#!/usr/local/bin/python
+# -*- coding: latin-1 -*-
+"""
+----------------------------------------------------------------------------
+FEC: XOR parity over groups of BFTP file packets.
+----------------------------------------------------------------------------
+
+The sender emits one PACKAGE_FEC packet after each group of N file packets
+(chunks), carrying the XOR of the chunks of the group (the last chunk of the
+file is padded with zeros). The receiver rebuilds a chunk when it is the
+only one missing in its group, instead of waiting for the next complete
+resend of the file.
+
+XOR parity repairs one loss per group: with a loss rate p, a group of N
+chunks is repaired as long as p*N stays well below 1. Reed-Solomon codes
+would repair several losses per group, at a much higher CPU cost in Python.
+"""
+
+# === IMPORTS ==================================================================
+
+import struct
+
+# === CONSTANTES ===============================================================
+
+# Extension of the FEC packets, between the file name and the parity:
+# - nombre de paquets par groupe (N): uint16=H
+FORMAT_EXTENSION = "H"
+EXTENSION = struct.Struct(FORMAT_EXTENSION)
+TAILLE_EXTENSION = EXTENSION.size
+
+# ------------------------------------------------------------------------------
+# classe Parite
+# -------------------
+
+
+class Parite:
+    """XOR parity of a group of chunks, computed on the fly.
+
+    The XOR is computed on big integers (int.from_bytes), much faster than a
+    loop on the bytes in Python. Little endian: a short chunk is implicitly
+    padded with zeros at the end."""
+
+    def __init__(self):
+        "Parite constructor."
+        self.valeur = 0
+        self.nb_blocs = 0
+
+    def ajouter(self, bloc):
+        "Add a chunk (bytes-like object) to the parity."
+        self.valeur ^= int.from_bytes(bloc, "little")
+        self.nb_blocs += 1
+
+    def octets(self, taille):
+        "Return the parity as bytes, padded to taille bytes."
+        return self.valeur.to_bytes(taille, "little")
+
+    def reset(self):
+        "Start a new group."
+        self.valeur = 0
+        self.nb_blocs = 0
+
+
+# ------------------------------------------------------------------------------
+# REPARER
+# -------------------
+
+
+def reparer(parite, blocs, taille):
+    """Rebuild the missing chunk of a group.
+
+    parite: parity of the group (bytes-like object)
+    blocs: the other chunks of the group
+    taille: size of the missing chunk"""
+    p = Parite()
+    p.ajouter(parite)
+    for bloc in blocs:
+        p.ajouter(bloc)
+    return p.octets(len(parite))[:taille]
+
+
+def bornes_groupe(groupe, taille_groupe, nb_paquets):
+    "Return the numbers of the first and after-last packets of a group."
+    premier = groupe * taille_groupe
+    return premier, min(premier + taille_groupe, nb_paquets)
+
+
+if __name__ == "__main__":
+    # simulation: temps de convergence d'un fichier avec/sans FEC, pertes aleatoires
+    # (un "passage" = un envoi complet du fichier par synchro_arbo)
+    import sys, os, random
+
+    # verification rapide de la reparation
+    blocs = [os.urandom(1000), os.urandom(1000), os.urandom(700)]
+    p = Parite()
+    for bloc in blocs:
+        p.ajouter(bloc)
+    assert reparer(p.octets(1000), blocs[:2], 700) == blocs[2]
+    assert reparer(p.octets(1000), blocs[1:], 1000) == blocs[0]
+
+    NB_PAQUETS = int(sys.argv[1]) if len(sys.argv) > 1 else 66000  # ~4 Go en paquets de 65 Ko
+    NB_ESSAIS = 5
+    alea = random.Random(1)
+
+    def convergence(perte, taille_groupe):
+        """Nombre de passages et de paquets envoyes jusqu'a reception complete."""
+        recus = bytearray(NB_PAQUETS)
+        manquants = NB_PAQUETS
+        passages = envoyes = 0
+        while manquants:
+            passages += 1
+            envoyes += NB_PAQUETS
+            for n in range(NB_PAQUETS):
+                if not recus[n] and alea.random() >= perte:
+                    recus[n] = 1
+                    manquants -= 1
+            if taille_groupe:
+                nb_groupes = (NB_PAQUETS + taille_groupe - 1) // taille_groupe
+                envoyes += nb_groupes
+                for g in range(nb_groupes):
+                    premier, fin = bornes_groupe(g, taille_groupe, NB_PAQUETS)
+                    absents = fin - premier - sum(recus[premier:fin])
+                    if absents == 1 and alea.random() >= perte:
+                        recus[premier + recus[premier:fin].index(0)] = 1
+                        manquants -= 1
+        return passages, envoyes
+
+    print("%d paquets par fichier, moyenne sur %d essais" % (NB_PAQUETS, NB_ESSAIS))
+    print("perte   FEC   passages  paquets envoyes (temps relatif)")
+    for perte in (0.001, 0.01, 0.05):
+        reference = None
+        for taille_groupe in (0, 64, 16, 8):
+            resultats = [convergence(perte, taille_groupe) for i in range(NB_ESSAIS)]
+            passages = sum(r[0] for r in resultats) / NB_ESSAIS
+            envoyes = sum(r[1] for r in resultats) / NB_ESSAIS
+            if reference is None:
+                reference = envoyes
+            fec = "1/%d" % taille_groupe if taille_groupe else "non"
+            print("%5.1f%% %5s %9.1f %16d (%3.0f%%)" % (100 * perte, fec, passages, envoyes, 100 * envoyes / reference))
@@ -0,0 +1,236 @@
+#!/usr/local/bin/python
+# -*- coding: latin-1 -*-
+"""
+----------------------------------------------------------------------------
+Fountain: systematic fountain code for BFTP files.
+----------------------------------------------------------------------------
+
+The file is cut in chunks of the same size (the last one is padded with
+zeros), grouped in source blocks of TAILLE_BLOC chunks. For each block, the
+sender emits a stream of symbols identified by their ESI (encoding symbol
+id): symbols 0 to k-1 are the chunks themselves, the next ones are the XOR
+of the chunks chosen by a pseudo-random generator seeded by (block, ESI),
+each chunk with a probability of 1/2. Each pass sends new symbols, so
+slightly more than k symbols received decode the block, whichever were lost.
+
+LT codes (sparse symbols, robust soliton degrees) decode by peeling alone,
+but once the systematic symbols are received most of their repair symbols
+miss the few chunks still unknown: dense symbols make nearly every repair
+symbol useful, for k XOR of chunks per symbol.
+
+The receiver reduces each symbol by the chunks already known (read back
+from the temporary file): a symbol left with one unknown chunk gives that
+chunk (peeling), the others are kept in memory in echelon form and solved
+by Gaussian elimination once they cover all the unknown chunks.
+"""
+
+# === IMPORTS ==================================================================
+
+import struct
+
+# === CONSTANTES ===============================================================
+
+TAILLE_BLOC = 128  # Number of chunks in a source block
+
+# Extension of the fountain packets, between the file name and the symbol:
+# - ESI, numero du symbole dans le bloc: uint32=I
+# - nombre de paquets par bloc: uint16=H
+FORMAT_EXTENSION = "IH"
+EXTENSION = struct.Struct(FORMAT_EXTENSION)
+TAILLE_EXTENSION = EXTENSION.size
+
+# ------------------------------------------------------------------------------
+# PRNG (portable: the sender and the receiver must draw the same numbers)
+# -------------------
+
+
+class Generateur:
+    """splitmix64 pseudo-random generator.
+
+    (a linear generator such as xorshift would not do: its outputs are
+    linear on GF(2), and so the symbols would not be independent)"""
+
+    def __init__(self, bloc, esi):
+        "seeded by the block number and the ESI."
+        self.etat = (bloc << 32 | esi) & 0xFFFFFFFFFFFFFFFF
+
+    def suivant(self):
+        "Return the next 64-bit number."
+        self.etat = (self.etat + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        z = self.etat
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+        return z ^ (z >> 31)
+
+
+def voisins(bloc, esi, k):
+    """Return the list of the chunks (indexes in the block) combined in the
+    symbol esi of a block of k chunks."""
+    if esi < k:
+        # symboles systematiques
+        return [esi]
+    g = Generateur(bloc, esi)
+    masque = 0
+    for i in range(0, k, 64):
+        masque |= g.suivant() << i
+    liste = [i for i in range(k) if masque >> i & 1]
+    return liste or [g.suivant() % k]
+
+
+def encoder(blocs, liste):
+    "Return the XOR of the chunks blocs[i] (integers) for i in liste."
+    valeur = 0
+    for i in liste:
+        valeur ^= blocs[i]
+    return valeur
+
+
+# ------------------------------------------------------------------------------
+# classe Decodeur
+# -------------------
+
+
+class Decodeur:
+    """Decoder of one source block: Gaussian elimination on GF(2) of the
+    received symbols, a symbol left with one unknown chunk decoding it.
+
+    Symbols and chunks are handled as integers (int.from_bytes, little endian).
+    The chunks are not kept here: connu(i) tells if the chunk i is known,
+    lire(i) reads it back, and ecrire(i, valeur) is called for each decoded
+    chunk. The pending symbols are kept in echelon form: each one is stored
+    under its pivot (lowest unknown chunk), with the bit mask of its unknown
+    chunks. The chunks read or decoded are cached until the end of the block."""
+
+    def __init__(self, k, connu, lire, ecrire):
+        """Decodeur constructor.
+
+        k: number of chunks in the block"""
+        self.k = k
+        self.connu = connu
+        self.lire = lire
+        self.ecrire = ecrire
+        # symboles en attente: pivot -> [masque des paquets inconnus, valeur]
+        self.lignes = {}
+        self.cache = {}
+
+    def ajouter(self, liste, valeur):
+        "Add a received symbol (list of its chunks, value)."
+        masque = 0
+        for i in liste:
+            if self.connu(i):
+                valeur ^= self._lire(i)
+            else:
+                masque |= 1 << i
+        self._inserer(masque, valeur)
+
+    def propager(self, i, valeur=None):
+        """Reduce the pending symbols by the chunk i, newly known
+        (valeur: its value, read back with lire() if not given)."""
+        a_traiter = [(i, valeur)]
+        while a_traiter:
+            i, valeur = a_traiter.pop()
+            bit = 1 << i
+            pivots = [p for p, ligne in self.lignes.items() if ligne[0] & bit]
+            if pivots and valeur is None:
+                valeur = self._lire(i)
+            for p in pivots:
+                if p not in self.lignes:
+                    # resolu entre temps par elimination
+                    continue
+                masque, v = self.lignes.pop(p)
+                a_traiter.extend(self._inserer(masque ^ bit, v ^ valeur, False))
+
+    def _lire(self, i):
+        valeur = self.cache.get(i)
+        if valeur is None:
+            valeur = self.cache[i] = self.lire(i)
+        return valeur
+
+    def _ecrire(self, i, valeur):
+        self.cache[i] = valeur
+        self.ecrire(i, valeur)
+
+    def _inserer(self, masque, valeur, propager=True):
+        """Reduce a symbol by the pending ones, and store it under its pivot.
+        Return the list of the decoded (chunk, value), already propagated
+        if propager is True."""
+        while masque:
+            pivot = (masque & -masque).bit_length() - 1
+            ligne = self.lignes.get(pivot)
+            if ligne is None:
+                break
+            masque ^= ligne[0]
+            valeur ^= ligne[1]
+        if not masque:
+            # symbole redondant
+            return []
+        if masque & (masque - 1) == 0:
+            # un seul paquet inconnu: il est decode
+            self._ecrire(pivot, valeur)
+            decodes = [(pivot, valeur)]
+            if propager:
+                self.propager(pivot, valeur)
+            return decodes
+        self.lignes[pivot] = [masque, valeur]
+        self._eliminer()
+        return []
+
+    def _eliminer(self):
+        """Solve the pending symbols by back substitution once they cover
+        all their unknown chunks (full rank)."""
+        inconnus = 0
+        for masque, valeur in self.lignes.values():
+            inconnus |= masque
+        if len(self.lignes) < bin(inconnus).count("1"):
+            return
+        # rang plein: les autres bits d'une ligne sont des pivots plus grands
+        decodes = {}
+        for pivot in sorted(self.lignes, reverse=True):
+            masque, valeur = self.lignes[pivot]
+            autres = masque ^ (1 << pivot)
+            while autres:
+                bit = autres & -autres
+                valeur ^= decodes[bit.bit_length() - 1]
+                autres ^= bit
+            decodes[pivot] = valeur
+        self.lignes = {}
+        for i in sorted(decodes):
+            self._ecrire(i, decodes[i])
+
+
+if __name__ == "__main__":
+    # simulation: nombre de symboles necessaires au decodage d'un bloc
+    # (avec des pertes, le surcout est compte sur les symboles recus)
+    import sys, random
+
+    NB_ESSAIS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    alea = random.Random(1)
+
+    def essai(k, perte, premier_esi):
+        """Emission sans fin de symboles d'un bloc de k paquets (1 octet), avec
+        des pertes aleatoires: retourne le nombre de symboles emis et recus."""
+        source = [alea.getrandbits(8) for i in range(k)]
+        decode = {}
+        d = Decodeur(k, decode.__contains__, decode.__getitem__, decode.__setitem__)
+        esi = premier_esi
+        recus = 0
+        while len(decode) < k:
+            if alea.random() >= perte:
+                liste = voisins(7, esi, k)
+                d.ajouter(liste, encoder(source, liste))
+                recus += 1
+            esi += 1
+        assert [decode[i] for i in range(k)] == source
+        return esi - premier_esi, recus
+
+    print("bloc   perte  systematique  symboles emis  symboles recus (surcout)")
+    for k in (32, 128, 256):
+        for perte, premier_esi in ((0.01, 0), (0.1, 0), (0.1, k)):
+            resultats = [essai(k, perte, premier_esi) for i in range(NB_ESSAIS)]
+            emis = sum(r[0] for r in resultats) / NB_ESSAIS
+            recus = sum(r[1] for r in resultats) / NB_ESSAIS
+            systematique = "oui" if premier_esi == 0 else "non"
+            print(
+                "%4d %6.1f%% %13s %14.1f %15.1f (%+.1f%%)"
+                % (k, 100 * perte, systematique, emis, recus, 100 * (recus - k) / k)
+            )
@@ -0,0 +1,132 @@
+#!/usr/local/bin/python
+# -*- coding: latin-1 -*-
+"""
+----------------------------------------------------------------------------
+Packetizer: zero-copy assembly of BFTP data packets.
+----------------------------------------------------------------------------
+
+Packets are built in a ring of preallocated buffers: the header is packed
+with a precompiled struct.Struct, the file data is read with readinto()
+directly in the payload buffer, and the packet is handed to the transport
+as a (header, name, payload) tuple sent with scatter/gather I/O.
+"""
+
+# === IMPORTS ==================================================================
+
+import struct
+
+# ------------------------------------------------------------------------------
+# READINTO_FULL
+# -------------------
+
+
+def readinto_full(f, vue):
+    """Fill the memoryview vue from the file f, and return the number of
+    bytes read (less than len(vue) only at the end of the file)."""
+    total = 0
+    taille = len(vue)
+    while total < taille:
+        n = f.readinto(vue[total:])
+        if not n:
+            break
+        total += n
+    return total
+
+
+# ------------------------------------------------------------------------------
+# classe Packetizer
+# -------------------
+
+
+class Packetizer:
+    """Builds BFTP data packets in a ring of preallocated buffers.
+
+    A buffer is reused after nb_buffers packets: nb_buffers must be at least
+    the batch size of the transport, which flushes every batch_size packets.
+    """
+
+    def __init__(self, format_entete, taille_paquet, nb_buffers):
+        """Packetizer constructor.
+
+        format_entete: struct format of the packet header
+        taille_paquet: maximum size of the payload
+        nb_buffers: number of buffers in the ring"""
+        self.entete = struct.Struct(format_entete)
+        self.taille_paquet = taille_paquet
+        self._entetes = [bytearray(self.entete.size) for i in range(nb_buffers)]
+        self._donnees = [memoryview(bytearray(taille_paquet)) for i in range(nb_buffers)]
+        self._index = 0
+
+    def build(self, f, data_size, nom, *champs):
+        """Read data_size bytes from the file f, and return the packet as a
+        (header, name, payload) tuple of buffers.
+
+        nom: file name field (bytes)
+        champs: values of the header fields"""
+        i = self._index
+        self._index = (i + 1) % len(self._entetes)
+        donnees = self._donnees[i][:data_size]
+        if readinto_full(f, donnees) != data_size:
+            raise IOError("fichier tronque pendant l'envoi")
+        entete = self._entetes[i]
+        self.entete.pack_into(entete, 0, *champs)
+        return (entete, nom, donnees)
+
+
+if __name__ == "__main__":
+    # micro-benchmark: assemblage par concatenation / par Packetizer
+    import sys, os, time, tempfile
+
+    FORMAT = "BBHQIIIIQIi"
+    TAILLE = 65500
+    nom = b"repertoire/sous-repertoire/fichier.iso"
+    data_size = TAILLE - struct.calcsize(FORMAT) - len(nom)
+    taille_fichier = int(sys.argv[1]) if len(sys.argv) > 1 else 256 * 1024 * 1024
+    tmp = tempfile.NamedTemporaryFile(prefix="BFTP_bench_")
+    bloc = os.urandom(1024 * 1024)
+    for i in range(taille_fichier // len(bloc)):
+        tmp.write(bloc)
+    tmp.flush()
+    nb_paquets = (taille_fichier + data_size - 1) // data_size
+
+    def taille(n, reste):
+        return min(n, reste)
+
+    def concatenation():
+        f = open(tmp.name, "rb")
+        reste = taille_fichier
+        octets = 0
+        for num in range(nb_paquets):
+            n = taille(data_size, reste)
+            reste -= n
+            donnees = f.read(n)
+            entete = struct.pack(FORMAT, 0, len(nom), n, f.tell(), 0, num, num, nb_paquets, taille_fichier, 0, 0)
+            paquet = entete + nom + donnees
+            octets += len(paquet)
+        f.close()
+        return octets
+
+    def packetizer():
+        p = Packetizer(FORMAT, TAILLE, 32)
+        f = open(tmp.name, "rb", buffering=0)
+        reste = taille_fichier
+        offset = 0
+        octets = 0
+        for num in range(nb_paquets):
+            n = taille(data_size, reste)
+            reste -= n
+            paquet = p.build(f, n, nom, 0, len(nom), n, offset, 0, num, num, nb_paquets, taille_fichier, 0, 0)
+            octets += sum(len(morceau) for morceau in paquet)
+            offset += n
+        f.close()
+        return octets
+
+    octets = set()
+    for fonction in (concatenation, packetizer):
+        fonction()  # pour remplir le cache disque
+        debut = time.process_time()
+        octets.add(fonction())
+        duree = time.process_time() - debut
+        print("%-14s: %6.2f us CPU/paquet (%d paquets)" % (fonction.__name__, 1e6 * duree / nb_paquets, nb_paquets))
+    # les deux methodes construisent des paquets de meme taille
+    assert len(octets) == 1
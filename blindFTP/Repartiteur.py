@@ -0,0 +1,141 @@
+#!/usr/local/bin/python
+# -*- coding: latin-1 -*-
+"""
+----------------------------------------------------------------------------
+Repartiteur: dispatch of received datagrams to per-file worker threads.
+----------------------------------------------------------------------------
+
+The receiving thread only drains the socket: each datagram is put in one of
+N bounded queues, chosen by a hash of its file name, and processed by the
+worker thread of that queue. All the packets of a file go to the same
+worker, in order, so the state of a file is never shared between threads,
+while disk writes and completions of different files run in parallel (the
+GIL is released during file I/O).
+
+The receiving thread never waits for a worker: when a queue is full, the
+datagram is dropped and counted, as if it had been lost on the link. It is
+received again on the next pass, as any lost packet.
+"""
+
+# === IMPORTS ==================================================================
+
+import queue, threading
+
+# === CONSTANTES ===============================================================
+
+NB_WORKERS = 4  # Default number of worker threads
+TAILLE_FILE = 1024  # Default max number of datagrams waiting in each queue
+
+# ------------------------------------------------------------------------------
+# classe Repartiteur
+# -------------------
+
+
+class Repartiteur:
+    """Bounded queues sharded by file name, each one emptied by a worker thread."""
+
+    def __init__(self, fabrique, nb_workers=NB_WORKERS, taille_file=TAILLE_FILE):
+        """Repartiteur constructor.
+
+        fabrique: function called once in each worker, returning the function
+                  which processes a datagram (so each worker has its own state)
+        nb_workers: number of queues and worker threads
+        taille_file: max number of datagrams waiting in a queue"""
+        self.files = [queue.Queue(taille_file) for i in range(max(1, nb_workers))]
+        self.nb_rejetes = 0  # datagrams dropped, queue full
+        self.threads = []
+        for file_attente in self.files:
+            th = threading.Thread(target=self._travailler, args=(fabrique, file_attente))
+            th.daemon = True
+            th.start()
+            self.threads.append(th)
+
+    def _travailler(self, fabrique, file_attente):
+        traiter = fabrique()
+        while True:
+            paquet = file_attente.get()
+            if paquet is None:
+                break
+            traiter(paquet)
+
+    def repartir(self, cle, paquet):
+        """Queue a datagram for the worker of the key cle (file name), without
+        waiting. Return False if the datagram was dropped (queue full)."""
+        try:
+            self.files[hash(cle) % len(self.files)].put_nowait(paquet)
+        except queue.Full:
+            self.nb_rejetes += 1
+            return False
+        return True
+
+    def arreter(self):
+        """Stop the workers, once the datagrams already queued are processed."""
+        for file_attente in self.files:
+            file_attente.put(None)
+        for th in self.threads:
+            th.join()
+
+
+if __name__ == "__main__":
+    # benchmark sur la boucle locale: bftp.py -r seul, puis avec repartition,
+    # pour NB_FICHIERS fichiers envoyes en meme temps par autant d'emetteurs
+    import sys, os, time, subprocess, tempfile, shutil
+
+    NB_FICHIERS = int(sys.argv[1]) if len(sys.argv) > 1 else 24
+    TAILLE = int(sys.argv[2]) if len(sys.argv) > 2 else 4 * 1024 * 1024
+    DEBIT = int(sys.argv[3]) if len(sys.argv) > 3 else 10000  # Kbps par emetteur
+    ATTENTE = 10  # fin de la mesure sans nouveau fichier recu pendant ce delai (s)
+    PORT = 36116
+    bftp = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bftp.py")
+    racine = tempfile.mkdtemp(prefix="BFTP_bench_")
+    source = os.path.join(racine, "src")
+    os.mkdir(source)
+    for n in range(NB_FICHIERS):
+        with open(os.path.join(source, "f%02d.bin" % n), "wb") as f:
+            f.write(os.urandom(TAILLE))
+
+    def termines(dest):
+        nb = 0
+        for n in range(NB_FICHIERS):
+            nom = os.path.join(dest, "f%02d.bin" % n)
+            if os.path.isfile(nom) and os.path.getsize(nom) == TAILLE:
+                nb += 1
+        return nb
+
+    print("%d fichiers de %d Ko, %d Kbps par emetteur" % (NB_FICHIERS, TAILLE // 1024, DEBIT))
+    print("workers  fichiers recus  duree")
+    for nb_workers in (0, 2, NB_WORKERS, 8):
+        dest = os.path.join(racine, "dst%d" % nb_workers)
+        os.mkdir(dest)
+        sortie = open(os.path.join(racine, "recv%d.log" % nb_workers), "w")
+        recepteur = subprocess.Popen(
+            [sys.executable, bftp, "-r", "-w", str(nb_workers), "-a", "127.0.0.1", "-p", str(PORT), dest],
+            stdout=sortie,
+            stderr=subprocess.STDOUT,
+            cwd=racine,  # journal bftp.log dans le repertoire temporaire
+        )
+        time.sleep(1)
+        debut = time.time()
+        emetteurs = [
+            subprocess.Popen(
+                [sys.executable, bftp, "-e", "-a", "127.0.0.1", "-p", str(PORT), "-l", str(DEBIT), nom],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                cwd=racine,
+            )
+            for nom in sorted(os.path.join(source, nom) for nom in os.listdir(source))
+        ]
+        # les emetteurs ne s'arretent pas seuls (heartbeat): on attend les fichiers
+        nb = 0
+        fin = debut + TAILLE * 8 / (DEBIT * 1000)  # duree d'envoi au debit demande
+        while nb < NB_FICHIERS and time.time() - fin < ATTENTE:
+            time.sleep(0.1)
+            recus = termines(dest)
+            if recus != nb:
+                nb, fin = recus, time.time()
+        for p in emetteurs + [recepteur]:
+            p.kill()
+            p.wait()
+        sortie.close()
+        print("%7d  %8d/%-6d  %.1fs" % (nb_workers, nb, NB_FICHIERS, fin - debut if nb else 0))
+    shutil.rmtree(racine)
@@ -44,11 +44,12 @@ termes.
 # 03/07/2005 v0.01: - 1�re version
 # 06/07/2005 v0.02: - remplacement du buffer chaine par un objet array
 # 08/07/2005 v0.03: - ajout du comptage des bits � 1
+# 2026       v0.04: - import depuis une cha�ne ou un fichier, export en cha�ne
 
 # A FAIRE:
 # + v�rifier si index hors tableau (<0 ou >N-1)
-# - import de cha�ne ou fichier ou liste de bool�ens
-# - export vers cha�ne ou fichier
+# - import de liste de bool�ens
+# - export vers fichier
 # - interface tableau Python
 # - taille dynamique
 
@@ -67,12 +68,15 @@ class TabBits:
 		taille: nombre de bits du tableau.
 		buffer: chaine utilis�e pour remplir le tableau (optionnel).
 		readFile: fichier utilis� pour remplir le tableau (optionnel).
+		(buffer et readFile contiennent le tableau export� par export())
 		"""
 		self._taille = taille
 		self.nb_true = 0    # nombre de bits � 1, 0 par d�faut
-		if buffer == None and readFile == None:
-			# on calcule le nombre d'octets n�cessaires pour le buffer
-			taille_buffer = (taille+7)/8
+		# on calcule le nombre d'octets n�cessaires pour le buffer
+		taille_buffer = (taille+7)//8
+		if readFile != None:
+			buffer = readFile.read(taille_buffer)
+		if buffer == None:
 			# on cr�e alors un buffer de cette taille, initialis� � z�ro:
 			# self._buffer = chr(0)*taille_buffer
 			# on cr�e un objet array de Bytes
@@ -81,8 +85,12 @@ class TabBits:
 			# (� optimiser: boucle pour �viter de cr�er une liste ?)
 			self._buffer.fromlist([0]*taille_buffer)
 		else:
-			# pas encore �crit...
-			raise NotImplementedError
+			if len(buffer) != taille_buffer:
+				raise ValueError("taille du buffer incorrecte")
+			self._buffer = array.array('B', bytearray(buffer))
+			# on recompte les bits � 1
+			for octet in self._buffer:
+				self.nb_true += bin(octet).count("1")
 
 	def get (self, indexBit):
 		"""Pour lire un bit dans le tableau. Retourne un bool�en."""
@@ -115,6 +123,10 @@ class TabBits:
 			self._buffer[indexOctet] = octet
 			self.nb_true -= 1
 
+	def export (self):
+		"""pour exporter le tableau en cha�ne d'octets (cf. buffer du constructeur)."""
+		return bytes(bytearray(self._buffer))
+
 	def __str__ (self):
 		"""pour convertir le TabBits en cha�ne contenant des 0 et des 1."""
 		chaine = ""
@@ -140,5 +152,7 @@ if __name__ == "__main__":
 	print ("tb[%d] = %d" % (N-1, tb.get(N-1)))
 	print ("taille bits = %d" % tb._taille)
 	print ("taille buffer = %d" % len(tb._buffer))
+	tb2 = TabBits(N, buffer=tb.export())
+	print ("import: %s, nb_true = %d" % (str(tb2) == str(tb), tb2.nb_true))
 			
 		
@@ -44,7 +44,7 @@ class TraitEnCours:
         lg = len(newchaine)
         if truncate == True and lg > LgMax:
             # Chaine trop longue � couper en 2 + insertion de "..." au milieu
-            l1 = (LgMax - 3) / 2
+            l1 = (LgMax - 3) // 2
             l2 = LgMax - l1 - 3
             self.__chaine = newchaine[0:l1] + "..." + newchaine[lg - l2 : lg]
         else:
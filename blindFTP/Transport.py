@@ -0,0 +1,545 @@
+#!/usr/local/bin/python
+# -*- coding: latin-1 -*-
+"""
+----------------------------------------------------------------------------
+Transport: UDP sockets with batched datagram submission and reception.
+----------------------------------------------------------------------------
+
+A single Transport object is shared by file sending, heartbeats and delete
+notifications. Datagrams are queued and submitted in batches with the Linux
+sendmmsg() system call (through ctypes); other platforms fall back to a
+plain sendmsg()/sendto() loop.
+
+A datagram is either one bytes-like object or a tuple of bytes-like objects
+(header, name, payload...) sent with scatter/gather I/O, without joining
+them in a new buffer.
+
+A transfer can be striped over several destinations (ports, or address/port
+pairs for bonded links): the datagrams are sent to each one in turn.
+
+Pacing can be handed to the kernel (fq qdisc required on the interface):
+- PACING_FQ: the socket pacing rate is set with SO_MAX_PACING_RATE,
+- PACING_TXTIME: each datagram carries its transmit time (SO_TXTIME).
+
+The largest datagram sent without IP fragmentation is given by the MTU of
+the path known by the kernel (taille_datagramme): a datagram larger than
+the MTU is cut in IP fragments, and the loss of any fragment loses the
+whole datagram.
+
+On the receiving side, Reception reads the datagrams in batches with the
+Linux recvmmsg() system call (recvfrom_into() elsewhere), into a ring of
+preallocated buffers: no bytes object is allocated per datagram.
+"""
+
+# === IMPORTS ==================================================================
+
+import sys, os, socket, struct, threading
+from errno import EINTR
+import ctypes, ctypes.util
+
+# === CONSTANTES ===============================================================
+
+BATCH_SIZE = 32  # Default number of datagrams submitted in one system call
+MAX_IOV = 4  # Max number of buffers (scatter/gather) in one datagram
+
+# Pacing backends
+PACING_PYTHON = "python"  # pauses in Python (LimiteurDebit)
+PACING_FQ = "fq"  # socket pacing rate, applied by the fq qdisc
+PACING_TXTIME = "txtime"  # per-datagram transmit time, applied by the fq qdisc
+PACINGS = (PACING_PYTHON, PACING_FQ, PACING_TXTIME)
+
+# Linux socket options (not exported by the socket module): the fallback numbers
+# are only valid on Linux, other systems use them for other options
+LINUX = sys.platform.startswith("linux")
+SO_MAX_PACING_RATE = getattr(socket, "SO_MAX_PACING_RATE", 47 if LINUX else None)
+SO_TXTIME = getattr(socket, "SO_TXTIME", 61 if LINUX else None)
+SCM_TXTIME = SO_TXTIME
+IP_MTU = getattr(socket, "IP_MTU", 14 if LINUX else None)  # MTU of the path of a connected socket
+ENTETES_IP_UDP = 20 + 8  # Size of the IPv4 and UDP headers (bytes)
+CLOCK_MONOTONIC = 1  # clock of time.monotonic_ns() on Linux
+
+# ------------------------------------------------------------------------------
+# sendmmsg structures (Linux)
+# -------------------
+
+
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _msghdr), ("msg_len", ctypes.c_uint)]
+
+
+class _sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint16),
+        ("sin_addr", ctypes.c_uint8 * 4),
+        ("sin_zero", ctypes.c_uint8 * 8),
+    ]
+
+
+def _load_libc(nom, argtypes):
+    """Return the libc function nom (sendmmsg, recvmmsg), or None if it is not available."""
+    if not LINUX:
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        fonction = getattr(libc, nom)
+    except (OSError, AttributeError):
+        return None
+    fonction.argtypes = argtypes
+    fonction.restype = ctypes.c_int
+    return fonction
+
+
+_sendmmsg = _load_libc("sendmmsg", [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int])
+_recvmmsg = _load_libc(
+    "recvmmsg", [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+)
+MSG_WAITFORONE = 0x10000  # recvmmsg: block for the first datagram only
+
+
+def _address(buffer):
+    """Return the address of a bytes-like object, without copying it."""
+    if isinstance(buffer, bytes):
+        return ctypes.cast(ctypes.c_char_p(buffer), ctypes.c_void_p).value
+    return ctypes.addressof((ctypes.c_char * len(buffer)).from_buffer(buffer))
+
+
+# ------------------------------------------------------------------------------
+# classe Transport
+# -------------------
+
+
+class Transport:
+    """UDP sender socket kept open for the whole run, with batched submission.
+
+    Datagrams given to send() are queued and really sent by flush(), which is
+    called automatically when the batch is full. Callers must flush() before
+    pausing (rate limiting) and after urgent packets such as heartbeats.
+
+    The buffers of a queued datagram are not copied: they must not be
+    modified before being flushed. As send() flushes as soon as batch_size
+    datagrams are queued, a ring of batch_size buffers can safely be reused.
+    """
+
+    def __init__(self, host, port, batch_size=BATCH_SIZE, destinations=None):
+        """Transport constructor.
+
+        host: destination IP address or host name
+        port: destination UDP port
+        batch_size: maximum number of datagrams per system call
+        destinations: list of (host, port) to stripe the datagrams over,
+                      instead of (host, port)"""
+        if not destinations:
+            destinations = [(host, port)]
+        self.destinations = [(socket.gethostbyname(h), p) for h, p in destinations]
+        self.destination = self.destinations[0]
+        self._suivante = 0  # index of the destination of the next datagram
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.batch_size = max(1, batch_size)
+        self.nb_datagrams = 0  # datagrams really sent
+        self.nb_syscalls = 0  # system calls used to send them
+        self._queue = []  # (datagram, transmit time in ns or None)
+        self._lock = threading.RLock()
+        self.pacing = PACING_PYTHON
+        self._sendmmsg = _sendmmsg if self.batch_size > 1 else None
+        if self._sendmmsg is not None:
+            self._init_mmsghdr()
+
+    def taille_datagramme(self):
+        """Return the max size of a datagram sent to all the destinations without
+        IP fragmentation (MTU of the path known by the kernel, minus the IPv4
+        and UDP headers), or None if the MTU is not known (not Linux)."""
+        if IP_MTU is None:
+            return None
+        taille = None
+        for destination in self.destinations:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                s.connect(destination)
+                mtu = s.getsockopt(socket.IPPROTO_IP, IP_MTU)
+            except OSError:
+                return None
+            finally:
+                s.close()
+            if taille is None or mtu - ENTETES_IP_UDP < taille:
+                taille = mtu - ENTETES_IP_UDP
+        return taille
+
+    def _init_mmsghdr(self):
+        """Preallocate the sendmmsg() structures, reused for every batch."""
+        self._sockaddrs = (_sockaddr_in * len(self.destinations))()
+        for addr, (ip, port) in zip(self._sockaddrs, self.destinations):
+            addr.sin_family = socket.AF_INET
+            addr.sin_port = socket.htons(port)
+            addr.sin_addr[:] = list(socket.inet_aton(ip))
+        self._iovecs = (_iovec * (self.batch_size * MAX_IOV))()
+        self._msgs = (_mmsghdr * self.batch_size)()
+        # one SCM_TXTIME control message per datagram
+        self._taille_cmsg = socket.CMSG_SPACE(8)
+        self._cmsgs = (ctypes.c_char * (self.batch_size * self._taille_cmsg))()
+        for i in range(self.batch_size):
+            position = i * self._taille_cmsg
+            struct.pack_into("@Nii", self._cmsgs, position, socket.CMSG_LEN(8), socket.SOL_SOCKET, SCM_TXTIME)
+            hdr = self._msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._sockaddrs)
+            hdr.msg_namelen = ctypes.sizeof(_sockaddr_in)
+            hdr.msg_iov = ctypes.pointer(self._iovecs[i * MAX_IOV])
+            hdr.msg_iovlen = 1
+
+    def set_pacing(self, pacing, debit):
+        """Select the pacing backend.
+
+        pacing: PACING_PYTHON, PACING_FQ or PACING_TXTIME
+        debit: maximum rate in bytes/s (used by PACING_FQ)
+
+        Raise OSError if the backend is not available on this system."""
+        if pacing == PACING_FQ and SO_MAX_PACING_RATE is None or pacing == PACING_TXTIME and SO_TXTIME is None:
+            raise OSError("pacing %s is only available on Linux" % pacing)
+        if pacing == PACING_FQ:
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_MAX_PACING_RATE, int(debit))
+        elif pacing == PACING_TXTIME:
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_TXTIME, struct.pack("@iI", CLOCK_MONOTONIC, 0))
+        self.pacing = pacing
+
+    def send(self, paquet, txtime=None):
+        """Queue a datagram (bytes-like object or tuple of bytes-like objects),
+        flushing when the batch is full.
+
+        txtime: transmit time (time.monotonic_ns), with PACING_TXTIME only"""
+        with self._lock:
+            self._queue.append((paquet, txtime))
+            if len(self._queue) >= self.batch_size:
+                self.flush()
+
+    def send_now(self, paquet):
+        """Send a datagram immediately, along with any queued datagram."""
+        with self._lock:
+            self._queue.append((paquet, None))
+            self.flush()
+
+    def flush(self):
+        """Send all the queued datagrams."""
+        with self._lock:
+            queue, self._queue = self._queue, []
+            if not queue:
+                return
+            if self._sendmmsg is None:
+                for paquet, txtime in queue:
+                    destination = self.destinations[self._suivante]
+                    self._suivante = (self._suivante + 1) % len(self.destinations)
+                    if txtime is not None:
+                        cmsg = [(socket.SOL_SOCKET, SCM_TXTIME, struct.pack("@Q", txtime))]
+                        if not isinstance(paquet, tuple):
+                            paquet = (paquet,)
+                        self.socket.sendmsg(paquet, cmsg, 0, destination)
+                    elif not isinstance(paquet, tuple):
+                        self.socket.sendto(paquet, destination)
+                    elif hasattr(self.socket, "sendmsg"):
+                        self.socket.sendmsg(paquet, (), 0, destination)
+                    else:
+                        # pas de scatter/gather (Windows): on concatene
+                        self.socket.sendto(b"".join(paquet), destination)
+                    self.nb_syscalls += 1
+            else:
+                self._flush_sendmmsg(queue)
+            self.nb_datagrams += len(queue)
+
+    def _flush_sendmmsg(self, queue):
+        """Submit the queued datagrams with as few sendmmsg() calls as possible."""
+        for i, (paquet, txtime) in enumerate(queue):
+            if not isinstance(paquet, tuple):
+                paquet = (paquet,)
+            iov = i * MAX_IOV
+            for tampon in paquet:
+                self._iovecs[iov].iov_base = _address(tampon)
+                self._iovecs[iov].iov_len = len(tampon)
+                iov += 1
+            hdr = self._msgs[i].msg_hdr
+            hdr.msg_iovlen = len(paquet)
+            if len(self.destinations) > 1:
+                hdr.msg_name = ctypes.addressof(self._sockaddrs) + self._suivante * ctypes.sizeof(_sockaddr_in)
+                self._suivante = (self._suivante + 1) % len(self.destinations)
+            if txtime is None:
+                hdr.msg_control = None
+                hdr.msg_controllen = 0
+            else:
+                position = i * self._taille_cmsg
+                struct.pack_into("@Q", self._cmsgs, position + socket.CMSG_LEN(0), txtime)
+                hdr.msg_control = ctypes.addressof(self._cmsgs) + position
+                hdr.msg_controllen = self._taille_cmsg
+        fd = self.socket.fileno()
+        done = 0
+        while done < len(queue):
+            msgs = ctypes.cast(ctypes.byref(self._msgs, done * ctypes.sizeof(_mmsghdr)), ctypes.POINTER(_mmsghdr))
+            n = self._sendmmsg(fd, msgs, len(queue) - done, 0)
+            self.nb_syscalls += 1
+            if n < 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            done += n
+
+    def close(self):
+        """Flush the queue and close the socket."""
+        with self._lock:
+            self.flush()
+            self.socket.close()
+
+
+# ------------------------------------------------------------------------------
+# classe Reception
+# -------------------
+
+
+class Reception:
+    """Batched reception of datagrams into a ring of preallocated buffers.
+
+    recevoir() returns memoryviews on the buffers, which are overwritten by
+    the next call: a datagram kept longer (e.g. queued for another thread)
+    must be copied first.
+    """
+
+    def __init__(self, sock, taille_paquet, batch_size=BATCH_SIZE):
+        """Reception constructor.
+
+        sock: bound UDP socket
+        taille_paquet: maximum size of a datagram (longer ones are truncated)
+        batch_size: maximum number of datagrams per system call"""
+        self.socket = sock
+        self.batch_size = max(1, batch_size)
+        self.nb_datagrams = 0  # datagrams received
+        self.nb_syscalls = 0  # system calls used to receive them
+        self._buffer = bytearray(taille_paquet * self.batch_size)
+        vue = memoryview(self._buffer)
+        self._vues = [vue[i * taille_paquet : (i + 1) * taille_paquet] for i in range(self.batch_size)]
+        self._recvmmsg = _recvmmsg if self.batch_size > 1 else None
+        if self._recvmmsg is not None:
+            adresse = ctypes.addressof((ctypes.c_char * len(self._buffer)).from_buffer(self._buffer))
+            self._iovecs = (_iovec * self.batch_size)()
+            self._msgs = (_mmsghdr * self.batch_size)()
+            for i in range(self.batch_size):
+                self._iovecs[i].iov_base = adresse + i * taille_paquet
+                self._iovecs[i].iov_len = taille_paquet
+                self._msgs[i].msg_hdr.msg_iov = ctypes.pointer(self._iovecs[i])
+                self._msgs[i].msg_hdr.msg_iovlen = 1
+
+    def recevoir(self):
+        """Wait for at least one datagram, and return the list of the datagrams
+        received (memoryviews, valid until the next call)."""
+        if self._recvmmsg is None:
+            n = self.socket.recv_into(self._vues[0])
+            self.nb_syscalls += 1
+            self.nb_datagrams += 1
+            return [self._vues[0][:n]]
+        fd = self.socket.fileno()
+        while True:
+            n = self._recvmmsg(fd, self._msgs, self.batch_size, MSG_WAITFORONE, None)
+            self.nb_syscalls += 1
+            if n >= 0:
+                break
+            errno = ctypes.get_errno()
+            if errno != EINTR:
+                raise OSError(errno, os.strerror(errno))
+            # EINTR: le gestionnaire de signal Python (Ctrl+C) s'execute avant la reprise
+        self.nb_datagrams += n
+        return [self._vues[i][: self._msgs[i].msg_len] for i in range(n)]
+
+
+if __name__ == "__main__":
+    # quelques tests si le module est lance directement
+    import time
+
+    r = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    r.bind(("127.0.0.1", 0))
+    r.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    r.settimeout(1)
+    N = 20000
+    paquets = [b"%05d" % i + b"x" * 1400 for i in range(N)]
+
+    def lecteur(resultat):
+        try:
+            while True:
+                r.recv(2048)
+                resultat.append(1)
+        except socket.timeout:
+            pass
+
+    for batch in (1, BATCH_SIZE):
+        recus = []
+        th = threading.Thread(target=lecteur, args=(recus,))
+        th.start()
+        t = Transport("127.0.0.1", r.getsockname()[1], batch)
+        debut = time.time()
+        for paquet in paquets:
+            t.send(paquet)
+        t.flush()
+        duree = time.time() - debut
+        th.join()
+        print(
+            "batch=%3d: %d datagrams, %d syscalls, %d received, %.1f us/datagram"
+            % (batch, t.nb_datagrams, t.nb_syscalls, len(recus), 1e6 * duree / N)
+        )
+        t.close()
+
+    # reception: le tampon de la socket est rempli, puis vide par recvfrom ou par Reception
+    r.settimeout(None)
+    NB_LOT = 2000
+    for batch in (0, 1, BATCH_SIZE):
+        t = Transport("127.0.0.1", r.getsockname()[1])
+        reception = Reception(r, 2048, batch or 1)
+        duree = 0
+        recus = 0
+        for essai in range(10):
+            for paquet in paquets[:NB_LOT]:
+                t.send(paquet)
+            t.flush()
+            time.sleep(0.05)
+            debut = time.time()
+            n = 0
+            while n < NB_LOT:
+                if batch:
+                    n += len(reception.recevoir())
+                else:
+                    r.recvfrom(2048)
+                    n += 1
+            duree += time.time() - debut
+            recus += n
+        syscalls = reception.nb_syscalls if batch else recus
+        print(
+            "%-13s: %d datagrams, %d syscalls, %.2f us/datagram"
+            % ("Reception(%d)" % batch if batch else "recvfrom", recus, syscalls, 1e6 * duree / recus)
+        )
+        t.close()
+
+    # perte de fragments: lien de MTU 1500 dont chaque fragment IP est perdu avec la
+    # probabilite PERTE (un datagramme est perdu si l'un de ses fragments l'est).
+    # Mesure sur une paire veth dont une extremite est dans un namespace reseau, avec
+    # netem (perte et debit) sur l'autre; sans netem (pas root, pas de sch_netem),
+    # seul le modele est affiche.
+    import math, subprocess
+
+    PERTE = float(sys.argv[1]) if len(sys.argv) > 1 else 0.01
+    MTU = 1500
+    DEBIT_LIEN = 100  # debit du lien en Mbit/s
+    ENTETE_BFTP = 48 + 40  # entete BFTP et nom de fichier typique
+    VOLUME = 16 * 1024 * 1024  # donnees envoyees pour chaque taille
+    NETNS = "bftp_perte"
+    IP_LOCALE, IP_DISTANTE = "10.199.0.1", "10.199.0.2"
+    RECEPTEUR = """
+import socket, sys, time
+r = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+r.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16 * 1024 * 1024)
+r.bind((sys.argv[1], 0))
+print(r.getsockname()[1], flush=True)
+r.settimeout(10)
+n, debut, fin = 0, None, None
+try:
+    while True:
+        r.recv(65536)
+        fin = time.time()
+        if debut is None:
+            debut = fin
+            r.settimeout(2)
+        n += 1
+except socket.timeout:
+    pass
+print(n, fin - debut if n > 1 else 0, flush=True)
+"""
+
+    def fragments(taille):
+        return int(math.ceil((taille + 8) / (MTU - 20)))
+
+    def debit_utile_modele(taille):
+        """Goodput (Mo/s) of the file data on the link according to the model."""
+        octets_lien = taille + 8 + 20 * fragments(taille)
+        return DEBIT_LIEN / 8 * (1 - PERTE) ** fragments(taille) * (taille - ENTETE_BFTP) / octets_lien
+
+    def supprimer_lien():
+        subprocess.run(["ip", "netns", "del", NETNS], stderr=subprocess.DEVNULL)
+        subprocess.run(["ip", "link", "del", "bftp0"], stderr=subprocess.DEVNULL)
+
+    def creer_lien():
+        """Create the veth pair with netem, return False if it is not possible."""
+        commandes = [
+            "ip netns add %s" % NETNS,
+            "ip link add bftp0 type veth peer name bftp1",
+            "ip link set bftp1 netns %s" % NETNS,
+            "ip addr add %s/24 dev bftp0" % IP_LOCALE,
+            "ip link set bftp0 mtu %d up" % MTU,
+            "ip netns exec %s ip addr add %s/24 dev bftp1" % (NETNS, IP_DISTANTE),
+            "ip netns exec %s ip link set bftp1 mtu %d up" % (NETNS, MTU),
+            "tc qdisc add dev bftp0 root netem loss %f%% rate %dmbit limit 100000" % (100 * PERTE, DEBIT_LIEN),
+        ]
+        for commande in commandes:
+            try:
+                ok = subprocess.run(commande.split(), stderr=subprocess.DEVNULL).returncode == 0
+            except OSError:
+                ok = False
+            if not ok:
+                supprimer_lien()
+                return False
+        return True
+
+    def mesure_netem(taille):
+        """Send VOLUME bytes in datagrams of the given size over the netem link,
+        return (datagrams sent, datagrams received, goodput in Mo/s)."""
+        recepteur = subprocess.Popen(
+            ["ip", "netns", "exec", NETNS, sys.executable, "-c", RECEPTEUR, IP_DISTANTE],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        port = int(recepteur.stdout.readline())
+        nb_envois = VOLUME // taille
+        datagramme = b"x" * taille
+        t = Transport(IP_DISTANTE, port)
+        for i in range(nb_envois):
+            t.send(datagramme)
+        t.flush()
+        t.close()
+        recus, duree = recepteur.communicate()[0].split()
+        recus, duree = int(recus), float(duree)
+        return nb_envois, recus, recus * (taille - ENTETE_BFTP) / duree / 1e6 if duree else 0
+
+    tailles = (65507, 32000, 8972, MTU - ENTETES_IP_UDP)
+    print("lien MTU %d a %d Mbit/s, perte de %.1f%% des fragments" % (MTU, DEBIT_LIEN, 100 * PERTE))
+    if creer_lien():
+        try:
+            print("datagramme  fragments  recus (modele)  debit utile (modele)")
+            for taille in tailles:
+                nb_envois, recus, debit_utile = mesure_netem(taille)
+                print(
+                    "%10d  %9d  %5.1f%% (%5.1f%%)  %6.2f Mo/s (%5.2f Mo/s)"
+                    % (
+                        taille,
+                        fragments(taille),
+                        100 * recus / nb_envois,
+                        100 * (1 - PERTE) ** fragments(taille),
+                        debit_utile,
+                        debit_utile_modele(taille),
+                    )
+                )
+        finally:
+            supprimer_lien()
+    else:
+        print("netem indisponible (root, ip et tc avec sch_netem requis): modele seul, rien n'est mesure")
+        print("datagramme  fragments  recus (modele)  debit utile (modele)")
+        for taille in tailles:
+            print(
+                "%10d  %9d  %13.1f%%  %15.2f Mo/s"
+                % (taille, fragments(taille), 100 * (1 - PERTE) ** fragments(taille), debit_utile_modele(taille))
+            )
@@ -0,0 +1,257 @@
+#!/usr/local/bin/python
+# -*- coding: latin-1 -*-
+"""
+----------------------------------------------------------------------------
+Watcher: change detection in a tree with Linux inotify (through ctypes).
+----------------------------------------------------------------------------
+
+Each directory of the tree is watched: a file written, created, moved,
+deleted or whose date changed gives its path (relative to the root), and
+the tree only has to be read again for these paths (cf. xfl.DirTree.update)
+instead of being scanned entirely. A new directory is watched as soon as it
+appears, with its subdirectories.
+
+The kernel queue of events is limited (fs.inotify.max_queued_events): when
+it overflows, events are lost and the tree must be scanned entirely again
+(debordement). The number of watches is limited too
+(fs.inotify.max_user_watches): OSError is raised when it is reached.
+"""
+
+# === IMPORTS ==================================================================
+
+import sys, os, struct, select, time
+import ctypes, ctypes.util
+
+# === CONSTANTES ===============================================================
+
+# inotify events and flags (linux/inotify.h)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+
+# events watched on each directory (not IN_MODIFY: one event per write, the
+# end of the write is given by IN_CLOSE_WRITE)
+MASQUE = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+)
+
+# struct inotify_event, followed by the name (padded with zeros):
+# - wd: int=i
+# - mask, cookie, len: uint32=I
+EVENEMENT = struct.Struct("iIII")
+TAILLE_LECTURE = 64 * 1024  # Size of the buffer read from the inotify descriptor (bytes)
+
+DELAI_REGROUPEMENT = 2  # Time without event ending a group of changes (s)
+DELAI_REGROUPEMENT_MAX = 30  # Max duration of a group of changes (s)
+
+# ------------------------------------------------------------------------------
+# fonctions inotify (Linux)
+# -------------------
+
+
+def _load_libc(nom, argtypes):
+    """Return the libc function nom (inotify_*), or None if it is not available."""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        fonction = getattr(libc, nom)
+    except (OSError, AttributeError):
+        return None
+    fonction.argtypes = argtypes
+    fonction.restype = ctypes.c_int
+    return fonction
+
+
+_inotify_init1 = _load_libc("inotify_init1", [ctypes.c_int])
+_inotify_add_watch = _load_libc("inotify_add_watch", [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32])
+_inotify_rm_watch = _load_libc("inotify_rm_watch", [ctypes.c_int, ctypes.c_int])
+
+
+def disponible():
+    "Return True if inotify is available on this system."
+    return None not in (_inotify_init1, _inotify_add_watch, _inotify_rm_watch)
+
+
+# ------------------------------------------------------------------------------
+# classe Surveillance
+# -------------------
+
+
+class Surveillance:
+    """Watch of a tree: paths changed since the last call to prendre()."""
+
+    def __init__(self, racine, ignores=()):
+        """Surveillance constructor. Raise OSError if inotify is not available
+        or if the directories cannot be watched.
+
+        racine: root directory of the tree
+        ignores: files and directories whose changes are ignored (files
+        written by the sender itself)"""
+        if not disponible():
+            raise OSError("inotify n'est pas disponible sur ce systeme")
+        self.racine = os.path.abspath(racine)
+        self.ignores = [os.path.abspath(nom) for nom in ignores]
+        self.fd = _inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.repertoires = {}  # descripteur de surveillance -> chemin relatif du repertoire
+        self.chemins = set()  # chemins relatifs modifies
+        self.debordement = False  # evenements perdus: relire toute l'arborescence
+        try:
+            self.surveiller("")
+        except OSError:
+            self.fermer()
+            raise
+
+    def surveiller(self, relatif):
+        """Watch a directory (relative path, "" for the root) and its subdirectories.
+        Raise OSError if the max number of watches is reached."""
+        racine = os.path.join(self.racine, relatif) if relatif else self.racine
+        for repertoire, sous_repertoires, fichiers in os.walk(racine):
+            wd = _inotify_add_watch(self.fd, os.fsencode(repertoire), MASQUE | IN_ONLYDIR)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                if errno in (2, 20):  # ENOENT, ENOTDIR: supprime pendant le parcours
+                    continue
+                raise OSError(errno, "%s: %s" % (os.strerror(errno), repertoire))
+            chemin = os.path.relpath(repertoire, self.racine)
+            self.repertoires[wd] = "" if chemin == os.curdir else chemin.replace(os.sep, "/")
+
+    def oublier(self, relatif):
+        "Stop watching a directory moved out of its place, and its subdirectories."
+        prefixe = relatif + "/"
+        for wd, chemin in list(self.repertoires.items()):
+            if chemin == relatif or chemin.startswith(prefixe):
+                _inotify_rm_watch(self.fd, wd)
+                del self.repertoires[wd]
+
+    def ignore(self, chemin):
+        "Return True if the changes of a path (relative) are ignored."
+        nom = os.path.join(self.racine, chemin)
+        return any(nom == i or nom.startswith(i + os.sep) for i in self.ignores)
+
+    def lire(self):
+        """Read the events available (without waiting). Return True if paths
+        have changed or if events have been lost."""
+        while True:
+            try:
+                donnees = os.read(self.fd, TAILLE_LECTURE)
+            except BlockingIOError:
+                break
+            position = 0
+            while position + EVENEMENT.size <= len(donnees):
+                wd, masque, cookie, longueur = EVENEMENT.unpack_from(donnees, position)
+                position += EVENEMENT.size
+                nom = os.fsdecode(donnees[position : position + longueur].rstrip(b"\0"))
+                position += longueur
+                if masque & IN_Q_OVERFLOW:
+                    self.debordement = True
+                    continue
+                if masque & IN_IGNORED:
+                    self.repertoires.pop(wd, None)
+                    continue
+                relatif = self.repertoires.get(wd)
+                if relatif is None:
+                    continue
+                if masque & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    # un sous-repertoire est signale par son parent, pas la racine
+                    if relatif == "":
+                        self.debordement = True
+                    continue
+                chemin = relatif + "/" + nom if relatif else nom
+                if self.ignore(chemin):
+                    continue
+                self.chemins.add(chemin)
+                if masque & IN_ISDIR:
+                    if masque & (IN_CREATE | IN_MOVED_TO):
+                        self.surveiller(chemin)
+                    elif masque & IN_MOVED_FROM:
+                        self.oublier(chemin)
+        return bool(self.chemins) or self.debordement
+
+    def attendre(self, delai):
+        """Wait for changes during delai seconds at most. Once a change is
+        seen, the changes are gathered until DELAI_REGROUPEMENT seconds
+        without event (a file being copied...). Return True if paths have
+        changed or if events have been lost."""
+        fin = time.time() + delai
+        while not self.lire():
+            reste = fin - time.time()
+            if reste <= 0:
+                return False
+            select.select([self.fd], [], [], reste)
+        fin = time.time() + DELAI_REGROUPEMENT_MAX
+        while time.time() < fin and select.select([self.fd], [], [], DELAI_REGROUPEMENT)[0]:
+            self.lire()
+        return True
+
+    def prendre(self):
+        "Return the paths changed (relative, with / separators) and forget them."
+        self.lire()
+        chemins = self.chemins
+        self.chemins = set()
+        return chemins
+
+    def vider(self):
+        "Forget the changes and the lost events, before a scan of the whole tree."
+        self.prendre()
+        self.debordement = False
+
+    def fermer(self):
+        os.close(self.fd)
+
+
+if __name__ == "__main__":
+    # arborescence de NB_FICHIERS fichiers: temps d'un scan complet, et delai
+    # entre l'ecriture d'un nouveau fichier et sa detection et sa mise a jour
+    # dans l'arborescence
+    import tempfile, shutil
+    import xfl
+
+    NB_FICHIERS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    racine = tempfile.mkdtemp(prefix="BFTP_watch_")
+    for i in range(NB_FICHIERS):
+        repertoire = os.path.join(racine, "rep%03d" % (i % 1000))
+        if i < 1000:
+            os.mkdir(repertoire)
+        with open(os.path.join(repertoire, "fichier%06d" % i), "wb") as f:
+            f.write(b"x")
+    debut = time.time()
+    arbre = xfl.DirTree(owner=False)
+    arbre.read_disk(racine)
+    print("%d fichiers: scan complet en %.2f s" % (NB_FICHIERS, time.time() - debut))
+    arbre.pathdict()
+    debut = time.time()
+    surveillance = Surveillance(racine)
+    print("surveillance de %d repertoires en %.2f s" % (len(surveillance.repertoires), time.time() - debut))
+    debut = time.time()
+    os.mkdir(os.path.join(racine, "nouveau"))
+    with open(os.path.join(racine, "nouveau", "fichier"), "wb") as f:
+        f.write(b"nouveau")
+    with open(os.path.join(racine, "rep000", "fichier000000"), "wb") as f:
+        f.write(b"modifie")
+    while not surveillance.lire():
+        select.select([surveillance.fd], [], [], 1)
+    detection = time.time() - debut
+    chemins = surveillance.prendre()
+    arbre.update(chemins)
+    assert "nouveau/fichier" in arbre.dict and arbre.dict["rep000/fichier000000"].get(xfl.ATTR_SIZE) == "7"
+    print(
+        "%d changements detectes en %.1f ms, arborescence mise a jour en %.1f ms"
+        % (len(chemins), 1000 * detection, 1000 * (time.time() - debut - detection))
+    )
+    surveillance.fermer()
+    shutil.rmtree(racine)
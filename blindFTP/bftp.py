@@ -8,9 +8,9 @@ BlindFTP v 0.37 - Unidirectional File Transfer Protocol
 
 # === IMPORTS ==================================================================
 
-import sys, socket, struct, time, os, os.path, tempfile, logging, traceback
-import binascii
-import threading
+import sys, socket, struct, time, os, os.path, tempfile, logging, traceback, math, array
+import binascii, hashlib, errno, shutil, atexit
+import threading, asyncio, concurrent.futures, multiprocessing, queue, signal
 import configparser
 
 # path.py module import
@@ -36,8 +36,9 @@ except:
 
 # internal modules
 from optparse import OptionParser
-import TabBits, Console
+import TabBits, Console, CRC
 import TraitEncours
+import Transport, Packetizer, Codec, FEC, Fountain, Repartiteur, Compression, Dedup, Delta, Bundle, Watcher
 
 
 # === CONSTANTES ===============================================================
@@ -53,6 +54,7 @@ if sys.platform == "darwin":
     PACKAGE_SIZE = 1500
 else:
     PACKAGE_SIZE = 65500
+MTU_MIN = 576  # Min MTU of an IPv4 link (option -m)
 
 MODE_DEBUG = True  # check if debug() messages are displayed
 
@@ -62,9 +64,36 @@ MAX_FILE_NAME = 1024  # Max length for the filename field
 
 HB_DELAY = 10  # Default time between two Heartbeat
 
+RAFALE = 256 * 1024  # Default burst size of the rate limiter (bytes)
+ATTENTE_ACTIVE = 0.0005  # End of rate limiter pauses done by busy waiting (s)
+AVANCE_TXTIME = 0.2  # Max advance of scheduled transmit times on the clock (s)
+TAILLE_RCVBUF = 8 * 1024 * 1024  # Receive socket buffer (bytes, capped by net.core.rmem_max on Linux)
+TAILLE_NOTIFICATIONS = 65536  # Max number of packets waiting for the main process (reception on several ports)
+
 # en synchro stricte dur�e de r�tention
 # un fichier disparu/effac� sur le guichet bas est effac� cot� haut apr�s ce d�lai
 OFFLINEDELAY = 86400 * 7  # 86400 vaut 1 jour
+# mode surveillance (option -W): l'arborescence n'est relue enti�rement qu'au d�part,
+# apr�s un d�bordement de la file des �v�nements inotify et apr�s ce d�lai (s)
+SCAN_COMPLET_DELAI = 86400
+# en mode surveillance, le fichier de reprise n'est r��crit qu'apr�s ce d�lai (s) entre deux
+# scrutations compl�tes: apr�s un arr�t, les fichiers �mis depuis sont �mis � nouveau
+SAUVEGARDE_DELAI = 600
+
+# R�ceptions partielles journalis�es dans le r�pertoire destination, pour les
+# reprendre apr�s un red�marrage du r�cepteur (cf. Sender)
+REPERTOIRE_PARTIEL = ".bftp_partial"
+JOURNAL_DELAI = 5  # Min time between two saves of the received packets of a file (s)
+# ent�te du fichier .bits: taille du fichier (Q), date (I), nombre de paquets (I), CRC32 (i),
+# suivi des paquets re�us (TabBits), de la taille d'un paquet (I) et du CRC32 de chaque paquet (I)
+FORMAT_JOURNAL = "QIIi"
+# Index des fichiers re�us en entier, dans REPERTOIRE_PARTIEL (cf. IndexRecus):
+# enregistrements ajout�s en fin de fichier, chacun suivi du nom (utf-8):
+# taille (Q), taille du fichier destination (Q, diff�rente si compress�), date (I),
+# CRC32 (i), longueur du nom (H), re�u (B, 0 si supprim�)
+FICHIER_INDEX = "index"
+FORMAT_INDEX = "QQIiHB"
+INDEX_VERIFICATION = 60  # Min time between two checks of an indexed file on disk (s)
 
 IgnoreExtensions = (".part", ".tmp", ".ut", ".dlm")  #  Extensions of temp files which are never send (temp files)
 
@@ -89,12 +118,35 @@ FORMAT_ENTETE = "BBHQIIIIQIi"
 # Correction bug 557 : taille du format diff�re selon les OS
 SIZE_ENTETE = struct.calcsize(FORMAT_ENTETE)
 # size : Win32 (48) ; Linux (44) ; MacOSX PPC (44)
+# precompiled header decoder
+codec = Codec.Codec(FORMAT_ENTETE)
 
 # Types of packages:
 PACKAGE_FILE = 0  # File
 PACKAGE_DIRECTORY = 1  # Directory (not yet use)
+PACKAGE_FEC = 2  # XOR parity of a group of File packets (cf. FEC)
+PACKAGE_FOUNTAIN = 3  # Fountain coded symbol of a block of File packets (cf. Fountain)
+PACKAGE_FILE_CRC = 4  # File, with the CRC32 of the packet data (cf. CRC)
+PACKAGE_BUNDLE = 5  # Bundle of small files (cf. Bundle)
+PACKAGE_ANNOUNCE = 6  # Binding of a file name to a file ID (cf. Annonce)
+PACKAGE_FEC_CRC = 7  # FEC, with the CRC32 of the parity (cf. CRC)
+PACKAGE_FOUNTAIN_CRC = 8  # Fountain, with the CRC32 of the symbol (cf. CRC)
 PACKAGE_HEARTBEAT = 10  # HeartBeat
 PACKAGE_DELETEFile = 16  # File Delete
+# paquets portant un morceau de fichier, et tous les types connus
+TYPES_FICHIER = (PACKAGE_FILE, PACKAGE_FEC, PACKAGE_FOUNTAIN, PACKAGE_FILE_CRC, PACKAGE_FEC_CRC, PACKAGE_FOUNTAIN_CRC)
+# parit� et symboles avec checksum: type sans checksum correspondant
+TYPES_CRC = {PACKAGE_FEC_CRC: PACKAGE_FEC, PACKAGE_FOUNTAIN_CRC: PACKAGE_FOUNTAIN}
+TYPES_PAQUETS = TYPES_FICHIER + (PACKAGE_BUNDLE, PACKAGE_ANNOUNCE, PACKAGE_HEARTBEAT, PACKAGE_DELETEFile)
+# mode identifiants: le champ nom d'un paquet de fichier porte l'identifiant du
+# fichier au lieu de son chemin, li� au chemin par des paquets d'annonce (cf. Annonce)
+DRAPEAU_IDENTIFIANT = 0x20
+IDENTIFIANT = struct.Struct("<I")
+PERIODE_ANNONCE = 256  # Number of file packets between two announcements
+IDENTIFIANTS_MAX = 100000  # Max number of file IDs kept by a receiver
+# les bits de poids fort du type d'un paquet de fichier indiquent la compression
+# (cf. Compression) et le mode identifiants
+MASQUE_TYPE = 0xFF & ~(Compression.MASQUE | DRAPEAU_IDENTIFIANT)
 
 # Complement d'attributs � XFL
 ATTR_CRC = "crc"  # File CRC
@@ -112,14 +164,10 @@ MinFileRedundancy = 5
 global options
 options = None
 
-# dictionnaire des fichiers en cours de r�ception
-# receiving files dictionnary
-global files
-files = {}
-
-# pour mesurer les stats de reception:
-
-stats = None
+# sender transport (socket shared by send, heartbeats and delete notifications)
+transport = None
+# ring of preallocated packet buffers used by send()
+packetizer = None
 
 
 # ------------------------------------------------------------------------------
@@ -171,6 +219,34 @@ def mtime2str(date_fichier):
     return time.strftime("%d/%m/%Y %H:%M:%S", localtime)
 
 
+# ------------------------------------------------------------------------------
+# GET_TRANSPORT : Shared sender transport
+# -------------------
+
+
+def get_transport():
+    "Return the sender transport shared by all emissions, created on first use."
+    global transport
+    if transport is None:
+        destinations = None
+        if options is not None:
+            # envoi r�parti sur plusieurs ports, et/ou plusieurs adresses (liens agr�g�s)
+            adresses = options.adresse.split(",")
+            destinations = [(adresse, PORT + i) for adresse in adresses for i in range(options.stripes)]
+        transport = Transport.Transport(HOST, PORT, destinations=destinations)
+        if options is not None:
+            transport.set_pacing(options.pacing, options.debit * 1000 / 8)
+    return transport
+
+
+def get_packetizer():
+    "Return the packet builder used by send(), sized for the shared transport."
+    global packetizer
+    if packetizer is None:
+        packetizer = Packetizer.Packetizer(FORMAT_ENTETE, PACKAGE_SIZE, get_transport().batch_size)
+    return packetizer
+
+
 # ------------------------------------------------------------------------------
 # classe STATS
 # -------------------
@@ -184,6 +260,9 @@ class Stats:
         self.num_session = -1
         self.expected_packet_num = 0
         self.nb_packets_lost = 0
+        self.nb_repares = 0  # paquets reconstruits par FEC
+        self.nb_corrompus = 0  # paquets rejet�s: CRC32 des donn�es incorrect
+        self.nb_rejetes = 0  # paquets perdus par le r�cepteur: file d'attente pleine
 
     def add_package(self, pack):
         """pour mettre � jour les stats en fonction du paquet."""
@@ -193,9 +272,12 @@ class Stats:
             self.expected_packet_num = 0
             self.nb_packets_lost = 0
         # a-t-on perdu des paquets ?
-        if pack.num_paquet_session != self.expected_packet_num:
+        if pack.num_paquet_session >= self.expected_packet_num:
             self.nb_packets_lost += pack.num_paquet_session - self.expected_packet_num
-        self.expected_packet_num = pack.num_paquet_session + 1
+            self.expected_packet_num = pack.num_paquet_session + 1
+        elif self.nb_packets_lost > 0:
+            # paquet en retard (r�ception sur plusieurs ports): il avait �t� compt� perdu
+            self.nb_packets_lost -= 1
 
     def loss_rate(self):
         """calcule le taux de lost packets, en pourcentage"""
@@ -209,7 +291,15 @@ class Stats:
     def print_stats(self):
         """affiche les stats"""
         print(
-            "loss rate: %d%%, lost packets: %d/%d" % (self.loss_rate(), self.nb_packets_lost, self.expected_packet_num)
+            "loss rate: %d%%, lost packets: %d/%d, repaired by FEC: %d, corrupted: %d, dropped (queues full): %d"
+            % (
+                self.loss_rate(),
+                self.nb_packets_lost,
+                self.expected_packet_num,
+                self.nb_repares,
+                self.nb_corrompus,
+                self.nb_rejetes,
+            )
         )
 
 
@@ -237,11 +327,394 @@ def chemin_interdit(chemin):
         return True
     if "?" in chemin:
         return True
+    # le journal des r�ceptions partielles n'est pas accessible
+    if chemin.replace("\\", "/").split("/")[0] == REPERTOIRE_PARTIEL:
+        return True
     # A AJOUTER: v�rifier si codage unicode, ou autre ??
     # Sinon c'est OK, le chemin est valide:
     return False
 
 
+# ------------------------------------------------------------------------------
+# JOURNAL des r�ceptions partielles
+# -------------------
+
+
+def chemin_journal(chemin_dest, nom_fichier, taille_fichier, date_fichier, crc32):
+    """Retourne le chemin (sans extension) du journal de r�ception d'un fichier
+    re�u dans chemin_dest:
+    .part pour les donn�es re�ues, .bits pour la liste des paquets re�us.
+    La cl� change d�s que le fichier est modifi� sur le guichet bas."""
+    cle = "%s\0%d\0%d\0%08X" % (nom_fichier, taille_fichier, date_fichier, crc32 & 0xFFFFFFFF)
+    return chemin_dest / REPERTOIRE_PARTIEL / hashlib.sha1(cle.encode("utf_8")).hexdigest()
+
+
+def purger_journal(chemin_dest):
+    """Supprime les r�ceptions partielles abandonn�es depuis plus de OFFLINEDELAY
+    (fichier modifi� ou supprim� sur le guichet bas)."""
+    repertoire = chemin_dest / REPERTOIRE_PARTIEL
+    if not repertoire.isdir():
+        return
+    limite = time.time() - OFFLINEDELAY
+    for fichier in repertoire.files():
+        if fichier.name == FICHIER_INDEX:
+            continue
+        try:
+            if fichier.getmtime() < limite:
+                fichier.remove()
+        except OSError:
+            pass
+
+
+def deja_recu(fichier_dest, taille_fichier, date_fichier):
+    "Retourne True si le fichier destination est d�j� � jour (m�me taille et m�me date)."
+    return (
+        fichier_dest.exists() and fichier_dest.getsize() == taille_fichier and fichier_dest.getmtime() == date_fichier
+    )
+
+
+# ------------------------------------------------------------------------------
+# classe INDEXRECUS
+# -------------------
+
+
+class IndexRecus:
+    """Index des fichiers re�us en entier dans un r�pertoire destination:
+    nom (utf-8, tel que dans les paquets) -> taille, date et CRC32.
+
+    Les paquets d'un fichier d�j� re�u (envoi en boucle) sont ignor�s d'apr�s
+    leur ent�te seul, sans acc�s disque: le fichier destination n'est v�rifi�
+    qu'au plus toutes les INDEX_VERIFICATION secondes (s'il a �t� modifi� ou
+    effac�, il est re�u � nouveau). L'index est conserv� d'un d�marrage
+    � l'autre dans un fichier o� chaque changement est ajout� � la fin."""
+
+    def __init__(self, chemin_dest):
+        """Constructeur d'objet IndexRecus.
+
+        chemin_dest: r�pertoire destination (objet path)"""
+        self.chemin_dest = chemin_dest
+        self.chemin = chemin_dest / REPERTOIRE_PARTIEL / FICHIER_INDEX
+        self.enregistrement = struct.Struct(FORMAT_INDEX)
+        # nom -> [taille, date, CRC32, taille destination, heure de la derni�re v�rification]
+        self.fichiers = {}
+        self.fichier = None
+        self.verrou = threading.Lock()
+        self.charger()
+
+    def charger(self):
+        "pour relire l'index enregistr�, puis le r��crire sans les entr�es p�rim�es."
+        try:
+            with open(self.chemin, "rb") as f:
+                contenu = f.read()
+        except OSError:
+            return
+        taille_enregistrement = self.enregistrement.size
+        position = 0
+        nb_enregistrements = 0
+        # un enregistrement tronqu� (arr�t pendant l'�criture) termine la lecture
+        while position + taille_enregistrement <= len(contenu):
+            taille, taille_dest, date, crc32, longueur_nom, recu = self.enregistrement.unpack_from(contenu, position)
+            position += taille_enregistrement
+            nom = contenu[position : position + longueur_nom]
+            if len(nom) < longueur_nom:
+                break
+            position += longueur_nom
+            nb_enregistrements += 1
+            if recu:
+                self.fichiers[nom] = [taille, date, crc32, taille_dest, None]
+            else:
+                self.fichiers.pop(nom, None)
+        if nb_enregistrements > len(self.fichiers) or position < len(contenu):
+            temp = self.chemin + ".tmp"
+            with open(temp, "wb") as f:
+                for nom, (taille, date, crc32, taille_dest, verifie) in self.fichiers.items():
+                    f.write(self.enregistrement.pack(taille, taille_dest, date, crc32, len(nom), 1) + nom)
+            os.replace(temp, self.chemin)
+
+    def est_recu(self, nom, taille_fichier, date_fichier, crc32):
+        """Retourne True si le fichier nom (bytes) a d�j� �t� re�u en entier avec
+        cette taille, cette date et ce CRC32."""
+        entree = self.fichiers.get(nom)
+        if entree is None or entree[0] != taille_fichier or entree[1] != date_fichier or entree[2] != crc32:
+            return False
+        maintenant = time.monotonic()
+        if entree[4] is None or maintenant - entree[4] > INDEX_VERIFICATION:
+            nom_fichier = nom.decode("utf_8", "replace")
+            fichier_dest = self.chemin_dest / nom_fichier
+            reconstitue = Dedup.nom_recette(nom_fichier) or Delta.nom_delta(nom_fichier)
+            if reconstitue is not None and not fichier_dest.exists():
+                # recette ou delta supprim� une fois le fichier reconstitu�: c'est lui qui est v�rifi�
+                fichier_dest = self.chemin_dest / reconstitue
+                recu = fichier_dest.exists() and fichier_dest.getmtime() == date_fichier
+            else:
+                recu = deja_recu(fichier_dest, entree[3], date_fichier)
+            if not recu:
+                # modifi� ou effac� sur le guichet haut: il sera re�u � nouveau
+                self.supprimer(nom)
+                return False
+            entree[4] = maintenant
+        return True
+
+    def ajouter(self, nom, taille_fichier, date_fichier, crc32, taille_dest):
+        """pour indexer un fichier re�u en entier (nom en bytes).
+
+        taille_dest: taille du fichier destination (d�compress�)"""
+        self.fichiers[nom] = [taille_fichier, date_fichier, crc32, taille_dest, time.monotonic()]
+        enregistrement = self.enregistrement.pack(taille_fichier, taille_dest, date_fichier, crc32, len(nom), 1)
+        self.enregistrer(enregistrement + nom)
+
+    def supprimer(self, nom):
+        "pour retirer un fichier de l'index (nom en bytes)."
+        if self.fichiers.pop(nom, None) is not None:
+            self.enregistrer(self.enregistrement.pack(0, 0, 0, 0, len(nom), 0) + nom)
+
+    def enregistrer(self, enregistrement):
+        # appel� par le thread de recopie et par les workers: un seul �crivain � la fois
+        # (pas de fsync: un enregistrement perdu co�te seulement une nouvelle r�ception)
+        with self.verrou:
+            if self.fichier is None:
+                os.makedirs(self.chemin.dirname(), exist_ok=True)
+                self.fichier = open(self.chemin, "ab")
+            self.fichier.write(enregistrement)
+            self.fichier.flush()
+
+
+# ------------------------------------------------------------------------------
+# classe RECEPTEUR
+# -------------------
+
+
+class Recepteur:
+    """classe regroupant l'�tat d'un r�cepteur: r�pertoire destination, fichiers
+    en cours de r�ception, statistiques et heartbeat. Plusieurs r�cepteurs
+    peuvent fonctionner dans le m�me processus (cf. RecepteurAsync)."""
+
+    def __init__(self, chemin_dest, indexer=True):
+        """Constructeur d'objet Recepteur.
+
+        chemin_dest: r�pertoire o� sont stock�s les fichiers re�us.
+        indexer: pour tenir l'index des fichiers re�us en entier (cf. IndexRecus)"""
+        self.chemin_dest = path(chemin_dest)
+        self.index = IndexRecus(self.chemin_dest) if indexer else None
+        # dictionnaire des fichiers en cours de r�ception
+        self.files = {}
+        # pour mesurer les stats de reception:
+        self.stats = Stats()
+        self.heartbeat = HeartBeat()
+        # mode identifiants (cf. Annonce): identifiant -> nom (bytes et str), taille, date et CRC32
+        self.identifiants = {}
+        # d�duplication (cf. Dedup): SHA-1 d'un morceau manquant -> recettes qui l'attendent
+        self.recettes_en_attente = {}
+        self.verrou_recettes = threading.Lock()
+        if indexer:
+            self.reprendre_en_attente()
+
+    def journaliser(self):
+        "pour enregistrer l'�tat des r�ceptions en cours (avant de quitter)."
+        for f in list(self.files.values()):
+            if not f.est_termine:
+                f.journaliser()
+
+    def liberer(self, journal, termine):
+        """appel� quand la r�ception d'un fichier se termine (termine=True) ou
+        est annul�e: journal est le chemin de son journal (cf. chemin_journal)."""
+        pass
+
+    def est_recu(self, nom, pack):
+        """Retourne True si le fichier du paquet pack (ent�te d�cod�) est d�j� re�u
+        en entier: nom est le nom du fichier en bytes, tel que dans le paquet."""
+        if self.index is None:
+            return False
+        return self.index.est_recu(nom, pack.taille_fichier, pack.date_fichier, pack.crc32)
+
+    def annoncer(self, identifiant, nom, pack):
+        """appel� � la r�ception d'une annonce (pack): l'identifiant (4 octets) d�signe
+        le fichier nom (bytes, d�j� v�rifi�) de m�me taille, date et CRC32 que l'annonce."""
+        if identifiant not in self.identifiants and len(self.identifiants) >= IDENTIFIANTS_MAX:
+            # les annonces sont r�p�t�es: les identifiants encore utiles seront r�appris
+            self.identifiants.clear()
+        self.identifiants[identifiant] = (
+            nom,
+            nom.decode("utf_8", "strict"),
+            pack.taille_fichier,
+            pack.date_fichier,
+            pack.crc32,
+        )
+
+    def identifier(self, identifiant, pack):
+        """Retourne le nom (bytes et str) du fichier d�sign� par l'identifiant d'un
+        paquet (ent�te d�cod�), ou None si son annonce n'a pas �t� re�ue."""
+        entree = self.identifiants.get(identifiant)
+        if (
+            entree is None
+            or entree[2] != pack.taille_fichier
+            or entree[3] != pack.date_fichier
+            or entree[4] != pack.crc32
+        ):
+            return None
+        return entree[:2]
+
+    def oublier(self, nom_fichier):
+        "appel� quand un fichier est effac� � la demande du guichet bas."
+        if self.index is not None:
+            self.index.supprimer(nom_fichier.encode("utf_8"))
+        # sans sa recette ou son delta, le fichier ne sera pas reconstitu� au prochain d�marrage
+        for chemin in (Dedup.chemin_recette(nom_fichier), Delta.chemin_delta(nom_fichier)):
+            try:
+                os.remove(self.chemin_dest / chemin)
+            except OSError:
+                pass
+
+    def fichier_recu(self, nom_fichier):
+        """appel� quand un fichier est re�u en entier et mis en place: une recette
+        est assembl�e, un morceau compl�te les recettes qui l'attendent (cf. Dedup),
+        un delta est appliqu� (cf. Delta)."""
+        if Dedup.nom_recette(nom_fichier) is not None:
+            with self.verrou_recettes:
+                self.assembler(nom_fichier)
+            return
+        if Delta.nom_delta(nom_fichier) is not None:
+            with self.verrou_recettes:
+                self.appliquer_delta(nom_fichier)
+            return
+        sha1 = Dedup.sha1_morceau(nom_fichier)
+        if sha1 is not None:
+            with self.verrou_recettes:
+                for recette in self.recettes_en_attente.pop(sha1, ()):
+                    self.assembler(recette)
+
+    def recevoir_lot(self, donnees):
+        """pour mettre en place les fichiers d'un lot de petits fichiers (cf. Bundle),
+        �crits directement sans fichier partiel ni journal."""
+        nb_recus = 0
+        for nom, date, crc32, contenu in Bundle.lire(donnees):
+            if self.index is not None and self.index.est_recu(nom, len(contenu), date, crc32):
+                continue
+            nom_fichier = nom.decode("utf_8", "strict")
+            if chemin_interdit(nom_fichier):
+                logging.error("nom de fichier ou de chemin incorrect: %s" % nom_fichier)
+                continue
+            fichier_dest = self.chemin_dest / nom_fichier
+            if not deja_recu(fichier_dest, len(contenu), date):
+                temp = chemin_journal(self.chemin_dest, nom_fichier, len(contenu), date, crc32) + ".tmp"
+                try:
+                    os.makedirs(temp.dirname(), exist_ok=True)
+                    with open(temp, "wb") as f:
+                        f.write(contenu)
+                    os.utime(temp, (date, date))
+                    os.makedirs(fichier_dest.dirname(), exist_ok=True)
+                    os.replace(temp, fichier_dest)
+                except OSError as e:
+                    logging.error('Echec de mise en place de "%s": %s' % (nom_fichier, e))
+                    continue
+                logging.info('Fichier "%s" recu (lot).' % nom_fichier)
+                nb_recus += 1
+            if self.index is not None:
+                self.index.ajouter(nom, len(contenu), date, crc32, len(contenu))
+            self.fichier_recu(nom_fichier)
+        if nb_recus:
+            Console.Print_temp("%d fichiers recus (lot)" % nb_recus)
+
+    def reprendre_en_attente(self):
+        """pour reprendre au d�marrage les recettes en attente de morceaux, et les
+        deltas re�us mais pas appliqu�s (arr�t pendant l'application)."""
+        for repertoire, reprendre in (
+            (Dedup.REPERTOIRE_RECETTES, self.assembler),
+            (Delta.REPERTOIRE_DELTAS, self.appliquer_delta),
+        ):
+            for racine, repertoires, fichiers in os.walk(self.chemin_dest / repertoire):
+                for nom in fichiers:
+                    chemin = os.path.relpath(os.path.join(racine, nom), self.chemin_dest).replace(os.sep, "/")
+                    with self.verrou_recettes:
+                        reprendre(chemin)
+
+    def assembler(self, recette):
+        """pour reconstituer le fichier d'une recette � partir du magasin de morceaux,
+        ou la mettre en attente de ses morceaux manquants (verrou_recettes acquis)."""
+        try:
+            taille, date, crc32, morceaux = Dedup.lire_recette(self.chemin_dest / recette)
+        except (OSError, ValueError) as e:
+            logging.error('Recette incorrecte "%s": %s' % (recette, e))
+            return
+        nom_fichier = Dedup.nom_recette(recette)
+        fichier_dest = self.chemin_dest / nom_fichier
+        if deja_recu(fichier_dest, taille, date):
+            self.supprimer_source(recette)
+            return
+        manquants = [sha1 for sha1, t in morceaux if not (self.chemin_dest / Dedup.chemin_morceau(sha1)).isfile()]
+        if manquants:
+            debug('%d morceaux manquants pour "%s"' % (len(manquants), nom_fichier))
+            for sha1 in manquants:
+                self.recettes_en_attente.setdefault(sha1, set()).add(recette)
+            return
+        temp = chemin_journal(self.chemin_dest, recette, taille, date, crc32) + ".asm"
+        try:
+            os.makedirs(temp.dirname(), exist_ok=True)
+            if Dedup.assembler(morceaux, self.chemin_dest, temp) & 0xFFFFFFFF != crc32 & 0xFFFFFFFF:
+                raise ValueError("controle d'integrite incorrect")
+            os.makedirs(fichier_dest.dirname(), exist_ok=True)
+            os.utime(temp, (date, date))
+            os.replace(temp, fichier_dest)
+        except (OSError, ValueError) as e:
+            logging.error('Echec de reconstitution de "%s": %s' % (nom_fichier, e))
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            return
+        self.supprimer_source(recette)
+        msg = 'Fichier "%s" reconstitue a partir de %d morceaux.' % (nom_fichier, len(morceaux))
+        Console.Print_temp(msg, NL=True)
+        logging.info(msg)
+
+    def supprimer_source(self, chemin):
+        """pour supprimer la recette ou le delta d'un fichier reconstitu� (les morceaux
+        d'une recette restent dans le magasin pour les versions suivantes, cf.
+        Dedup.purger_magasin)."""
+        try:
+            os.remove(self.chemin_dest / chemin)
+        except OSError:
+            pass
+
+    def appliquer_delta(self, delta):
+        """pour reconstituer la nouvelle version d'un fichier � partir de sa copie
+        et d'un delta (verrou_recettes acquis)."""
+        try:
+            taille, date, crc32 = Delta.lire_entete(self.chemin_dest / delta)
+        except (OSError, ValueError) as e:
+            logging.error('Delta incorrect "%s": %s' % (delta, e))
+            return
+        nom_fichier = Delta.nom_delta(delta)
+        fichier_dest = self.chemin_dest / nom_fichier
+        if deja_recu(fichier_dest, taille, date):
+            self.supprimer_source(delta)
+            return
+        temp = chemin_journal(self.chemin_dest, delta, taille, date, crc32) + ".asm"
+        try:
+            os.makedirs(temp.dirname(), exist_ok=True)
+            # un bloc de la copie diff�rent de la nouvelle version et absent du delta
+            # (copie d'une version inconnue de l'�metteur) fait �chouer l'application
+            if Delta.appliquer(self.chemin_dest / delta, fichier_dest, temp) != crc32:
+                raise ValueError("controle d'integrite incorrect")
+            os.makedirs(fichier_dest.dirname(), exist_ok=True)
+            os.utime(temp, (date, date))
+            os.replace(temp, fichier_dest)
+        except (OSError, ValueError) as e:
+            logging.error('Echec d\'application du delta de "%s": %s' % (nom_fichier, e))
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            # delta inutilisable (copie d'une autre version): le fichier entier sera re�u
+            # au dernier envoi de cette version (cf. send_delta)
+            self.supprimer_source(delta)
+            return
+        self.supprimer_source(delta)
+        msg = 'Fichier "%s" mis a jour par delta.' % nom_fichier
+        Console.Print_temp(msg, NL=True)
+        logging.info(msg)
+
+
 # ------------------------------------------------------------------------------
 # classe FICHIER
 # -------------------
@@ -250,43 +723,152 @@ def chemin_interdit(chemin):
 class Sender:
     """classe repr�sentant un fichier en cours de r�ception."""
 
-    def __init__(self, paquet):
+    def __init__(self, paquet, recepteur):
         """Constructeur d'objet Fichier.
 
-        paquet: objet paquet contenant les infos du fichier."""
+        paquet: objet paquet contenant les infos du fichier.
+        recepteur: objet Recepteur auquel appartient le fichier."""
 
+        self.recepteur = recepteur
         self.nom_fichier = paquet.nom_fichier
         self.date_fichier = paquet.date_fichier
         self.taille_fichier = paquet.taille_fichier
         self.nb_paquets = paquet.nb_paquets
+        self.crc32 = paquet.crc32  # CRC32 du fichier
+        # fichier compress� (cf. Compression): m�thode et taille une fois d�compress�
+        self.compression = paquet.compression
+        self.taille_originale = paquet.taille_originale
+        # CRC32 de chaque paquet re�u, combin�s � la fin pour v�rifier le fichier
+        self.crc_paquets = array.array("I", bytes(4 * self.nb_paquets))
+        self.taille_paquet = 0  # taille des donn�es d'un paquet (sauf le dernier)
         # chemin du fichier destination
-        self.fichier_dest = CHEMIN_DEST / self.nom_fichier
+        self.fichier_dest = recepteur.chemin_dest / self.nom_fichier
         debug('fichier_dest = "%s"' % self.fichier_dest)
-        # on cr�e le fichier temporaire (objet file):
-        self.fichier_temp = tempfile.NamedTemporaryFile(prefix="BFTP_")
+        # fichier partiel et paquets re�us sont journalis�s sous le r�pertoire
+        # destination, pour reprendre la r�ception apr�s un red�marrage
+        self.journal = chemin_journal(
+            recepteur.chemin_dest, self.nom_fichier, self.taille_fichier, self.date_fichier, self.crc32
+        )
+        self.paquets_recus = self.reprendre_journal()
+        if self.paquets_recus is None:
+            self.paquets_recus = TabBits.TabBits(self.nb_paquets)
+            os.makedirs(self.journal.dirname(), exist_ok=True)
+            # sans troncature: sur plusieurs ports, les workers ont pu y �crire d�j�
+            # droits 0o666 moins l'umask, comme open(): le fichier re�u n'est pas ex�cutable
+            fd = os.open(self.journal + ".part", os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666)
+            self.fichier_temp = open(fd, "r+b")
+            self.preallouer()
+        else:
+            self.fichier_temp = open(self.journal + ".part", "r+b")
         debug('fichier_temp = "%s"' % self.fichier_temp.name)
-        self.paquets_recus = TabBits.TabBits(self.nb_paquets)
+        self.derniere_journalisation = time.monotonic()
         # print 'Reception du fichier "%s"...' % self.nom_fichier
         self.est_termine = False  # flag indiquant une r�ception compl�te
-        self.crc32 = paquet.crc32  # CRC32 du fichier
+        self.pourcent_affiche = -1  # dernier pourcentage affiche
+        # parit�s FEC re�ues (fichier temporaire cr�� au premier paquet FEC)
+        self.fichier_parites = None
+        self.taille_bloc = 0  # taille des donn�es d'un paquet (et d'une parit�)
+        self.taille_groupe = 0  # nombre de paquets couverts par une parit�
+        self.groupes_parite = set()  # groupes incomplets dont la parit� est stock�e
+        # mode fontaine: d�codeurs des blocs en cours, paquets manquants par bloc
+        self.decodeurs = {}
+        self.manquants_bloc = {}
+        self.paquets_par_bloc = 0
         # on ne doit pas traiter le paquet automatiquement, sinon il peut
         # y avoir des probl�mes d'ordre des actions
         # self.traiter_paquet(paquet)
 
+    def preallouer(self):
+        """pour r�server d'embl�e la place du fichier sur le disque: moins de
+        fragmentation, et un disque plein est d�tect� d�s le premier paquet."""
+        fd = self.fichier_temp.fileno()
+        if self.taille_fichier and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, self.taille_fichier)
+                return
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                    raise
+        # pas de posix_fallocate (Windows, syst�me de fichiers non support�)
+        os.ftruncate(fd, self.taille_fichier)
+
+    def reprendre_journal(self):
+        """pour reprendre une r�ception interrompue: retourne le TabBits des
+        paquets d�j� re�us, ou None s'il n'y a pas de journal valide."""
+        try:
+            with open(self.journal + ".bits", "rb") as f:
+                entete = f.read(struct.calcsize(FORMAT_JOURNAL))
+                if struct.unpack(FORMAT_JOURNAL, entete) != (
+                    self.taille_fichier,
+                    self.date_fichier,
+                    self.nb_paquets,
+                    self.crc32,
+                ):
+                    # d�coupage diff�rent (taille de paquet, FEC...): on recommence
+                    return None
+                paquets_recus = TabBits.TabBits(self.nb_paquets, readFile=f)
+                (self.taille_paquet,) = struct.unpack("I", f.read(4))
+                crc_paquets = f.read(4 * self.nb_paquets)
+                if len(crc_paquets) != 4 * self.nb_paquets:
+                    return None
+                self.crc_paquets = array.array("I", crc_paquets)
+            if not os.path.isfile(self.journal + ".part"):
+                return None
+        except (IOError, OSError, ValueError, struct.error):
+            return None
+        msg = 'Reprise de "%s" (%d/%d paquets)' % (self.nom_fichier, paquets_recus.nb_true, self.nb_paquets)
+        Console.Print_temp(msg, NL=True)
+        logging.info(msg)
+        return paquets_recus
+
+    def journaliser(self):
+        """pour enregistrer la liste des paquets re�us, une fois les donn�es
+        �crites sur disque (le journal ne doit pas annoncer de donn�es perdues)."""
+        if self.fichier_temp.closed:
+            return
+        self.fichier_temp.flush()
+        os.fsync(self.fichier_temp.fileno())
+        temp = self.journal + ".bits.tmp"
+        with open(temp, "wb") as f:
+            f.write(struct.pack(FORMAT_JOURNAL, self.taille_fichier, self.date_fichier, self.nb_paquets, self.crc32))
+            f.write(self.paquets_recus.export())
+            f.write(struct.pack("I", self.taille_paquet))
+            f.write(self.crc_paquets.tobytes())
+        os.replace(temp, self.journal + ".bits")
+        self.derniere_journalisation = time.monotonic()
+
+    def supprimer_journal(self):
+        "pour supprimer le journal de r�ception du fichier."
+        for extension in (".part", ".bits", ".dec"):
+            try:
+                os.remove(self.journal + extension)
+            except OSError:
+                pass
+
+    def echec_reception(self):
+        "pour abandonner un fichier complet mais incorrect: il sera re�u � nouveau."
+        self.annuler_reception()
+        if self.recepteur.files.get(self.nom_fichier) is self:
+            del self.recepteur.files[self.nom_fichier]
+
     def annuler_reception(self):
         "pour annuler la r�ception d'un fichier en cours."
-        # on ferme et on supprime le fichier temporaire
+        # on ferme et on supprime le fichier partiel
         # seulement s'il est effectivement ouvert
         # (sinon � l'initialisation c'est un entier)
-        if isinstance(self.fichier_temp, file):
+        if not isinstance(self.fichier_temp, int):
             if not self.fichier_temp.closed:
                 self.fichier_temp.close()
-        # d'apr�s la doc de tempfile, le fichier est automatiquement supprim�
-        # os.remove(self.nom_temp)
+        if self.fichier_parites is not None:
+            self.fichier_parites.close()
+        self.supprimer_journal()
+        self.recepteur.liberer(self.journal, False)
         debug("Reception de fichier annulee.")
 
     def recopier_destination(self):
-        "pour recopier le fichier � destination une fois qu'il est termin�."
+        """pour mettre le fichier � destination une fois qu'il est termin�:
+        le fichier partiel est v�rifi�, puis renomm� (sans recopie, il est
+        sur le m�me syst�me de fichiers que le r�pertoire destination)."""
         print("OK, fichier termine.")
         # cr�er le chemin destination si besoin avec makedirs
         chemin_dest = self.fichier_dest.dirname()
@@ -295,43 +877,69 @@ class Sender:
         elif not os.path.isdir(chemin_dest):
             chemin_dest.remove()
             chemin_dest.mkdir()
-        # recopier le fichier temporaire au bon endroit
-        debug("Recopie de %s vers %s..." % (self.fichier_temp.name, self.fichier_dest))
-        # move(self.nom_temp, self.fichier_dest)
-        # on revient au d�but
-        self.fichier_temp.seek(0)
-        f_dest = file(self.fichier_dest, "wb")
-        buffer = self.fichier_temp.read(16384)
-        # on d�marre le calcul de CRC32:
-        crc32 = binascii.crc32(buffer)
-        while len(buffer) != 0:
-            f_dest.write(buffer)
-            buffer = self.fichier_temp.read(16384)
-            # poursuite du calcul de CRC32:
-            crc32 = binascii.crc32(buffer, crc32)
-        f_dest.close()
+        # v�rifier le fichier partiel avant de le mettre en place
+        debug("Verification de %s..." % self.fichier_temp.name)
+        self.fichier_temp.flush()
         # v�rifier si la taille obtenue est correcte
-        if self.fichier_dest.getsize() != self.taille_fichier:
-            debug("taille_fichier = %d, taille obtenue = %d" % (self.taille_fichier, self.fichier_dest.getsize()))
+        taille = os.fstat(self.fichier_temp.fileno()).st_size
+        taille_dernier = self.taille_fichier - (self.nb_paquets - 1) * self.taille_paquet
+        if self.nb_paquets > 1 and not 0 < taille_dernier <= self.taille_paquet:
+            # d�coupage incoh�rent: la taille reconstitu�e est fausse
+            taille = -1
+        if taille != self.taille_fichier:
+            debug("taille_fichier = %d, taille obtenue = %d" % (self.taille_fichier, taille))
             logging.error('Taille du fichier incorrecte: "%s"' % self.nom_fichier)
+            self.echec_reception()
             raise IOError("taille du fichier incorrecte.")
-        # v�rifier si le checksum CRC32 est correct
-        if self.crc32 != crc32:
+        # v�rifier si le checksum CRC32 est correct, sans relire le fichier:
+        # il est obtenu en combinant les CRC32 des paquets calcul�s � la r�ception
+        # (le CRC32 de l'entete est sign�, binascii.crc32 ne l'est pas sous Python 3)
+        crc32 = CRC.crc32_paquets(self.crc_paquets, self.taille_paquet, self.taille_fichier)
+        if self.crc32 & 0xFFFFFFFF != crc32 & 0xFFFFFFFF:
             debug("CRC32 fichier = %X, CRC32 attendu = %X" % (crc32, self.crc32))
             logging.error('Controle d\'integrite incorrect: "%s"' % self.nom_fichier)
+            self.echec_reception()
             raise IOError("controle d'integrite incorrect.")
-        # mettre � jour la date de modif: tuple (atime,mtime)
-        self.fichier_dest.utime((self.date_fichier, self.date_fichier))
-        # fermer le fichier temporaire
         self.fichier_temp.close()
-        # d'apr�s la doc de tempfile, le fichier est automatiquement supprim�
+        if self.fichier_parites is not None:
+            self.fichier_parites.close()
+        fichier_recu = self.journal + ".part"
+        if self.compression:
+            # donn�es compress�es: d�compression � c�t� du fichier partiel
+            fichier_recu = self.journal + ".dec"
+            debug("Decompression de %s..." % (self.journal + ".part"))
+            try:
+                taille = Compression.decompresser(self.journal + ".part", fichier_recu, self.compression)
+            except ValueError as e:
+                debug(str(e))
+                taille = -1
+            if taille != self.taille_originale:
+                logging.error('Decompression du fichier incorrecte: "%s"' % self.nom_fichier)
+                self.echec_reception()
+                raise IOError("decompression du fichier incorrecte.")
+        # mettre � jour la date de modif: tuple (atime,mtime)
+        os.utime(fichier_recu, (self.date_fichier, self.date_fichier))
+        # renommage atomique: le fichier destination est complet ou absent
+        debug("Renommage de %s en %s..." % (fichier_recu, self.fichier_dest))
+        os.replace(fichier_recu, self.fichier_dest)
+        self.supprimer_journal()
+        if self.recepteur.index is not None:
+            self.recepteur.index.ajouter(
+                self.nom_fichier.encode("utf_8"),
+                self.taille_fichier,
+                self.date_fichier,
+                self.crc32,
+                self.taille_originale,
+            )
+        self.recepteur.liberer(self.journal, True)
         self.fichier_en_cours = False
         # Affichage de fin de traitement
         debug("Fichier termine.")
         logging.info('Fichier "%s" recu en entier, recopie a destination.' % self.nom_fichier)
         # dans ce cas on retire le fichier du dictionnaire
         self.est_termine = True
-        del files[self.nom_fichier]
+        del self.recepteur.files[self.nom_fichier]
+        self.recepteur.fichier_recu(self.nom_fichier)
 
     def traiter_paquet(self, paquet):
         "pour traiter un paquet contenant un morceau du fichier."
@@ -342,26 +950,159 @@ class Sender:
             # paquet contient la m�me longueur de donn�es:
             # offset = paquet.num_paquet * paquet.taille_donnees
             # debug("offset = %d" % offset)
-            self.fichier_temp.seek(paquet.offset)
             # note: si on d�place le curseur apr�s la fin r�elle du fichier,
             # celui-ci est compl�t� d'octets nuls, ce qui nous arrange bien :-).
-            self.fichier_temp.write(paquet.donnees)
-            debug("offset apres = %d" % self.fichier_temp.tell())
-            self.paquets_recus.set(paquet.num_paquet, True)
-            pourcent = 100 * (self.paquets_recus.nb_true) / self.nb_paquets
+            if paquet.donnees is None:
+                # donn�es d�j� �crites par le worker d'un port (cf. PackPort)
+                self.noter_paquet(paquet.num_paquet, paquet.taille_donnees, paquet.crc_paquet)
+            else:
+                self.ecrire_paquet(paquet.num_paquet, paquet.offset, paquet.donnees, paquet.crc_paquet)
+            if MODE_DEBUG:
+                debug("offset apres = %d" % self.fichier_temp.tell())
+            self.marquer_recu(paquet.num_paquet)
+            if self.groupes_parite:
+                groupe = paquet.num_paquet // self.taille_groupe
+                if groupe in self.groupes_parite:
+                    self.reparer_groupe(groupe)
+            if self.decodeurs:
+                # paquet re�u hors mode fontaine: les symboles en attente n'en d�pendent plus
+                bloc, i = divmod(paquet.num_paquet, self.paquets_par_bloc)
+                decodeur = self.decodeurs.get(bloc)
+                if decodeur is not None:
+                    self.fin_paquet_bloc(bloc)
+                    decodeur.propager(i)
+
+    def ecrire_paquet(self, num_paquet, offset, donnees, crc_paquet=None):
+        """pour �crire les donn�es d'un paquet dans le fichier partiel, et noter
+        leur CRC32 (crc_paquet: CRC32 d�j� v�rifi� � la r�ception, s'il y en a un)."""
+        self.fichier_temp.seek(offset)
+        self.fichier_temp.write(donnees)
+        if crc_paquet is None:
+            crc_paquet = binascii.crc32(donnees)
+        self.noter_paquet(num_paquet, len(donnees), crc_paquet)
+
+    def noter_paquet(self, num_paquet, taille, crc_paquet):
+        "pour noter le CRC32 et la taille des donn�es d'un paquet �crit."
+        self.crc_paquets[num_paquet] = crc_paquet
+        if num_paquet < self.nb_paquets - 1:
+            self.taille_paquet = taille
+
+    def traiter_parite(self, paquet):
+        "pour traiter un paquet FEC contenant la parit� d'un groupe de paquets."
+        if self.fichier_parites is None:
+            self.fichier_parites = tempfile.TemporaryFile(prefix="BFTP_FEC_")
+            self.taille_bloc = len(paquet.donnees)
+            self.taille_groupe = paquet.taille_groupe
+        elif len(paquet.donnees) != self.taille_bloc or paquet.taille_groupe != self.taille_groupe:
+            raise ValueError("parametres FEC incoherents")
+        groupe = paquet.num_paquet // self.taille_groupe
+        if groupe in self.groupes_parite:
+            return
+        self.fichier_parites.seek(groupe * self.taille_bloc)
+        self.fichier_parites.write(paquet.donnees)
+        self.groupes_parite.add(groupe)
+        self.reparer_groupe(groupe)
+
+    def reparer_groupe(self, groupe):
+        """pour reconstruire le paquet manquant d'un groupe � partir de sa
+        parit�, quand il n'en manque qu'un seul."""
+        premier, fin = FEC.bornes_groupe(groupe, self.taille_groupe, self.nb_paquets)
+        manquants = [n for n in range(premier, fin) if not self.paquets_recus.get(n)]
+        if len(manquants) > 1:
+            # pas encore r�parable, on garde la parit�
+            return
+        self.groupes_parite.discard(groupe)
+        if not manquants:
+            return
+        num_paquet = manquants[0]
+        self.fichier_parites.seek(groupe * self.taille_bloc)
+        parite = self.fichier_parites.read(self.taille_bloc)
+        blocs = []
+        for n in range(premier, fin):
+            if n != num_paquet:
+                self.fichier_temp.seek(n * self.taille_bloc)
+                blocs.append(self.fichier_temp.read(self.taille_bloc))
+        offset = num_paquet * self.taille_bloc
+        taille = min(self.taille_bloc, self.taille_fichier - offset)
+        self.ecrire_paquet(num_paquet, offset, FEC.reparer(parite, blocs, taille))
+        debug("paquet %d reconstruit par FEC" % num_paquet)
+        self.recepteur.stats.nb_repares += 1
+        self.marquer_recu(num_paquet)
+
+    def traiter_symbole(self, paquet):
+        "pour traiter un symbole du mode fontaine, cod� sur un bloc de paquets."
+        bloc = paquet.num_paquet
+        decodeur = self.decodeurs.get(bloc)
+        if decodeur is None:
+            if self.manquants_bloc.get(bloc) == 0:
+                # bloc d�j� d�cod�
+                return
+            if not self.paquets_par_bloc:
+                self.taille_bloc = len(paquet.donnees)
+                self.paquets_par_bloc = paquet.paquets_par_bloc
+            elif len(paquet.donnees) != self.taille_bloc or paquet.paquets_par_bloc != self.paquets_par_bloc:
+                raise ValueError("parametres fontaine incoherents")
+            decodeur = self.nouveau_decodeur(bloc)
+            if decodeur is None:
+                return
+        liste = Fountain.voisins(bloc, paquet.esi, decodeur.k)
+        decodeur.ajouter(liste, int.from_bytes(paquet.donnees, "little"))
+
+    def nouveau_decodeur(self, bloc):
+        "pour cr�er le d�codeur fontaine d'un bloc (None s'il est d�j� complet)."
+        premier = bloc * self.paquets_par_bloc
+        k = min(self.paquets_par_bloc, self.nb_paquets - premier)
+        manquants = k - sum(1 for i in range(premier, premier + k) if self.paquets_recus.get(i))
+        self.manquants_bloc[bloc] = manquants
+        if not manquants:
+            return None
+        taille = self.taille_bloc
+
+        def connu(i):
+            return self.paquets_recus.get(premier + i)
+
+        def lire(i):
+            self.fichier_temp.seek((premier + i) * taille)
+            return int.from_bytes(self.fichier_temp.read(taille), "little")
+
+        def ecrire(i, valeur):
+            offset = (premier + i) * taille
+            self.ecrire_paquet(premier + i, offset, valeur.to_bytes(taille, "little")[: self.taille_fichier - offset])
+            self.fin_paquet_bloc(bloc)
+            self.marquer_recu(premier + i)
+
+        decodeur = Fountain.Decodeur(k, connu, lire, ecrire)
+        self.decodeurs[bloc] = decodeur
+        return decodeur
+
+    def fin_paquet_bloc(self, bloc):
+        "pour d�compter un paquet manquant du bloc, et lib�rer son d�codeur � la fin."
+        self.manquants_bloc[bloc] -= 1
+        if not self.manquants_bloc[bloc]:
+            del self.decodeurs[bloc]
+
+    def marquer_recu(self, num_paquet):
+        "pour marquer un paquet comme re�u, et terminer le fichier s'il est complet."
+        self.paquets_recus.set(num_paquet, True)
+        if time.monotonic() - self.derniere_journalisation > JOURNAL_DELAI:
+            if self.paquets_recus.nb_true < self.nb_paquets:
+                self.journaliser()
+        pourcent = 100 * (self.paquets_recus.nb_true) // self.nb_paquets
+        if pourcent != self.pourcent_affiche:
             # affichage du pourcentage: la virgule �vite un retour chariot
             print("%d%%\r" % pourcent)
             # pour forcer la mise � jour de l'affichage
             sys.stdout.flush()
-            # si le fichier est termin�, on le recopie � destination:
-            if self.paquets_recus.nb_true == self.nb_paquets:
-                # on va � la ligne
-                # print ""
-                # Mise en thread de la recopie afin de liberer de la ressource pour la r�ception
-                recopie = threading.Thread(None, self.recopier_destination, None, ())
-                recopie.start()
-                # ...et on suppose qu'il n'y a plus d'autres r�f�rences:
-                # le garbage collector devrait le supprimer de la m�moire.
+            self.pourcent_affiche = pourcent
+        # si le fichier est termin�, on le recopie � destination:
+        if self.paquets_recus.nb_true == self.nb_paquets:
+            # on va � la ligne
+            # print ""
+            # Mise en thread de la recopie afin de liberer de la ressource pour la r�ception
+            recopie = threading.Thread(None, self.recopier_destination, None, ())
+            recopie.start()
+            # ...et on suppose qu'il n'y a plus d'autres r�f�rences:
+            # le garbage collector devrait le supprimer de la m�moire.
 
 
 # ------------------------------------------------------------------------------
@@ -373,8 +1114,11 @@ class Pack:
     """classe repr�sentant un paquet BFTP, permettant la construction et le
     d�codage du paquet."""
 
-    def __init__(self):
-        "Constructeur d'objet Paquet BFTP."
+    def __init__(self, recepteur=None):
+        """Constructeur d'objet Paquet BFTP.
+
+        recepteur: objet Recepteur destinataire des paquets d�cod�s."""
+        self.recepteur = recepteur
         # on initialise les infos contenues dans l'ent�te du paquet
         self.type_paquet = PACKAGE_FILE
         self.longueur_nom = 0
@@ -389,115 +1133,143 @@ class Pack:
         self.fichier_en_cours = ""
         self.num_session = -1
         self.num_paquet_session = -1
+        self.taille_groupe = 0  # paquets FEC: nombre de paquets couverts
+        self.esi = 0  # paquets fontaine: num�ro du symbole dans le bloc
+        self.paquets_par_bloc = 0  # paquets fontaine: taille des blocs
+        self.crc_paquet = None  # paquets avec checksum: CRC32 des donn�es
+        self.compression = 0  # paquets compress�s: m�thode (cf. Compression)
+        self.taille_originale = 0  # taille du fichier destination (d�compress�)
+        self.identifiant = False  # mode identifiants: le champ nom porte l'identifiant du fichier
+        # faux avec plusieurs workers: les stats sont compt�es � la r�ception (cf. receive)
+        self.compter_stats = True
 
     def decoder(self, paquet):
         "Pour d�coder un paquet BFTP."
-        # on d�code d'abord l'ent�te (cf. d�but de ce fichier):
-        entete = paquet[0:SIZE_ENTETE]
-        (
-            self.type_paquet,
-            self.longueur_nom,
-            self.taille_donnees,
-            self.offset,
-            self.num_session,
-            self.num_paquet_session,
-            self.num_paquet,
-            self.nb_paquets,
-            self.taille_fichier,
-            self.date_fichier,
-            self.crc32,
-        ) = struct.unpack(FORMAT_ENTETE, entete)
-        debug("type_paquet        = %d" % self.type_paquet)
-        debug("longueur_nom       = %d" % self.longueur_nom)
-        debug("taille_donnees     = %d" % self.taille_donnees)
-        debug("offset             = %d" % self.offset)
-        debug("num_session        = %d" % self.num_session)
-        debug("num_paquet_session = %d" % self.num_paquet_session)
-        debug("num_paquet         = %d" % self.num_paquet)
-        debug("nb_paquets         = %d" % self.nb_paquets)
-        debug("taille_fichier     = %d" % self.taille_fichier)
-        debug("date_fichier       = %s" % mtime2str(self.date_fichier))
-        debug("CRC32              = %08X" % self.crc32)
-        if self.type_paquet not in [PACKAGE_FILE, PACKAGE_HEARTBEAT, PACKAGE_DELETEFile]:
-            raise ValueError(msg="type de paquet incorrect")
-        if self.type_paquet == PACKAGE_FILE:
+        # on d�code d'abord l'ent�te (cf. d�but de ce fichier), sans copie:
+        codec.decoder_entete(paquet, self)
+        if MODE_DEBUG:
+            for ligne in codec.trace(self):
+                debug(ligne)
+        if (self.type_paquet & MASQUE_TYPE) in TYPES_FICHIER:
+            # extension de compression, en t�te des extensions
+            taille_extension = self.decoder_compression(paquet)
+        elif self.type_paquet not in TYPES_PAQUETS:
+            raise ValueError("type de paquet incorrect")
+        if self.type_paquet in TYPES_FICHIER:
+            # parit� ou symbole suivi du CRC32 de ses donn�es: trait� ensuite comme sans checksum
+            checksum = self.type_paquet in TYPES_CRC
+            if checksum:
+                self.type_paquet = TYPES_CRC[self.type_paquet]
             if self.longueur_nom > MAX_FILE_NAME:
-                raise ValueError(msg="nom de fichier trop long")
-            if self.offset + self.taille_donnees > self.taille_fichier:
-                raise ValueError(msg="offset ou taille des donnees incorrects")
-            self.nom_fichier = paquet[SIZE_ENTETE : SIZE_ENTETE + self.longueur_nom]
-            # conversion en utf-8 pour �viter probl�mes d�s aux accents
-            # A VOIR: seulement sous Windows ?? (sous Mac �a pose probl�me...)
-            if sys.platform == "win32":
-                self.nom_fichier = self.nom_fichier.decode("utf_8", "strict")
-            ##debug("nom_fichier    = %s" % self.nom_fichier)
-            if chemin_interdit(self.nom_fichier):
-                logging.error("nom de fichier ou de chemin incorrect: %s" % self.nom_fichier)
-                raise ValueError(msg="nom de fichier ou de chemin incorrect")
-            taille_entete_complete = SIZE_ENTETE + self.longueur_nom
+                raise ValueError("nom de fichier trop long")
+            if self.num_paquet >= self.nb_paquets:
+                raise ValueError("numero de paquet incorrect")
+            nom = codec.nom(paquet, self.longueur_nom)
+            if self.identifiant:
+                # nom du fichier d'apr�s son annonce, d�j� v�rifi�
+                entree = self.recepteur.identifier(nom, self)
+                if entree is None:
+                    # annonce pas encore re�ue (perdue): paquet ignor�, il sera re�u au prochain envoi
+                    if self.compter_stats:
+                        self.recepteur.stats.add_package(self)
+                    debug("Paquet d'un fichier non annonce, ignore.")
+                    return
+                nom, self.nom_fichier = entree
+            if self.recepteur.est_recu(nom, self):
+                # fichier d�j� re�u en entier (envoi en boucle): ignor� d'apr�s l'ent�te
+                if self.compter_stats:
+                    self.recepteur.stats.add_package(self)
+                return
+            debut_extension = SIZE_ENTETE + self.longueur_nom + taille_extension
+            self.crc_paquet = None
+            if self.type_paquet == PACKAGE_FEC:
+                # la parit� couvre des paquets entiers: elle peut d�passer la fin du fichier
+                taille_extension += FEC.TAILLE_EXTENSION
+                (self.taille_groupe,) = FEC.EXTENSION.unpack_from(paquet, debut_extension)
+                if self.taille_groupe == 0 or self.num_paquet % self.taille_groupe:
+                    raise ValueError("groupe FEC incorrect")
+            elif self.type_paquet == PACKAGE_FOUNTAIN:
+                # num_paquet est le num�ro du bloc, le symbole peut d�passer la fin du fichier
+                taille_extension += Fountain.TAILLE_EXTENSION
+                (self.esi, self.paquets_par_bloc) = Fountain.EXTENSION.unpack_from(paquet, debut_extension)
+                # blocs de Fountain.TAILLE_BLOC paquets au plus (cf. send_symbols): un bloc plus
+                # grand ferait garder au d�codeur autant de symboles en attente
+                if (
+                    self.paquets_par_bloc == 0
+                    or self.paquets_par_bloc > Fountain.TAILLE_BLOC
+                    or self.num_paquet * self.paquets_par_bloc >= self.nb_paquets
+                ):
+                    raise ValueError("bloc fontaine incorrect")
+            elif self.offset + self.taille_donnees > self.taille_fichier:
+                raise ValueError("offset ou taille des donnees incorrects")
+            elif self.type_paquet == PACKAGE_FILE_CRC:
+                taille_extension += CRC.TAILLE_EXTENSION
+                (self.crc_paquet,) = CRC.EXTENSION.unpack_from(paquet, debut_extension)
+            if checksum:
+                # apr�s l'extension FEC ou fontaine
+                debut_crc = SIZE_ENTETE + self.longueur_nom + taille_extension
+                (self.crc_paquet,) = CRC.EXTENSION.unpack_from(paquet, debut_crc)
+                taille_extension += CRC.TAILLE_EXTENSION
+            if not self.identifiant:
+                # le nom est transmis en utf-8 (cf. send)
+                self.nom_fichier = nom.decode("utf_8", "strict")
+                ##debug("nom_fichier    = %s" % self.nom_fichier)
+                if chemin_interdit(self.nom_fichier):
+                    logging.error("nom de fichier ou de chemin incorrect: %s" % self.nom_fichier)
+                    raise ValueError("nom de fichier ou de chemin incorrect")
+            taille_entete_complete = SIZE_ENTETE + self.longueur_nom + taille_extension
             if self.taille_donnees != len(paquet) - taille_entete_complete:
                 debug("taille_paquet = %d" % len(paquet))
                 debug("taille_entete_complete = %d" % taille_entete_complete)
-                raise ValueError(msg="taille de donnees incorrecte")
-            self.donnees = paquet[taille_entete_complete : len(paquet)]
+                raise ValueError("taille de donnees incorrecte")
+            # memoryview sur le datagramme: pas de copie des donnees
+            self.donnees = codec.donnees(paquet, self.longueur_nom, taille_extension)
+            if self.crc_paquet is not None and binascii.crc32(self.donnees) != self.crc_paquet:
+                # donn�es corrompues: le paquet est ignor�, il sera re�u au prochain envoi
+                self.recepteur.stats.nb_corrompus += 1
+                msg = 'Paquet %d de "%s" corrompu, ignore.' % (self.num_paquet, self.nom_fichier)
+                debug(msg)
+                logging.warning(msg)
+                return
             # on mesure les stats, et on les affiche tous les 100 paquets
-            stats.add_package(self)
+            if self.compter_stats:
+                self.recepteur.stats.add_package(self)
             # if self.num_paquet_session % 100 == 0:
-            # stats.print_stats()
-            # est-ce que le fichier est en cours de r�ception ?
-            if self.nom_fichier in files:
-                debug("Fichier en cours de reception")
-                f = files[self.nom_fichier]
-                # on v�rifie si le fichier n'a pas chang�:
-                if (
-                    f.date_fichier != self.date_fichier
-                    or f.taille_fichier != self.taille_fichier
-                    or f.crc32 != self.crc32
-                ):
-                    # on commence par annuler la r�ception en cours:
-                    f.annuler_reception()
-                    del files[self.nom_fichier]
-                    # puis on recr�e un nouvel objet fichier d'apr�s les infos du paquet:
-                    self.nouveau_fichier()
-                else:
-                    if self.fichier_en_cours != self.nom_fichier:
-                        # on change de fichier
-                        msg = 'Suite de "%s"...' % self.nom_fichier
-                        heure = time.strftime("%d/%m %H:%M ")
-                        # V�rifier si un NL est n�cessaire ou non
-                        Console.Print_temp(msg, NL=True)
-                        logging.info(msg)
-                        self.fichier_en_cours = self.nom_fichier
-                    f.traiter_paquet(self)
-            else:
-                # est-ce que le fichier existe d�j� sur le disque ?
-                fichier_dest = CHEMIN_DEST / self.nom_fichier
-                ##debug('fichier_dest = "%s"' % fichier_dest)
-                # si la date et la taille du fichier n'ont pas chang�,
-                # inutile de recr�er le fichier, on l'ignore:
-                if (
-                    fichier_dest.exists()
-                    and fichier_dest.getsize() == self.taille_fichier
-                    and fichier_dest.getmtime() == self.date_fichier
-                ):
-                    # debug("Le fichier n'a pas change, on l'ignore.")
-                    msg = "Fichier deja recu: %s" % self.nom_fichier
-                    # msg = str_ajuste(msg)+'\r'
-                    # print_oem(msg),
-                    Console.Print_temp(msg)
-                    sys.stdout.flush()
-                else:
-                    # sinon on cr�e un nouvel objet fichier d'apr�s les infos du paquet:
-                    self.nouveau_fichier()
+            # self.recepteur.stats.print_stats()
+            self.aiguiller()
+        if self.type_paquet == PACKAGE_ANNOUNCE:
+            taille_annonce = SIZE_ENTETE + self.longueur_nom + IDENTIFIANT.size
+            if self.taille_donnees != IDENTIFIANT.size or len(paquet) != taille_annonce:
+                raise ValueError("annonce incorrecte")
+            nom = codec.nom(paquet, self.longueur_nom)
+            nom_fichier = nom.decode("utf_8", "strict")
+            if chemin_interdit(nom_fichier):
+                logging.error("nom de fichier ou de chemin incorrect: %s" % nom_fichier)
+                raise ValueError("nom de fichier ou de chemin incorrect")
+            if self.compter_stats:
+                self.recepteur.stats.add_package(self)
+            self.recepteur.annoncer(codec.donnees(paquet, self.longueur_nom).tobytes(), nom, self)
+        if self.type_paquet == PACKAGE_BUNDLE:
+            if self.taille_donnees != len(paquet) - SIZE_ENTETE - self.longueur_nom:
+                raise ValueError("taille de donnees incorrecte")
+            donnees = codec.donnees(paquet, self.longueur_nom)
+            if binascii.crc32(donnees) & 0xFFFFFFFF != self.crc32 & 0xFFFFFFFF:
+                # lot corrompu: ignor�, ses fichiers seront re�us au prochain envoi
+                self.recepteur.stats.nb_corrompus += 1
+                msg = "Lot de %d fichiers corrompu, ignore." % self.taille_fichier
+                debug(msg)
+                logging.warning(msg)
+                return
+            if self.compter_stats:
+                self.recepteur.stats.add_package(self)
+            self.recepteur.recevoir_lot(donnees)
         if self.type_paquet == PACKAGE_HEARTBEAT:
             debug("Reception HEARTBEAT")
-            HeartBeat.check_heartbeat(hb_reciver, self.num_session, self.num_paquet_session, self.num_paquet)
+            self.recepteur.heartbeat.check_heartbeat(self.num_session, self.num_paquet_session, self.num_paquet)
         if self.type_paquet == PACKAGE_DELETEFile:
             debug("Reception DeleteFile notification")
-            self.nom_fichier = paquet[SIZE_ENTETE : SIZE_ENTETE + self.longueur_nom]
-            if sys.platform == "win32":
-                self.nom_fichier = self.nom_fichier.decode("utf_8", "strict")
-            fichier_dest = CHEMIN_DEST / self.nom_fichier
+            self.nom_fichier = codec.nom(paquet, self.longueur_nom).decode("utf_8", "strict")
+            fichier_dest = self.recepteur.chemin_dest / self.nom_fichier
             # Test pour bloquer en pr�sence de caracteres joker ou autres
             if chemin_interdit(self.nom_fichier):
                 msg = 'Notification pour effacement suspecte "%s"...' % self.nom_fichier
@@ -505,6 +1277,7 @@ class Pack:
                 logging.error(msg)
             else:
                 msg = 'Effacement de "%s"...' % self.nom_fichier
+                self.recepteur.oublier(self.nom_fichier)
                 if fichier_dest.isfile():
                     try:
                         os.remove(fichier_dest)
@@ -524,6 +1297,105 @@ class Pack:
                         Console.Print_temp(msg, NL=True)
                         logging.warn(msg)
 
+    def decoder_compression(self, paquet):
+        """Pour d�coder la compression (cf. Compression) et le mode identifiants d'un
+        paquet de fichier (bits de poids fort du type): retourne la taille de
+        l'extension de compression."""
+        self.identifiant = bool(self.type_paquet & DRAPEAU_IDENTIFIANT)
+        self.compression = self.type_paquet & Compression.MASQUE
+        self.type_paquet &= MASQUE_TYPE
+        self.taille_originale = self.taille_fichier
+        if not self.compression:
+            return 0
+        if self.compression not in Compression.METHODES.values():
+            raise ValueError("compression incorrecte")
+        (self.taille_originale,) = Compression.EXTENSION.unpack_from(paquet, SIZE_ENTETE + self.longueur_nom)
+        return Compression.TAILLE_EXTENSION
+
+    def decoder_ecrit(self, entete, crc_paquet, generation):
+        """Pour traiter un paquet de fichier dont les donn�es ont d�j� �t� v�rifi�es
+        et �crites dans le fichier partiel par le worker d'un port (cf. PackPort).
+
+        entete: ent�te, nom et extension de compression du paquet
+        crc_paquet: CRC32 des donn�es
+        generation: nombre d'annulations de la r�ception vues par le worker
+        (cf. RecepteurPorts.est_perime)"""
+        codec.decoder_entete(entete, self)
+        self.decoder_compression(entete)
+        nom = codec.nom(entete, self.longueur_nom)
+        if self.compter_stats:
+            self.recepteur.stats.add_package(self)
+        if self.identifiant:
+            entree = self.recepteur.identifier(nom, self)
+            if entree is None:
+                return
+            nom, self.nom_fichier = entree
+        else:
+            self.nom_fichier = nom.decode("utf_8", "strict")
+        if self.recepteur.est_recu(nom, self):
+            return
+        if self.recepteur.est_perime(self, generation):
+            # donn�es �crites dans le fichier partiel supprim�: le paquet sera re�u au prochain envoi
+            debug("Paquet d'une reception annulee, ignore.")
+            return
+        self.donnees = None
+        self.crc_paquet = crc_paquet
+        self.aiguiller()
+
+    def aiguiller(self):
+        "pour transmettre un paquet de fichier d�cod� au fichier en cours de r�ception."
+        # est-ce que le fichier est en cours de r�ception ?
+        files = self.recepteur.files
+        if self.nom_fichier in files:
+            debug("Fichier en cours de reception")
+            f = files[self.nom_fichier]
+            # on v�rifie si le fichier n'a pas chang�:
+            if (
+                f.date_fichier != self.date_fichier
+                or f.taille_fichier != self.taille_fichier
+                or f.crc32 != self.crc32
+            ):
+                # on commence par annuler la r�ception en cours:
+                f.annuler_reception()
+                del files[self.nom_fichier]
+                # puis on recr�e un nouvel objet fichier d'apr�s les infos du paquet:
+                self.nouveau_fichier()
+            else:
+                if self.fichier_en_cours != self.nom_fichier:
+                    # on change de fichier
+                    msg = 'Suite de "%s"...' % self.nom_fichier
+                    heure = time.strftime("%d/%m %H:%M ")
+                    # V�rifier si un NL est n�cessaire ou non
+                    Console.Print_temp(msg, NL=True)
+                    logging.info(msg)
+                    self.fichier_en_cours = self.nom_fichier
+                self.transmettre(f)
+        else:
+            # est-ce que le fichier existe d�j� sur le disque ?
+            fichier_dest = self.recepteur.chemin_dest / self.nom_fichier
+            ##debug('fichier_dest = "%s"' % fichier_dest)
+            # si la date et la taille du fichier n'ont pas chang�,
+            # inutile de recr�er le fichier, on l'ignore:
+            if deja_recu(fichier_dest, self.taille_originale, self.date_fichier):
+                # debug("Le fichier n'a pas change, on l'ignore.")
+                msg = "Fichier deja recu: %s" % self.nom_fichier
+                # msg = str_ajuste(msg)+'\r'
+                # print_oem(msg),
+                Console.Print_temp(msg)
+                sys.stdout.flush()
+                # re�u avant la cr�ation de l'index: les paquets suivants sont ignor�s sans stat
+                if self.recepteur.index is not None:
+                    self.recepteur.index.ajouter(
+                        self.nom_fichier.encode("utf_8"),
+                        self.taille_fichier,
+                        self.date_fichier,
+                        self.crc32,
+                        self.taille_originale,
+                    )
+            else:
+                # sinon on cr�e un nouvel objet fichier d'apr�s les infos du paquet:
+                self.nouveau_fichier()
+
     def nouveau_fichier(self):
         "pour d�buter la r�ception d'un nouveau fichier."
         msg = 'Reception de "%s"...' % self.nom_fichier
@@ -535,9 +1407,18 @@ class Pack:
         self.fichier_en_cours = self.nom_fichier
         debug("Nouveau fichier ou fichier mis a jour")
         # on cr�e un nouvel objet fichier d'apr�s les infos du paquet:
-        nouveau_fichier = Sender(self)
-        files[self.nom_fichier] = nouveau_fichier
-        nouveau_fichier.traiter_paquet(self)
+        nouveau_fichier = Sender(self, self.recepteur)
+        self.recepteur.files[self.nom_fichier] = nouveau_fichier
+        self.transmettre(nouveau_fichier)
+
+    def transmettre(self, fichier):
+        "pour transmettre le paquet au fichier en cours de r�ception."
+        if self.type_paquet == PACKAGE_FEC:
+            fichier.traiter_parite(self)
+        elif self.type_paquet == PACKAGE_FOUNTAIN:
+            fichier.traiter_symbole(self)
+        else:
+            fichier.traiter_paquet(self)
 
     def construire(self):
         "pour construire un paquet BFTP � partir des param�tres. (non impl�ment�)"
@@ -570,6 +1451,7 @@ class HeartBeat:
         self.hb_numsession = 0
         self.hb_packetnum = 0
         self.hb_timeout = time.time() + 1.25 * (self.hb_delay)
+        self.nb_retards = 0
 
     def newsession(self):
         """initiate values for a new session"""
@@ -626,25 +1508,27 @@ class HeartBeat:
             Console.Print_temp(msg, NL=True)
             sys.stdout.flush()
 
+    def verifier_timeout(self):
+        """Check once if heartbeats are late, and send an alarm if needed.
+        Return the delay before the next check (s)."""
+        # self.print_heartbeat()
+        if self.hb_timeout < time.time():
+            self.nb_retards += 1
+            msg = "HeartBeat : Pending receipt ( %d ) " % self.hb_packetnum
+            Console.Print_temp(msg, NL=False)
+            sys.stdout.flush()
+            if self.nb_retards % 10 == 0:
+                msg = "HeartBeat : Delay in receipt ( %d ) - %d " % (self.hb_packetnum, self.nb_retards / 10)
+                logging.warn(msg)
+                Console.Print_temp(msg, NL=True)
+            return self.hb_delay
+        self.nb_retards = 0
+        return 1
+
     def checktimer_heartbeat(self):
         "Timer to send alarm if no heartbeat are received"
-        # self.print_heartbeat()
-        Nbretard = 0
         while True:
-            if self.hb_timeout < time.time():
-                Nbretard += 1
-                delta = time.time() - self.hb_timeout
-                msg = "HeartBeat : Pending receipt ( %d ) " % self.hb_packetnum
-                Console.Print_temp(msg, NL=False)
-                sys.stdout.flush()
-                time.sleep(self.hb_delay - 1)
-                if Nbretard % 10 == 0:
-                    msg = "HeartBeat : Delay in receipt ( %d ) - %d " % (self.hb_packetnum, Nbretard / 10)
-                    logging.warn(msg)
-                    Console.Print_temp(msg, NL=True)
-            else:
-                Nbretard = 0
-            time.sleep(1)
+            time.sleep(self.verifier_timeout())
 
     def Th_checktimeout_heartbeatT(self):
         """thead to send heartbeat"""
@@ -664,17 +1548,16 @@ class HeartBeat:
             num_paquet = self.hb_packetnum
         if message == None:
             message = "HeartBeat"
+        message = message.encode("latin_1")
         taille_donnees = len(message)
         debug("sending HB...")
         # self.print_heartbeat()
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         # on commence par packer l'entete:
         entete = struct.pack(
             FORMAT_ENTETE, PACKAGE_HEARTBEAT, 0, taille_donnees, 0, num_session, num_paquet, self.hb_delay, 1, 0, 0, 0
         )
-        paquet = bytes(entete) + bytes(message)
-        s.sendto(paquet, (HOST, PORT))
-        s.close()
+        # heartbeat must not wait in the transport queue
+        get_transport().send_now(entete + message)
 
     def send_hb_loop(self):
         """A loop to send heartbeat sequence every X seconds"""
@@ -696,23 +1579,45 @@ class HeartBeat:
 
 
 class LimiteurDebit:
-    "pour controler le d�bit d'envoi de donn�es."
+    """pour controler le d�bit d'envoi de donn�es.
+
+    Seau � jetons (token bucket): le seau se remplit au d�bit maximum, jusqu'�
+    la taille de rafale, et chaque paquet consomme sa taille en jetons. S'il
+    manque des jetons, la pause est calcul�e exactement (horloge monotone)
+    au lieu d'attendre que le d�bit moyen redescende: pas de rattrapage en
+    rafale apr�s une p�riode d'inactivit�, pas de d�rive sur un long cycle.
 
-    def __init__(self, debit):
+    Le pacing peut aussi �tre d�l�gu� au noyau (cf. Transport.PACINGS):
+    - PACING_FQ: le d�bit est appliqu� par la socket, aucune pause ici,
+    - PACING_TXTIME: chaque paquet re�oit sa date d'�mission, les pauses
+      servent seulement � ne pas prendre plus de AVANCE_TXTIME d'avance."""
+
+    def __init__(self, debit, rafale=None, pacing=Transport.PACING_PYTHON):
         """contructeur de classe LimiteurDebit.
 
-        debit : d�bit maximum autoris�, en Kbps."""
+        debit : d�bit maximum autoris�, en Kbps.
+        rafale : taille maximum d'une rafale, en octets (RAFALE par d�faut).
+        pacing : backend de pacing (Transport.PACING_PYTHON par d�faut)."""
         # d�bit en Kbps converti en octets/s
         self.debit_max = debit * 1000 / 8
-        debug("LimiteurDebit: debit_max = %d octets/s" % self.debit_max)
+        if rafale is None:
+            rafale = RAFALE
+        self.rafale = max(rafale, PACKAGE_SIZE)
+        debug("LimiteurDebit: debit_max = %d octets/s, rafale = %d octets" % (self.debit_max, self.rafale))
+        self.pacing = pacing
+        # seau plein au d�part
+        self.jetons = self.rafale
+        self.derniere_mesure = time.monotonic()
+        # date d'�mission du prochain paquet (PACING_TXTIME), en ns
+        self.prochain_depart = 0
         # on stocke le temps de d�part
-        self.temps_debut = time.time()
+        self.temps_debut = time.monotonic()
         # nombre d'octets d�j� transf�r�
         self.octets_envoyes = 0
 
     def depart_chrono(self):
-        "pour (re)d�marrer la mesure du d�bit."
-        self.temps_debut = time.time()
+        "pour (re)d�marrer la mesure du d�bit (le seau n'est pas rempli)."
+        self.temps_debut = time.monotonic()
         self.octets_envoyes = 0
 
     def ajouter_donnees(self, octets):
@@ -721,7 +1626,7 @@ class LimiteurDebit:
 
     def temps_total(self):
         "donne le temps total de mesure."
-        return time.time() - self.temps_debut
+        return time.monotonic() - self.temps_debut
 
     def debit_moyen(self):
         "donne le d�bit moyen mesur�, en octets/s."
@@ -731,23 +1636,61 @@ class LimiteurDebit:
         debit_moyen = self.octets_envoyes / temps_total
         return debit_moyen
 
-    def limiter_debit(self):
-        "pour faire une pause afin de respecter le d�bit maximum."
-        # on fait des petites pauses (10 ms) tant que le d�bit est trop �lev�:
-        while self.debit_moyen() > self.debit_max:
-            time.sleep(0.01)
-        # m�thode alternative qui ne fonctionne pas tr�s bien
-        # (donne souvent des temps de pause n�gatifs !)
-
+    def rapport(self):
+        "donne le d�bit obtenu compar� au d�bit cible, pour l'affichage."
+        debit_moyen = self.debit_moyen()
+        return "debit moyen %d Kbps / cible %d Kbps (%d%%)" % (
+            debit_moyen * 8 / 1000,
+            self.debit_max * 8 / 1000,
+            100 * debit_moyen / self.debit_max,
+        )
 
-#       temps_total = self.temps_total()
-#       debit_moyen = self.debit_moyen()
-#       # si on d�passe le d�bit max, on calcule la pause:
-#       if debit_moyen > self.debit_max:
-#           pause = self.octets_envoyes/self.debit_max - temps_total
-#           if pause>0:
-#               debug ("LimiteurDebit: pause de %.3f s..." % pause)
-#               time.sleep(pause)
+    def _remplir(self):
+        "ajoute au seau les jetons accumul�s depuis la derni�re mesure."
+        maintenant = time.monotonic()
+        self.jetons = min(self.rafale, self.jetons + (maintenant - self.derniere_mesure) * self.debit_max)
+        self.derniere_mesure = maintenant
+
+    def limiter_debit(self, octets, avant_pause=None):
+        """pour faire une pause afin de respecter le d�bit maximum,
+        avant d'envoyer un paquet.
+
+        octets: taille du paquet � envoyer
+        avant_pause: function called once before pausing (e.g. to flush queued packets)
+
+        Retourne la date d'�mission du paquet en ns (PACING_TXTIME) ou None."""
+        if self.pacing == Transport.PACING_FQ:
+            return None
+        if self.pacing == Transport.PACING_TXTIME:
+            return self.programmer(octets, avant_pause)
+        self._remplir()
+        self.jetons -= octets
+        if self.jetons >= 0:
+            return
+        # jetons manquants: on attend exactement le temps de les accumuler
+        fin_pause = self.derniere_mesure - self.jetons / self.debit_max
+        if avant_pause is not None:
+            avant_pause()
+        pause = fin_pause - time.monotonic()
+        # time.sleep d�borde d'environ 0.1 ms: on termine par une attente active
+        if pause > ATTENTE_ACTIVE:
+            time.sleep(pause - ATTENTE_ACTIVE)
+        while time.monotonic() < fin_pause:
+            pass
+
+    def programmer(self, octets, avant_pause=None):
+        """calcule la date d'�mission d'un paquet (time.monotonic_ns) pour
+        PACING_TXTIME, avec un intervalle exact entre deux paquets."""
+        maintenant = time.monotonic_ns()
+        depart = max(self.prochain_depart, maintenant)
+        self.prochain_depart = depart + int(octets * 1e9 / self.debit_max)
+        avance = (depart - maintenant) / 1e9 - AVANCE_TXTIME
+        if avance > 0:
+            # trop d'avance sur l'horloge: inutile de remplir la file du noyau
+            if avant_pause is not None:
+                avant_pause()
+            time.sleep(avance)
+        return depart
 
 
 # ------------------------------------------------------------------------------
@@ -759,29 +1702,408 @@ def receive(repertoire):
     """Pour recevoir les paquets UDP BFTP contenant les fichiers, et stocker
     les fichiers re�us dans le r�pertoire indiqu� en param�tre."""
 
-    # bidouille: on change le contenu de la variable globale
-    CHEMIN_DEST = repertoire
-    print('The files will be received in the directory "%s".' % str_lat1(CHEMIN_DEST.abspath(), errors="replace"))
+    recepteur = Recepteur(repertoire)
+    print(
+        'The files will be received in the directory "%s".'
+        % str_lat1(recepteur.chemin_dest.abspath(), errors="replace")
+    )
     print("Listening on the port UDP %d..." % PORT)
     print("(type Ctrl+Pause pour quit)")
-    p = Pack()
+    purger_journal(recepteur.chemin_dest)
+    # thread de timeout des heartbeat
+    recepteur.heartbeat.Th_checktimeout_heartbeatT()
+    p = Pack(recepteur)
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # tampon de r�ception large: absorbe les rafales des �metteurs
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, TAILLE_RCVBUF)
     s.bind((HOST, PORT))
-    while 1:
-        debug("")
-        paquet, emetteur = s.recvfrom(PACKAGE_SIZE)
-        debug("emetteur: " + str(emetteur))
-        if not paquet:
-            break
-        # print 'donnees recues:'
-        # print paquet
+    repartiteur = None
+    if options is not None and options.workers:
+        # ce thread ne fait que vider la socket, les fichiers sont trait�s
+        # par les workers (tous les paquets d'un fichier par le m�me worker)
+        print("%d workers" % options.workers)
+        repartiteur = Repartiteur.Repartiteur(lambda: fabrique_decodeur(recepteur), options.workers)
+    # r�ception par lots dans des tampons pr�allou�s: les paquets sont des
+    # memoryviews, r��crites au lot suivant
+    reception = Transport.Reception(s, PACKAGE_SIZE)
+    try:
+        while 1:
+            for paquet in reception.recevoir():
+                if not paquet:
+                    return
+                # print 'donnees recues:'
+                # print paquet
+                if repartiteur is None:
+                    decoder_paquet(p, paquet)
+                    continue
+                # ent�te seul: statistiques dans l'ordre d'arriv�e, et choix du worker par le nom
+                try:
+                    codec.decoder_entete(paquet, p)
+                    cle = codec.nom(paquet, p.longueur_nom)
+                except struct.error:
+                    cle = b""
+                else:
+                    if (p.type_paquet & MASQUE_TYPE) in TYPES_FICHIER:
+                        recepteur.stats.add_package(p)
+                        nom = cle
+                        if p.type_paquet & DRAPEAU_IDENTIFIANT:
+                            nom = (recepteur.identifier(cle, p) or (None,))[0]
+                        if recepteur.est_recu(nom, p):
+                            continue
+                    elif p.type_paquet in (PACKAGE_BUNDLE, PACKAGE_ANNOUNCE):
+                        recepteur.stats.add_package(p)
+                # copie du paquet: il attend dans la file apr�s la r�ception du lot suivant
+                if not repartiteur.repartir(cle, bytes(paquet)):
+                    recepteur.stats.nb_rejetes += 1
+    finally:
+        if repartiteur is not None:
+            repartiteur.arreter()
+        # on enregistre l'�tat des r�ceptions en cours avant de quitter
+        recepteur.journaliser()
+
+
+def decoder_paquet(p, paquet):
+    "Pour d�coder un paquet re�u avec l'objet Pack p, en affichant les erreurs."
+    try:
+        p.decoder(paquet)
+    except:
+        msg = "Erreur lors du decodage d'un paquet: %s" % traceback.format_exc(1)
+        print(msg)
+        traceback.print_exc()
+        logging.error(msg)
+
+
+def fabrique_decodeur(recepteur):
+    "Retourne la fonction de d�codage d'un worker de r�ception, avec son propre objet Pack."
+    p = Pack(recepteur)
+    p.compter_stats = False
+    return lambda paquet: decoder_paquet(p, paquet)
+
+
+# ------------------------------------------------------------------------------
+# classe RecepteurAsync
+# -------------------
+
+
+class RecepteurAsync(Recepteur, asyncio.DatagramProtocol):
+    """R�cepteur BFTP int�grable dans une boucle asyncio: plusieurs ports et
+    r�pertoires destination peuvent �tre servis par un seul processus, sur un
+    seul coeur.
+
+    La boucle ne fait que d�coder les ent�tes (statistiques, choix du worker)
+    et v�rifier les heartbeats; le traitement des paquets de fichiers (�critures
+    disque) est confi� � nb_workers ex�cuteurs d'un thread, tous les paquets
+    d'un fichier allant au m�me ex�cuteur, dans l'ordre. Un paquet est ignor�
+    (et compt�) si taille_file paquets attendent d�j� leur ex�cuteur.
+
+    Exemple:
+        async def diodes():
+            r1 = RecepteurAsync("/data/diode1")
+            r2 = RecepteurAsync("/data/diode2")
+            await r1.demarrer("0.0.0.0", 36016)
+            await r2.demarrer("0.0.0.0", 36017)
+            try:
+                await asyncio.Event().wait()
+            finally:
+                r1.arreter()
+                r2.arreter()
+    """
+
+    def __init__(self, chemin_dest, nb_workers=1, taille_file=Repartiteur.TAILLE_FILE):
+        """Constructeur d'objet RecepteurAsync.
+
+        chemin_dest: r�pertoire o� sont stock�s les fichiers re�us.
+        nb_workers: nombre d'ex�cuteurs pour le traitement des fichiers.
+        taille_file: nombre maximal de paquets en attente par ex�cuteur."""
+        Recepteur.__init__(self, chemin_dest)
+        nb_workers = max(1, nb_workers)
+        self.executeurs = [concurrent.futures.ThreadPoolExecutor(1) for i in range(nb_workers)]
+        self.packs = [Pack(self) for i in range(nb_workers)]
+        for p in self.packs:
+            p.compter_stats = False
+        self.en_attente = [0] * nb_workers
+        self.taille_file = taille_file
+        self.pack_entete = Pack(self)  # d�codage des ent�tes et des heartbeats dans la boucle
+        self.loop = None
+        self.transport = None
+        self.minuterie = None
+
+    async def demarrer(self, host, port):
+        "pour commencer la r�ception sur le port UDP indiqu�."
+        self.loop = asyncio.get_running_loop()
+        await self.loop.run_in_executor(self.executeurs[0], purger_journal, self.chemin_dest)
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, TAILLE_RCVBUF)
+        s.bind((host, port))
+        self.transport, protocole = await self.loop.create_datagram_endpoint(lambda: self, sock=s)
+        self.verifier_heartbeat()
+
+    def verifier_heartbeat(self):
+        "pour v�rifier la r�ception des heartbeats, � intervalles r�guliers."
+        delai = self.heartbeat.verifier_timeout()
+        self.minuterie = self.loop.call_later(delai, self.verifier_heartbeat)
+
+    def datagram_received(self, paquet, adresse):
+        "appel� par la boucle asyncio pour chaque paquet re�u."
+        p = self.pack_entete
         try:
-            p.decoder(paquet)
-        except:
-            msg = "Erreur lors du decodage d'un paquet: %s" % traceback.format_exc(1)
-            print(msg)
-            traceback.print_exc()
-            logging.error(msg)
+            codec.decoder_entete(paquet, p)
+            cle = codec.nom(paquet, p.longueur_nom)
+        except struct.error:
+            cle = b""
+        else:
+            if p.type_paquet == PACKAGE_HEARTBEAT:
+                # pas d'acc�s disque: trait� dans la boucle
+                decoder_paquet(p, paquet)
+                return
+            if (p.type_paquet & MASQUE_TYPE) in TYPES_FICHIER:
+                self.stats.add_package(p)
+                nom = cle
+                if p.type_paquet & DRAPEAU_IDENTIFIANT:
+                    nom = (self.identifier(cle, p) or (None,))[0]
+                if self.est_recu(nom, p):
+                    return
+            elif p.type_paquet in (PACKAGE_BUNDLE, PACKAGE_ANNOUNCE):
+                self.stats.add_package(p)
+        i = hash(cle) % len(self.executeurs)
+        if self.en_attente[i] >= self.taille_file:
+            self.stats.nb_rejetes += 1
+            return
+        self.en_attente[i] += 1
+        futur = self.loop.run_in_executor(self.executeurs[i], decoder_paquet, self.packs[i], paquet)
+        futur.add_done_callback(lambda futur: self.fin_paquet(i))
+
+    def fin_paquet(self, i):
+        "pour d�compter un paquet trait� par l'ex�cuteur i."
+        self.en_attente[i] -= 1
+
+    def arreter(self):
+        "pour arr�ter la r�ception, une fois les paquets en attente trait�s."
+        if self.minuterie is not None:
+            self.minuterie.cancel()
+        if self.transport is not None:
+            self.transport.close()
+        for executeur in self.executeurs:
+            executeur.shutdown(wait=True)
+        self.journaliser()
+
+
+async def receive_async(repertoire):
+    """Pour recevoir les fichiers dans le r�pertoire indiqu�, avec le moteur asyncio."""
+    recepteur = RecepteurAsync(repertoire, options.workers or 1)
+    print(
+        'The files will be received in the directory "%s".'
+        % str_lat1(recepteur.chemin_dest.abspath(), errors="replace")
+    )
+    print("Listening on the port UDP %d (asyncio)..." % PORT)
+    print("(type Ctrl+Pause pour quit)")
+    await recepteur.demarrer(HOST, PORT)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        recepteur.arreter()
+
+
+# ------------------------------------------------------------------------------
+# RECEPTION SUR PLUSIEURS PORTS
+# -------------------
+
+
+class PackPort(Pack):
+    """Paquet d�cod� par le processus worker d'un port, en r�ception sur
+    plusieurs ports (cf. receive_ports).
+
+    Les donn�es des paquets de fichier sont v�rifi�es et �crites directement
+    dans le fichier partiel par le worker; seuls l'ent�te, le nom et le CRC32
+    des donn�es sont transmis au processus principal, qui tient l'�tat des
+    fichiers (paquets re�us, fin de r�ception)."""
+
+    def __init__(self, recepteur, notifications, controle):
+        """Constructeur d'objet PackPort.
+
+        recepteur: Recepteur local au worker (r�pertoire destination)
+        notifications: multiprocessing.Queue vers le processus principal
+        controle: Connection o� le processus principal signale les fichiers lib�r�s"""
+        Pack.__init__(self, recepteur)
+        self.compter_stats = False
+        self.notifications = notifications
+        self.controle = controle
+        self.fichiers = {}  # journal -> descripteur du fichier partiel
+        self.noms = {}  # journal -> nom du fichier
+        self.ignores = {}  # journaux des fichiers d�j� re�us -> nom du fichier
+        # journal -> nombre d'annulations de sa r�ception (cf. RecepteurPorts.generations)
+        self.generations = {}
+        self.nb_rejetes = 0
+        self.paquet = None
+
+    def decoder(self, paquet):
+        self.paquet = paquet
+        Pack.decoder(self, paquet)
+
+    def aiguiller(self):
+        # le processus principal signale les fichiers termin�s ou annul�s
+        while self.controle.poll():
+            journal, termine = self.controle.recv()
+            if termine is None:
+                # fichier effac�: journal est son nom, il pourra �tre re�u � nouveau
+                for cle in [cle for cle, nom in self.ignores.items() if nom == journal]:
+                    del self.ignores[cle]
+                continue
+            fd = self.fichiers.pop(journal, None)
+            if fd is not None:
+                os.close(fd)
+            nom = self.noms.pop(journal, None)
+            if termine:
+                self.generations.pop(journal, None)
+                if nom is not None:
+                    self.ignores[journal] = nom
+            else:
+                self.generations[journal] = self.generations.get(journal, 0) + 1
+        chemin_dest = self.recepteur.chemin_dest
+        journal = chemin_journal(chemin_dest, self.nom_fichier, self.taille_fichier, self.date_fichier, self.crc32)
+        if journal in self.ignores:
+            return
+        fd = self.fichiers.get(journal)
+        if fd is None:
+            if deja_recu(chemin_dest / self.nom_fichier, self.taille_originale, self.date_fichier):
+                self.ignores[journal] = self.nom_fichier
+                return
+            os.makedirs(journal.dirname(), exist_ok=True)
+            fd = self.fichiers[journal] = os.open(journal + ".part", os.O_RDWR | os.O_CREAT, 0o666)
+            self.noms[journal] = self.nom_fichier
+        os.pwrite(fd, self.donnees, self.offset)
+        crc_paquet = self.crc_paquet
+        if crc_paquet is None:
+            crc_paquet = binascii.crc32(self.donnees)
+        taille_entete = SIZE_ENTETE + self.longueur_nom
+        if self.compression:
+            taille_entete += Compression.TAILLE_EXTENSION
+        entete = self.paquet[:taille_entete]
+        try:
+            self.notifications.put_nowait((bytes(entete), crc_paquet, self.generations.get(journal, 0)))
+        except queue.Full:
+            # donn�es �crites mais pas compt�es: le paquet sera r��crit au prochain envoi
+            self.nb_rejetes += 1
+
+
+def recevoir_port(chemin_dest, host, port, notifications, controle):
+    """Processus worker de la r�ception sur plusieurs ports: re�oit les paquets
+    d'un port, �crit les donn�es des fichiers, et transmet le reste au processus
+    principal."""
+    # le worker s'arr�te avec le processus principal, m�me tu� brutalement
+    # (et pas sur Ctrl+C: le processus principal doit d'abord journaliser)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    parent = os.getppid()
+
+    def surveiller_parent():
+        while os.getppid() == parent:
+            time.sleep(1)
+        os._exit(0)
+
+    threading.Thread(target=surveiller_parent, daemon=True).start()
+    # l'index est tenu par le processus principal
+    recepteur = Recepteur(chemin_dest, indexer=False)
+    p = PackPort(recepteur, notifications, controle)
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, TAILLE_RCVBUF)
+    s.bind((host, port))
+    reception = Transport.Reception(s, PACKAGE_SIZE)
+    while 1:
+        for paquet in reception.recevoir():
+            try:
+                type_paquet = paquet[0]
+            except IndexError:
+                continue
+            if (type_paquet & MASQUE_TYPE) in (PACKAGE_FILE, PACKAGE_FILE_CRC):
+                decoder_paquet(p, paquet)
+            else:
+                if type_paquet == PACKAGE_ANNOUNCE:
+                    # chaque port re�oit sa copie des annonces (cf. Annonce): le worker
+                    # en a besoin pour les paquets de fichier, le processus principal aussi
+                    decoder_paquet(p, paquet)
+                # FEC, fontaine, heartbeat, effacement: trait�s par le processus principal
+                try:
+                    notifications.put_nowait(bytes(paquet))
+                except queue.Full:
+                    p.nb_rejetes += 1
+
+
+class RecepteurPorts(Recepteur):
+    """Recepteur du processus principal en r�ception sur plusieurs ports: il
+    signale aux workers les fichiers termin�s ou annul�s."""
+
+    def __init__(self, chemin_dest):
+        Recepteur.__init__(self, chemin_dest)
+        self.controles = []
+        self.verrou = threading.Lock()
+        # journal -> nombre d'annulations de sa r�ception: les paquets �crits par un
+        # worker avant d'avoir vu l'annulation l'ont �t� dans l'ancien fichier partiel
+        self.generations = {}
+
+    def liberer(self, journal, termine):
+        # appel� aussi par le thread de recopie (fin de r�ception)
+        with self.verrou:
+            if termine:
+                self.generations.pop(journal, None)
+            elif termine is not None:
+                self.generations[journal] = self.generations.get(journal, 0) + 1
+            for controle in self.controles:
+                controle.send((journal, termine))
+
+    def est_perime(self, pack, generation):
+        """Retourne True si le paquet a �t� �crit par un worker dans le fichier
+        partiel d'une r�ception annul�e depuis (generation: nombre d'annulations
+        vues par le worker)."""
+        if not generation and not self.generations:
+            return False
+        journal = chemin_journal(self.chemin_dest, pack.nom_fichier, pack.taille_fichier, pack.date_fichier, pack.crc32)
+        return generation != self.generations.get(journal, 0)
+
+    def oublier(self, nom_fichier):
+        Recepteur.oublier(self, nom_fichier)
+        self.liberer(nom_fichier, None)
+
+
+def receive_ports(repertoire, nb_ports):
+    """Pour recevoir les fichiers sur nb_ports ports UDP cons�cutifs, � partir de
+    PORT, avec un processus worker par port (cf. PackPort)."""
+    recepteur = RecepteurPorts(repertoire)
+    print(
+        'The files will be received in the directory "%s".'
+        % str_lat1(recepteur.chemin_dest.abspath(), errors="replace")
+    )
+    print("Listening on the ports UDP %d to %d..." % (PORT, PORT + nb_ports - 1))
+    print("(type Ctrl+Pause pour quit)")
+    purger_journal(recepteur.chemin_dest)
+    recepteur.heartbeat.Th_checktimeout_heartbeatT()
+    notifications = multiprocessing.Queue(TAILLE_NOTIFICATIONS)
+    workers = []
+    for i in range(nb_ports):
+        lecture, ecriture = multiprocessing.Pipe(duplex=False)
+        recepteur.controles.append(ecriture)
+        worker = multiprocessing.Process(
+            target=recevoir_port, args=(recepteur.chemin_dest, HOST, PORT + i, notifications, lecture)
+        )
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+    p = Pack(recepteur)
+    try:
+        while 1:
+            message = notifications.get()
+            if isinstance(message, tuple):
+                try:
+                    p.decoder_ecrit(*message)
+                except:
+                    msg = "Erreur lors du traitement d'un paquet: %s" % traceback.format_exc(1)
+                    print(msg)
+                    logging.error(msg)
+            else:
+                decoder_paquet(p, message)
+    finally:
+        for worker in workers:
+            worker.terminate()
+        recepteur.journaliser()
 
 
 # ------------------------------------------------------------------------------
@@ -820,13 +2142,107 @@ def SendDeleteFileMessage(file):
     """send a file deletion message"""
     debug("Sending DeleteFileMessage...")
     
-    file_name = str(file)
+    file_name = str(file).encode("utf_8")
     size = len(file_name)
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     entete = struct.pack(FORMAT_ENTETE, PACKAGE_DELETEFile, size, size, 0, 0, 0, 0, 1, 0, 0, 0)
-    pack = entete + file_name
-    s.sendto(pack, (HOST, PORT))
-    s.close()
+    get_transport().send(entete + file_name)
+
+
+# ------------------------------------------------------------------------------
+# COMPRESSION des fichiers envoy�s
+# -------------------
+
+# fichiers compress�s, conserv�s d'un envoi � l'autre (mode boucle):
+# fichier source -> ((taille, date, m�thode), (chemin, taille, CRC32) ou None si incompressible)
+compressions = {}
+# r�pertoire des fichiers temporaires d'envoi (compression, d�duplication), supprim� en quittant
+repertoire_envoi = None
+
+
+def repertoire_temporaire():
+    "Retourne le r�pertoire des fichiers temporaires d'envoi, cr�� au premier appel."
+    global repertoire_envoi
+    if repertoire_envoi is None:
+        repertoire_envoi = tempfile.mkdtemp(prefix="BFTP_")
+        atexit.register(shutil.rmtree, repertoire_envoi, True)
+    return repertoire_envoi
+
+
+def fichier_compresse(source_file, file_size, file_date, methode):
+    """Retourne (chemin, taille, CRC32) de la version compress�e du fichier, ou
+    None si son contenu ne se compresse pas (d�j� compress�: zip, jpg, iso...).
+    Le fichier n'est compress� � nouveau que s'il a �t� modifi�."""
+    cle = (file_size, file_date, methode)
+    entree = compressions.get(source_file)
+    if entree is not None:
+        if entree[0] == cle:
+            return entree[1]
+        # fichier modifi� depuis l'envoi pr�c�dent
+        if entree[1] is not None:
+            os.remove(entree[1][0])
+    resultat = None
+    if Compression.compressible(source_file, file_size):
+        fd, temp = tempfile.mkstemp(dir=repertoire_temporaire())
+        os.close(fd)
+        taille, crc32 = Compression.compresser(source_file, temp, methode)
+        if taille < file_size:
+            resultat = (temp, taille, crc32)
+        else:
+            os.remove(temp)
+    compressions[source_file] = (cle, resultat)
+    return resultat
+
+
+# ------------------------------------------------------------------------------
+# classe Annonce
+# -------------------
+
+# mode identifiants: identifiant -> nom des fichiers envoy�s (pour �viter les collisions)
+identifiants_envoyes = {}
+
+
+def identifiant_fichier(nom_fichier_dest):
+    """Retourne l'identifiant (4 octets) d'un nom de fichier (bytes), ou None s'il
+    d�signe d�j� un autre fichier: le nom est alors envoy� dans chaque paquet."""
+    identifiant = IDENTIFIANT.pack(binascii.crc32(nom_fichier_dest))
+    if identifiants_envoyes.setdefault(identifiant, nom_fichier_dest) != nom_fichier_dest:
+        return None
+    return identifiant
+
+
+class Annonce:
+    """Annonce d'un fichier envoy� en mode identifiants: paquet liant le nom du
+    fichier � l'identifiant port� par ses paquets � la place du nom, r�p�t�
+    pendant l'envoi (une annonce perdue ne fait perdre que les paquets suivants,
+    jusqu'� la prochaine)."""
+
+    def __init__(self, nom_fichier_dest, identifiant, nb_paquets, file_size, file_date, crc32):
+        self.nom = nom_fichier_dest
+        self.identifiant = identifiant
+        self.champs = (nb_paquets, file_size, file_date, crc32)
+        self.taille_paquet = SIZE_ENTETE + len(nom_fichier_dest) + IDENTIFIANT.size
+
+    def envoyer(self, rate_limiter, num_session, num_paquet_session):
+        """pour �mettre l'annonce, une fois par destination (r�ception sur plusieurs
+        ports: chaque port en re�oit une copie). Retourne le compteur de paquets."""
+        s = get_transport()
+        for i in range(len(s.destinations)):
+            entete = struct.pack(
+                FORMAT_ENTETE,
+                PACKAGE_ANNOUNCE,
+                len(self.nom),
+                IDENTIFIANT.size,
+                0,
+                num_session,
+                num_paquet_session,
+                0,
+                *self.champs
+            )
+            txtime = rate_limiter.limiter_debit(self.taille_paquet, s.flush)
+            s.send((entete, self.nom, self.identifiant), txtime)
+            rate_limiter.ajouter_donnees(self.taille_paquet)
+            num_paquet_session += 1
+        return num_paquet_session
 
 
 # ------------------------------------------------------------------------------
@@ -834,7 +2250,7 @@ def SendDeleteFileMessage(file):
 # -------------------
 
 
-def send(source_file, dest_file, rate_limiter=None, num_session=None, num_paquet_session=None, crc=None):
+def send(source_file, dest_file, rate_limiter=None, num_session=None, num_paquet_session=None, crc=None, passage=0):
     """Pour �mettre un fichier en paquets UDP BFTP.
 
     source_file: source file path on the local disk
@@ -842,8 +2258,16 @@ def send(source_file, dest_file, rate_limiter=None, num_session=None, num_paquet
     rate_limiter: to limit the sending rate
     num_session: session number
     num_paquet_session: packet counter
+    passage: number of previous sends of the file (fountain mode: new symbols at each pass)
     """
 
+    if (
+        options.dedup
+        and not Dedup.est_interne(str(dest_file))
+        and source_file.isfile()
+        and source_file.getsize() > Dedup.TAILLE_MIN
+    ):
+        return send_dedup(source_file, dest_file, rate_limiter, num_session, num_paquet_session, passage)
     msg = "Envoi du fichier %s..." % source_file
     Console.Print_temp(msg, NL=True)
     logging.info(msg)
@@ -853,88 +2277,512 @@ def send(source_file, dest_file, rate_limiter=None, num_session=None, num_paquet
     debug("num_session         = %d" % num_session)
     debug("num_paquet_session  = %d" % num_paquet_session)
     debug("fichier destination = %s" % dest_file)
-    if sys.platform == "win32":
-        # sous Windows on doit corriger les accents
-        nom_fichier_dest = dest_file.encode("utf_8", "strict")
-    else:
-        # sinon �a a l'air de passer
-        nom_fichier_dest = str(dest_file)
+    # le nom est transmis en utf-8
+    nom_fichier_dest = str(dest_file).encode("utf_8", "strict")
     longueur_nom = len(nom_fichier_dest)
     debug("longueur_nom = %d" % longueur_nom)
     if longueur_nom > MAX_FILE_NAME:
         raise ValueError
     if source_file.isfile():
         file_size = source_file.getsize()
-        file_date = source_file.getmtime()
+        file_date = int(source_file.getmtime())
         debug("file size = %d" % file_size)
         debug("date_fichier = %s" % mtime2str(file_date))
+        # compression: le fichier compress� est envoy� � la place du fichier
+        # (taille et CRC32 de l'ent�te), avec la taille d'origine en extension
+        compression = 0
+        taille_originale = file_size
+        fichier_envoye = source_file
+        if options.compression and file_size > 0:
+            methode = Compression.METHODES[options.compression]
+            compresse = fichier_compresse(source_file, file_size, file_date, methode)
+            if compresse is not None:
+                compression = methode
+                fichier_envoye, file_size, crc = compresse
+                debug("compression %s: %d%%" % (options.compression, 100 * file_size // taille_originale))
         # calcul de CRC32
         if crc == None:
             crc32 = CalcCRC(source_file)
         else:
             crc32 = crc
+        # le champ CRC32 de l'entete est sign� (cf. FORMAT_ENTETE)
+        if crc32 > 0x7FFFFFFF:
+            crc32 -= 0x100000000
+    # mode identifiants: l'identifiant du fichier remplace son nom dans les paquets
+    nom_annonce = None
+    drapeau = 0
+    if options.identifiants and longueur_nom > IDENTIFIANT.size:
+        identifiant = identifiant_fichier(nom_fichier_dest)
+        if identifiant is not None:
+            nom_annonce = nom_fichier_dest
+            nom_fichier_dest = identifiant
+            longueur_nom = IDENTIFIANT.size
+            drapeau = DRAPEAU_IDENTIFIANT
+    # FEC: une parit� XOR pour chaque groupe de options.fec paquets
+    taille_groupe = options.fec
     # taille restant pour les donn�es dans un paquet normal
+    # (avec FEC, les paquets de parit� doivent aussi tenir dans PACKAGE_SIZE,
+    # en mode fontaine les symboles ont la taille d'un paquet)
     taille_donnees_max = PACKAGE_SIZE - SIZE_ENTETE - longueur_nom
+    # extensions entre le nom et les donn�es: compression, puis celle du type de paquet
+    extension = b""
+    if compression:
+        extension = Compression.EXTENSION.pack(taille_originale)
+        taille_donnees_max -= Compression.TAILLE_EXTENSION
+    if taille_groupe:
+        taille_donnees_max -= FEC.TAILLE_EXTENSION
+    elif options.fontaine:
+        taille_donnees_max -= Fountain.TAILLE_EXTENSION
+    if options.checksum:
+        # chaque paquet porte le CRC32 de ses donn�es
+        taille_donnees_max -= CRC.TAILLE_EXTENSION
+        type_paquet = PACKAGE_FILE_CRC | compression | drapeau
+        taille_extension = len(extension) + CRC.TAILLE_EXTENSION
+    else:
+        type_paquet = PACKAGE_FILE | compression | drapeau
+        taille_extension = len(extension)
     debug("taille_donnees_max = %d" % taille_donnees_max)
-    nb_paquets = (file_size + taille_donnees_max - 1) / taille_donnees_max
+    # petits paquets (option -m): un nom long et les extensions peuvent ne laisser
+    # aucune place aux donn�es, et l'annonce porte le nom entier. Le fichier ne
+    # pourra jamais �tre envoy�: il est ignor� (sans erreur, la synchro se termine)
+    if taille_donnees_max <= 0 or (
+        nom_annonce is not None and SIZE_ENTETE + len(nom_annonce) + IDENTIFIANT.size > PACKAGE_SIZE
+    ):
+        msg = "Fichier %s non envoye: nom trop long pour des paquets de %d octets." % (source_file, PACKAGE_SIZE)
+        print("Erreur : " + msg)
+        logging.error(msg)
+        return num_paquet_session
+    nb_paquets = (file_size + taille_donnees_max - 1) // taille_donnees_max
     if nb_paquets == 0:
         # si le fichier est vide, il faut quand m�me envoyer un paquet
         nb_paquets = 1
     debug("nb_paquets = %d" % nb_paquets)
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    annonce = None
+    if nom_annonce is not None:
+        annonce = Annonce(nom_annonce, nom_fichier_dest, nb_paquets, file_size, file_date, crc32)
+    s = get_transport()
+    p = get_packetizer()
+    if taille_groupe:
+        parite = FEC.Parite()
+        taille_parite = min(taille_donnees_max, file_size)
+        extension_fec = extension + FEC.EXTENSION.pack(taille_groupe)
     reste_a_envoyer = file_size
+    offset = 0
+    pourcent_affiche = -1
     try:
-        f = open(source_file, "rb")
+        # sans buffer: readinto lit directement dans le tampon du paquet
+        f = open(fichier_envoye, "rb", buffering=0)
         if rate_limiter == None:
             # si aucun limiteur fourni, on en initialise un:
-            rate_limiter = LimiteurDebit(options.debit)
+            rate_limiter = LimiteurDebit(options.debit, options.rafale * 1024, options.pacing)
         rate_limiter.depart_chrono()
-        for num_paquet in range(0, nb_paquets):
-            # on fait une pause si besoin pour limiter le d�bit
-            rate_limiter.limiter_debit()
-            if reste_a_envoyer > taille_donnees_max:
-                data_size = taille_donnees_max
+        if annonce is not None:
+            num_paquet_session = annonce.envoyer(rate_limiter, num_session, num_paquet_session)
+        if options.fontaine:
+            # mode fontaine: symboles cod�s au lieu des paquets du fichier
+            num_paquet_session = send_symbols(
+                f,
+                rate_limiter,
+                nom_fichier_dest,
+                taille_donnees_max,
+                nb_paquets,
+                file_size,
+                file_date,
+                crc32,
+                num_session,
+                num_paquet_session,
+                passage,
+                compression | drapeau,
+                extension,
+                annonce,
+            )
+        else:
+            for num_paquet in range(0, nb_paquets):
+                if annonce is not None and num_paquet and num_paquet % PERIODE_ANNONCE == 0:
+                    num_paquet_session = annonce.envoyer(rate_limiter, num_session, num_paquet_session)
+                if reste_a_envoyer > taille_donnees_max:
+                    data_size = taille_donnees_max
+                else:
+                    data_size = reste_a_envoyer
+                reste_a_envoyer -= data_size
+                # on fait une pause si besoin pour limiter le d�bit
+                # (les paquets en attente dans le transport partent avant la pause)
+                taille_paquet = SIZE_ENTETE + longueur_nom + taille_extension + data_size
+                txtime = rate_limiter.limiter_debit(taille_paquet, s.flush)
+                # entete, nom et donnees sont envoyes sans concatenation (scatter/gather)
+                paquet = p.build(
+                    f,
+                    data_size,
+                    nom_fichier_dest,
+                    type_paquet,
+                    longueur_nom,
+                    data_size,
+                    offset,
+                    num_session,
+                    num_paquet_session,
+                    num_paquet,
+                    nb_paquets,
+                    file_size,
+                    file_date,
+                    crc32,
+                )
+                if taille_extension:
+                    entete, nom, donnees = paquet
+                    if options.checksum:
+                        paquet = (entete, nom, extension + CRC.EXTENSION.pack(binascii.crc32(donnees)), donnees)
+                    else:
+                        paquet = (entete, nom, extension, donnees)
+                s.send(paquet, txtime)
+                offset += data_size
+                num_paquet_session += 1
+                rate_limiter.ajouter_donnees(taille_paquet)
+                if taille_groupe:
+                    parite.ajouter(paquet[-1])
+                    if parite.nb_blocs == taille_groupe or num_paquet == nb_paquets - 1:
+                        # fin du groupe: envoi du paquet FEC
+                        premier = num_paquet + 1 - parite.nb_blocs
+                        donnees_fec = parite.octets(taille_parite)
+                        if options.checksum:
+                            type_fec = PACKAGE_FEC_CRC
+                            extension_paquet = extension_fec + CRC.EXTENSION.pack(binascii.crc32(donnees_fec))
+                        else:
+                            type_fec = PACKAGE_FEC
+                            extension_paquet = extension_fec
+                        taille_fec = SIZE_ENTETE + longueur_nom + len(extension_paquet) + taille_parite
+                        txtime = rate_limiter.limiter_debit(taille_fec, s.flush)
+                        entete = struct.pack(
+                            FORMAT_ENTETE,
+                            type_fec | compression | drapeau,
+                            longueur_nom,
+                            taille_parite,
+                            premier * taille_donnees_max,
+                            num_session,
+                            num_paquet_session,
+                            premier,
+                            nb_paquets,
+                            file_size,
+                            file_date,
+                            crc32,
+                        )
+                        s.send((entete, nom_fichier_dest, extension_paquet, donnees_fec), txtime)
+                        num_paquet_session += 1
+                        rate_limiter.ajouter_donnees(taille_fec)
+                        parite.reset()
+                # debug("debit moyen = %d" % limiteur_debit.debit_moyen())
+                # time.sleep(0.3)
+                pourcent = 100 * (num_paquet + 1) // nb_paquets
+                if pourcent != pourcent_affiche:
+                    # affichage du pourcentage: la virgule �vite un retour chariot
+                    print("%d%%\r" % pourcent)
+                    # pour forcer la mise � jour de l'affichage
+                    sys.stdout.flush()
+                    pourcent_affiche = pourcent
+        s.flush()
+        f.close()
+        print("transfert en %.3f secondes - %s" % (rate_limiter.temps_total(), rate_limiter.rapport()))
+    except IOError:
+        msg = "Ouverture du fichier %s..." % source_file
+        print("Erreur : " + msg)
+        logging.error(msg)
+        num_paquet_session = -1
+    return num_paquet_session
+
+
+# ------------------------------------------------------------------------------
+# SEND_DEDUP
+# -------------------
+
+# nombre d'envois des morceaux, en mode d�duplication (cf. Dedup)
+morceaux_envoyes = None
+
+
+def send_dedup(source_file, dest_file, rate_limiter=None, num_session=None, num_paquet_session=None, passage=0):
+    """Pour �mettre un fichier en mode d�duplication (cf. Dedup): chacun de ses
+    morceaux pas encore envoy� MinFileRedundancy fois, comme un fichier du magasin
+    de morceaux, puis la recette du fichier. Au dernier des MinFileRedundancy envois
+    de la recette, tous ses morceaux sont envoy�s: un r�cepteur qui en a manqu� un
+    ne l'attend pas ind�finiment.
+
+    Retourne le compteur de paquets de la session."""
+    global morceaux_envoyes
+    if morceaux_envoyes is None:
+        morceaux_envoyes = Dedup.Envoyes()
+    msg = "Envoi du fichier %s (deduplication)..." % source_file
+    Console.Print_temp(msg, NL=True)
+    logging.info(msg)
+    if num_session == None:
+        num_session = int(time.time())
+        num_paquet_session = 0
+    file_date = int(source_file.getmtime())
+    morceaux = []
+    envoyes = set()
+    dernier_envoi = passage + 1 >= MinFileRedundancy
+    taille = crc32 = 0
+    with open(source_file, "rb") as f:
+        for morceau in Dedup.decouper(f):
+            sha1 = Dedup.empreinte(morceau)
+            morceaux.append((sha1, len(morceau)))
+            taille += len(morceau)
+            crc32 = binascii.crc32(morceau, crc32)
+            nb_envois = morceaux_envoyes.nb_envois(sha1)
+            if (nb_envois >= MinFileRedundancy and not dernier_envoi) or sha1 in envoyes:
+                continue
+            envoyes.add(sha1)
+            temp = path(repertoire_temporaire()) / sha1.hex()
+            with open(temp, "wb") as sortie:
+                sortie.write(morceau)
+            # date fixe: un morceau est le m�me quel que soit le fichier qui le contient
+            os.utime(temp, (0, 0))
+            num_paquet_session = send(
+                temp,
+                Dedup.chemin_morceau(sha1),
+                rate_limiter,
+                num_session,
+                num_paquet_session,
+                crc=binascii.crc32(morceau),
+                passage=nb_envois,
+            )
+            os.remove(temp)
+            if num_paquet_session == -1:
+                return -1
+            morceaux_envoyes.compter(sha1)
+    debug("%d morceaux, %d envoyes" % (len(morceaux), len(envoyes)))
+    # le champ CRC32 de la recette est sign� (cf. FORMAT_ENTETE)
+    if crc32 > 0x7FFFFFFF:
+        crc32 -= 0x100000000
+    fd, temp = tempfile.mkstemp(dir=repertoire_temporaire())
+    os.close(fd)
+    Dedup.ecrire_recette(temp, taille, file_date, crc32, morceaux)
+    # m�me date que le fichier: la recette n'est re�ue � nouveau que s'il change
+    os.utime(temp, (file_date, file_date))
+    num_paquet_session = send(
+        path(temp), Dedup.chemin_recette(dest_file), rate_limiter, num_session, num_paquet_session, passage=passage
+    )
+    os.remove(temp)
+    return num_paquet_session
+
+
+# ------------------------------------------------------------------------------
+# SEND_DELTA
+# -------------------
+
+# signatures des versions envoy�es, en mode delta (cf. Delta)
+signatures_envoyees = None
+
+
+def send_delta(source_file, dest_file, rate_limiter=None, crc=None, passage=0):
+    """Pour �mettre un fichier en mode delta (cf. Delta): seulement ses blocs qui
+    diff�rent des versions d�j� envoy�es, quand l'une d'elles a �t� envoy�e
+    MinFileRedundancy fois, sinon le fichier entier. Le dernier des MinFileRedundancy
+    envois de chaque version est celui du fichier entier: un r�cepteur qui a manqu�
+    la version de base des deltas la re�oit quand m�me.
+
+    crc: CRC32 du fichier, s'il est d�j� calcul�
+    passage: nombre d'envois pr�c�dents de cette version du fichier
+    Retourne le compteur de paquets de la session."""
+    file_size = source_file.getsize()
+    file_date = int(source_file.getmtime())
+    versions = signatures_envoyees.lire(dest_file)
+    courante = None
+    for version in versions:
+        if version[1] == file_size and version[2] == file_date and (crc is None or version[3] == crc & 0xFFFFFFFF):
+            courante = version
+    if courante is None:
+        signature, crc32 = Delta.signer(source_file)
+        courante = [False, file_size, file_date, crc32, signature]
+        versions.append(courante)
+        signatures_envoyees.ecrire(dest_file, versions)
+    anciennes = [v for v in versions if v is not courante]
+    blocs = None
+    dernier_envoi = passage + 1 >= MinFileRedundancy
+    if not dernier_envoi and any(v[0] for v in anciennes) and len(anciennes) <= Delta.NB_VERSIONS_MAX:
+        blocs = Delta.blocs_modifies(courante[4], [v[4] for v in anciennes])
+        if len(blocs) > Delta.TAUX_MAX * Delta.nb_blocs(file_size):
+            blocs = None
+    if blocs is None:
+        num_paquet_session = send(source_file, dest_file, rate_limiter, crc=courante[3], passage=passage)
+    else:
+        msg = "Envoi du fichier %s (delta de %d blocs sur %d)..." % (
+            source_file,
+            len(blocs),
+            Delta.nb_blocs(file_size),
+        )
+        Console.Print_temp(msg, NL=True)
+        logging.info(msg)
+        fd, temp = tempfile.mkstemp(dir=repertoire_temporaire())
+        os.close(fd)
+        Delta.ecrire_delta(temp, source_file, file_size, file_date, courante[3], courante[4], blocs)
+        # m�me date que le fichier: le delta n'est re�u � nouveau que s'il change
+        os.utime(temp, (file_date, file_date))
+        num_paquet_session = send(path(temp), Delta.chemin_delta(dest_file), rate_limiter, passage=passage)
+        os.remove(temp)
+    if num_paquet_session != -1 and dernier_envoi:
+        # version consid�r�e comme re�ue: seule base des prochains deltas
+        courante[0] = True
+        signatures_envoyees.ecrire(dest_file, [courante])
+    return num_paquet_session
+
+
+# ------------------------------------------------------------------------------
+# classe EnvoiLots
+# -------------------
+
+
+class EnvoiLots:
+    """Envoi des petits fichiers group�s par lots (cf. Bundle), un paquet par lot,
+    dans une session commune."""
+
+    def __init__(self, rate_limiter):
+        """Constructeur d'objet EnvoiLots.
+
+        rate_limiter: pour limiter le d�bit d'envoi"""
+        self.rate_limiter = rate_limiter
+        self.lot = Bundle.Lot(PACKAGE_SIZE - SIZE_ENTETE)
+        self.num_session = int(time.time())
+        self.num_paquet_session = 0
+
+    def ajouter(self, source_file, dest_file):
+        """pour ajouter un fichier au lot en cours, en envoyant le lot s'il est plein.
+        Retourne le CRC32 du fichier, ou None s'il est illisible ou trop gros pour
+        un lot (il doit alors �tre envoy� seul)."""
+        nom = str(dest_file).encode("utf_8", "strict")
+        try:
+            with open(source_file, "rb") as f:
+                contenu = f.read(Bundle.TAILLE_MAX_FICHIER + 1)
+                date = int(os.fstat(f.fileno()).st_mtime)
+        except OSError:
+            return None
+        if len(contenu) > Bundle.TAILLE_MAX_FICHIER:
+            return None
+        crc32 = binascii.crc32(contenu)
+        # le champ CRC32 d'une entr�e est sign� (cf. FORMAT_ENTETE)
+        crc32_signe = crc32 - 0x100000000 if crc32 > 0x7FFFFFFF else crc32
+        if not self.lot.ajouter(nom, contenu, date, crc32_signe):
+            self.envoyer()
+            if not self.lot.ajouter(nom, contenu, date, crc32_signe):
+                return None
+        return crc32
+
+    def envoyer(self):
+        "pour �mettre le lot en cours, s'il n'est pas vide."
+        if not self.lot.nb_fichiers:
+            return
+        donnees = self.lot.octets()
+        crc32 = binascii.crc32(donnees)
+        if crc32 > 0x7FFFFFFF:
+            crc32 -= 0x100000000
+        # ent�te: pas de nom, nombre de fichiers du lot et CRC32 du lot
+        entete = struct.pack(
+            FORMAT_ENTETE,
+            PACKAGE_BUNDLE,
+            0,
+            len(donnees),
+            0,
+            self.num_session,
+            self.num_paquet_session,
+            0,
+            1,
+            self.lot.nb_fichiers,
+            int(time.time()),
+            crc32,
+        )
+        s = get_transport()
+        taille_paquet = SIZE_ENTETE + len(donnees)
+        txtime = self.rate_limiter.limiter_debit(taille_paquet, s.flush)
+        s.send((entete, donnees), txtime)
+        s.flush()
+        self.rate_limiter.ajouter_donnees(taille_paquet)
+        self.num_paquet_session += 1
+        debug("Lot de %d fichiers envoye" % self.lot.nb_fichiers)
+        self.lot.vider()
+
+
+# ------------------------------------------------------------------------------
+# SEND_SYMBOLS
+# -------------------
+
+
+def send_symbols(
+    f,
+    rate_limiter,
+    nom_fichier_dest,
+    taille_donnees_max,
+    nb_paquets,
+    file_size,
+    file_date,
+    crc32,
+    num_session,
+    num_paquet_session,
+    passage,
+    drapeaux=0,
+    extension=b"",
+    annonce=None,
+):
+    """Pour �mettre un fichier en mode fontaine (cf. Fountain): pour chaque bloc
+    de paquets, options.fontaine x k symboles, nouveaux � chaque passage.
+
+    drapeaux: bits de poids fort du type (m�thode de compression, mode identifiants)
+    extension: extension des fichiers compress�s (cf. Compression)
+    annonce: annonce du fichier en mode identifiants, r�p�t�e � chaque bloc (cf. Annonce)
+    Retourne le compteur de paquets de la session."""
+    s = get_transport()
+    longueur_nom = len(nom_fichier_dest)
+    # tous les symboles ont la m�me taille (dernier paquet compl�t� par des z�ros)
+    taille_symbole = min(taille_donnees_max, file_size)
+    taille_paquet = SIZE_ENTETE + longueur_nom + len(extension) + Fountain.TAILLE_EXTENSION + taille_symbole
+    type_symbole = PACKAGE_FOUNTAIN
+    if options.checksum:
+        # chaque symbole porte son CRC32
+        taille_paquet += CRC.TAILLE_EXTENSION
+        type_symbole = PACKAGE_FOUNTAIN_CRC
+    paquets_par_bloc = min(Fountain.TAILLE_BLOC, nb_paquets)
+    nb_blocs = (nb_paquets + paquets_par_bloc - 1) // paquets_par_bloc
+    pourcent_affiche = -1
+    for bloc in range(nb_blocs):
+        premier = bloc * paquets_par_bloc
+        k = min(paquets_par_bloc, nb_paquets - premier)
+        donnees = memoryview(bytearray(k * taille_symbole))
+        f.seek(premier * taille_symbole)
+        Packetizer.readinto_full(f, donnees)
+        nb_symboles = int(math.ceil(k * options.fontaine))
+        if annonce is not None and bloc:
+            num_paquet_session = annonce.envoyer(rate_limiter, num_session, num_paquet_session)
+        if (passage + 1) * nb_symboles > k:
+            # symboles de r�paration: XOR calcul�s sur des entiers
+            paquets = [
+                int.from_bytes(donnees[i * taille_symbole : (i + 1) * taille_symbole], "little") for i in range(k)
+            ]
+        for esi in range(passage * nb_symboles, (passage + 1) * nb_symboles):
+            txtime = rate_limiter.limiter_debit(taille_paquet, s.flush)
+            if esi < k:
+                symbole = donnees[esi * taille_symbole : (esi + 1) * taille_symbole]
             else:
-                data_size = reste_a_envoyer
-            reste_a_envoyer -= data_size
-            offset = f.tell()
-            donnees = f.read(data_size)
-            # on commence par packer l'entete:
+                symbole = Fountain.encoder(paquets, Fountain.voisins(bloc, esi, k)).to_bytes(taille_symbole, "little")
             entete = struct.pack(
                 FORMAT_ENTETE,
-                PACKAGE_FILE,
+                type_symbole | drapeaux,
                 longueur_nom,
-                data_size,
-                offset,
+                taille_symbole,
+                premier * taille_symbole,
                 num_session,
                 num_paquet_session,
-                num_paquet,
+                bloc,
                 nb_paquets,
                 file_size,
                 file_date,
                 crc32,
             )
-            paquet = entete + nom_fichier_dest + donnees
-            s.sendto(paquet, (HOST, PORT))
+            extension_symbole = extension + Fountain.EXTENSION.pack(esi, paquets_par_bloc)
+            if options.checksum:
+                extension_symbole += CRC.EXTENSION.pack(binascii.crc32(symbole))
+            s.send((entete, nom_fichier_dest, extension_symbole, symbole), txtime)
             num_paquet_session += 1
-            rate_limiter.ajouter_donnees(len(paquet))
-            # debug("debit moyen = %d" % limiteur_debit.debit_moyen())
-            # time.sleep(0.3)
-            pourcent = 100 * (num_paquet + 1) / nb_paquets
-            # affichage du pourcentage: la virgule �vite un retour chariot
+            rate_limiter.ajouter_donnees(taille_paquet)
+        pourcent = 100 * (bloc + 1) // nb_blocs
+        if pourcent != pourcent_affiche:
             print("%d%%\r" % pourcent)
-            # pour forcer la mise � jour de l'affichage
             sys.stdout.flush()
-        print(
-            "transfert en %.3f secondes - debit moyen %d Kbps"
-            % (rate_limiter.temps_total(), rate_limiter.debit_moyen() * 8 / 1000)
-        )
-    except IOError:
-        msg = "Ouverture du fichier %s..." % source_file
-        print("Erreur : " + msg)
-        logging.error(msg)
-        num_paquet_session = -1
-    s.close()
+            pourcent_affiche = pourcent
     return num_paquet_session
 
 
@@ -945,15 +2793,17 @@ def sortDictBy(nslist, key):
     """
     Sorting a dictionary on a field
     """
-    nslist = map(lambda x, key=key: (x[key], x), nslist)
-    nslist.sort()
-    return map(lambda key, x: x, nslist)
+    # tri stable sur la cl� seule (les dictionnaires ne sont pas comparables)
+    return sorted(nslist, key=lambda x: x[key])
 
 
 # ------------------------------------------------------------------------------
 # SYNCHRO_ARBO
 # -------------------
 
+# changements de l'arborescence, en mode surveillance (cf. Watcher)
+surveillance = None
+
 
 def synchro_arbo(directory):
     """
@@ -965,24 +2815,50 @@ def synchro_arbo(directory):
     logging.info('Directory synchronization "%s"' % str_lat1(directory, errors="replace"))
 
     # on utilise un objet LimiteurDebit global pour tout le transfert:
-    limiteur_debit = LimiteurDebit(options.debit)
-
-    # TODO : Distinguer le traitement d'une arborescence locale / distante
-    if 0:
-        print("arborescence locale")
-        # TODO : Traitement Local des donnn�es :
-        #            - utiliser wath_directory pour d�tecter le besoin l'�mission
-    else:
-        # print("arborescence distante")
-        # Remote data processing :
-        #     Boucle 1 : File analysis and prioritization
-        AllFileSendMax = False
-        # test for display of a cyclic pattern
-        monaff = TraitEncours.TraitEnCours()
-        monaff.StartIte()
-        while not (AllFileSendMax) or options.boucle:
+    limiteur_debit = LimiteurDebit(options.debit, options.rafale * 1024, options.pacing)
+    # mode lots: les petits fichiers sont envoy�s group�s (cf. Bundle)
+    lots = EnvoiLots(limiteur_debit) if options.lots else None
+
+    # Remote data processing :
+    #     Boucle 1 : File analysis and prioritization
+    AllFileSendMax = False
+    # test for display of a cyclic pattern
+    monaff = TraitEncours.TraitEnCours()
+    monaff.StartIte()
+    scanning = None
+    dernier_scan_complet = 0
+    derniere_sauvegarde = 0
+    # fichiers pas encore �mis MinFileRedundancy fois et chemins disparus: en mode
+    # surveillance, ils sont tenus � jour d'un cycle � l'autre sans parcourir l'arborescence
+    a_envoyer = set()
+    disparus = set()
+    while not (AllFileSendMax) or options.boucle:
+        incremental = (
+            surveillance is not None
+            and scanning is not None
+            and not surveillance.debordement
+            and time.time() - dernier_scan_complet < SCAN_COMPLET_DELAI
+        )
+        if incremental:
+            # mode surveillance: seuls les chemins modifi�s depuis la scrutation pr�c�dente sont relus
+            # et compar�s, DRef et la liste des fichiers � �mettre sont mis � jour pour eux seuls
+            chemins = surveillance.prendre()
+            print("%s - Tree update (%d changes)" % (mtime2str(time.time()), len(chemins)))
+            scanning.update(chemins)
+            same, different, only1, only2 = xfl.compare_paths(scanning, DRef, chemins)
+            for f in only2:
+                if f not in disparus and DRef.dict[f].tag == xfl.TAG_FILE:
+                    # vu pour la derni�re fois avant cette mise � jour (cf. OffLineDelay)
+                    DRef.dict[f].set(ATTR_LASTVIEW, scanning.et.get(xfl.ATTR_TIME))
+            only2 = [f for f in disparus.union(only2) if f in DRef.dict and f not in scanning.dict]
+        else:
+            if surveillance is not None:
+                # les changements d�j� signal�s sont vus par la scrutation compl�te
+                surveillance.vider()
+                dernier_scan_complet = time.time()
             print("%s - Tree scan" % mtime2str(time.time()))
-            scanning = xfl.DirTree()
+            # propri�taire des fichiers non relev�: compare_DT ne compare que taille et date
+            scanning = xfl.DirTree(owner=False, workers=options.jobs)
             if MODE_DEBUG:
                 scanning.read_disk(directory, xfl.callback_dir_print)
                 # Dscrutation.read_disk(repertoire, xfl.callback_dir_print, xfl.callback_file_print)
@@ -991,210 +2867,241 @@ def synchro_arbo(directory):
                 # Dscrutation.read_disk(repertoire)
             debug("%s - Tree analysis" % mtime2str(time.time()))
             same, different, only1, only2 = xfl.compare_DT(scanning, DRef)
-            Console.Print_temp("%s - Processing deleted files" % mtime2str(time.time()))
-            debug("\n========== Deleted ========== ")
-            for f in sorted(only2, reverse=True):
-                debug("S  " + f)
-                monaff.AffCar()
-                DeletionNeeded = False
-                parent, myfile = f.splitpath()
-                if DRef.dict[f].tag == xfl.TAG_DIR:
-                    # V�rifier la pr�sence de fils (dir / file)
-                    if not (bool(DRef.dict[f].getchildren())):
-                        DeletionNeeded = True
-                if DRef.dict[f].tag == xfl.TAG_FILE:
-                    LastView = DRef.dict[f].get(ATTR_LASTVIEW)
-                    NbSend = DRef.dict[f].get(ATTR_NBSEND)
-                    if LastView == None:
-                        LastView = 0
-                    # Si Disparu depuis X jours ; on notifie la suppression
-                    if (time.time() - (float(LastView) + OffLineDelay)) > 0:
-                        if NbSend == None:
-                            NbSend = -10
-                        else:
-                            if NbSend >= 0:
-                                NbSend = -1
-                        for attr in (ATTR_LASTSEND, ATTR_CRC):
-                            DRef.dict[f].set(attr, str(0))
-                        if options.synchro_arbo_stricte:
-                            SendDeleteFileMessage(f)
-                        NbSend -= 1
-                        if NbSend > -10:
-                            DRef.dict[f].set(ATTR_NBSEND, str(NbSend))
-                        else:
-                            DeletionNeeded = True
-                if DeletionNeeded:
-                    debug("****** Deletion")
-                    if parent == "":
-                        DRef.et.remove(DRef.dict[f])
+        Console.Print_temp("%s - Processing deleted files" % mtime2str(time.time()))
+        debug("\n========== Deleted ========== ")
+        for f in sorted(only2, reverse=True):
+            debug("S  " + f)
+            monaff.AffCar()
+            DeletionNeeded = False
+            parent, myfile = f.splitpath()
+            if DRef.dict[f].tag == xfl.TAG_DIR:
+                # V�rifier la pr�sence de fils (dir / file)
+                if not (bool(len(DRef.dict[f]))):
+                    DeletionNeeded = True
+            if DRef.dict[f].tag == xfl.TAG_FILE:
+                LastView = DRef.dict[f].get(ATTR_LASTVIEW)
+                NbSend = DRef.dict[f].get(ATTR_NBSEND)
+                if LastView == None:
+                    LastView = 0
+                # Si Disparu depuis X jours ; on notifie la suppression
+                if (time.time() - (float(LastView) + OffLineDelay)) > 0:
+                    if NbSend == None:
+                        NbSend = -10
                     else:
-                        DRef.dict[parent].remove(DRef.dict[f])
-            Console.Print_temp("%s - Processing new files " % mtime2str(time.time()))
-            debug("\n========== New  ========== ")
-            RefreshDictNeeded = False
-            for f in sorted(only1):
-                # TODO : Optimiser le traitement
-                # en cas de nombreux ajouts ; la reconstruction du dict est trop gourmande
-                monaff.AffCar()
-                debug("N  " + f)
-                parent, myfile = f.splitpath()
-                index = 0
-                if parent == "":
-                    newET = ET.SubElement(DRef.et, scanning.dict[f].tag)
-                    index = len(DRef.et) - 1
-                    if scanning.dict[f].tag == xfl.TAG_FILE:
-                        RefreshDictNeeded = True
-                        for attr in (xfl.ATTR_NAME, xfl.ATTR_MTIME, xfl.ATTR_SIZE):
-                            DRef.et[index].set(attr, scanning.dict[f].get(attr))
-                        for attr in (ATTR_LASTSEND, ATTR_CRC, ATTR_NBSEND):
-                            DRef.et[index].set(attr, str(0))
-                        DRef.et[index].set(ATTR_LASTVIEW, scanning.et.get(xfl.ATTR_TIME))
+                        if NbSend >= 0:
+                            NbSend = -1
+                    for attr in (ATTR_LASTSEND, ATTR_CRC):
+                        DRef.dict[f].set(attr, str(0))
+                    if options.synchro_arbo_stricte:
+                        SendDeleteFileMessage(f)
+                    NbSend -= 1
+                    if NbSend > -10:
+                        DRef.dict[f].set(ATTR_NBSEND, str(NbSend))
                     else:
-                        DRef.et[index].set(xfl.ATTR_NAME, scanning.dict[f].get(xfl.ATTR_NAME))
+                        DeletionNeeded = True
+            if DeletionNeeded:
+                debug("****** Deletion")
+                if parent == "":
+                    DRef.et.remove(DRef.dict[f])
                 else:
-                    newET = ET.SubElement(DRef.dict[parent], scanning.dict[f].tag)
-                    index = len(DRef.dict[parent]) - 1
-                    if scanning.dict[f].tag == xfl.TAG_FILE:
-                        RefreshDictNeeded = True
-                        for attr in (xfl.ATTR_NAME, xfl.ATTR_MTIME, xfl.ATTR_SIZE):
-                            DRef.dict[parent][index].set(attr, scanning.dict[f].get(attr))
-                        for attr in (ATTR_LASTSEND, ATTR_CRC, ATTR_NBSEND):
-                            DRef.dict[parent][index].set(attr, str(0))
-                        DRef.dict[parent][index].set(ATTR_LASTVIEW, (scanning.et.get(xfl.ATTR_TIME)))
-                    else:
-                        DRef.dict[parent][index].set(xfl.ATTR_NAME, scanning.dict[f].get(xfl.ATTR_NAME))
-                # Reconstruction du dictionnaire pour faciliter l'insertion des sous �l�ments
-                if scanning.dict[f].tag == xfl.TAG_DIR:
-                    DRef.pathdict()
-                    RefreshDict = False
-            # reconstruction du dictionnaire si ajout uniquement de fichiers
-            if RefreshDictNeeded:
-                DRef.pathdict()
-            Console.Print_temp("%s - Processing modified files" % mtime2str(time.time()))
-            debug("\n========== Differents  ========== ")
-            for f in different:
-                monaff.AffCar()
-                debug("D  " + f)
+                    DRef.dict[parent].remove(DRef.dict[f])
+                del DRef.dict[f]
+        disparus = set(f for f in only2 if f in DRef.dict)
+        Console.Print_temp("%s - Processing new files " % mtime2str(time.time()))
+        debug("\n========== New  ========== ")
+        # tri: chaque r�pertoire est ajout� avant son contenu
+        for f in sorted(only1):
+            monaff.AffCar()
+            debug("N  " + f)
+            parent, myfile = f.splitpath()
+            index = 0
+            if parent == "":
+                newET = ET.SubElement(DRef.et, scanning.dict[f].tag)
+                index = len(DRef.et) - 1
                 if scanning.dict[f].tag == xfl.TAG_FILE:
-                    # Mise � jour des donn�es
-                    for attr in (xfl.ATTR_MTIME, xfl.ATTR_SIZE):
-                        DRef.dict[f].set(attr, str(scanning.dict[f].get(attr)))
+                    for attr in (xfl.ATTR_NAME, xfl.ATTR_MTIME, xfl.ATTR_SIZE):
+                        DRef.et[index].set(attr, scanning.dict[f].get(attr))
                     for attr in (ATTR_LASTSEND, ATTR_CRC, ATTR_NBSEND):
-                        DRef.dict[f].set(attr, str(0))
-                    DRef.dict[f].set(ATTR_LASTVIEW, scanning.et.get(xfl.ATTR_TIME))
-            Console.Print_temp("%s - Handling identical files" % mtime2str(time.time()))
-            debug("\n========== identical  ========== ")
-            for f in same:
-                monaff.AffCar()
-                debug("I  " + f)
+                        DRef.et[index].set(attr, str(0))
+                    DRef.et[index].set(ATTR_LASTVIEW, scanning.et.get(xfl.ATTR_TIME))
+                else:
+                    DRef.et[index].set(xfl.ATTR_NAME, scanning.dict[f].get(xfl.ATTR_NAME))
+            else:
+                newET = ET.SubElement(DRef.dict[parent], scanning.dict[f].tag)
+                index = len(DRef.dict[parent]) - 1
                 if scanning.dict[f].tag == xfl.TAG_FILE:
-                    if DRef.dict[f].get(ATTR_LASTVIEW) == None:
-                        for attr in (ATTR_LASTSEND, ATTR_CRC, ATTR_NBSEND):
-                            DRef.dict[f].set(attr, str(0))
-                    DRef.dict[f].set(ATTR_LASTVIEW, scanning.et.get(xfl.ATTR_TIME))
-            Console.Print_temp("%s - Sauvegarde du fichier de reprise" % mtime2str(time.time()))
-            DRef.et.set(xfl.ATTR_TIME, str(time.time()))
-            if XFLFile == "BFTPsynchro.xml":
-                if os.path.isfile(XFLFile):
-                    try:
-                        os.rename(XFLFile, XFLFileBak)
-                    except:
-                        os.remove(XFLFileBak)
-                        os.rename(XFLFile, XFLFileBak)
-            DRef.write_file(XFLFile)
-            debug("%s - Selection des fichiers les moins emis " % mtime2str(time.time()))
-            FileToSend = []
-            Console.Print_temp("%s - Selection des fichiers a emettre" % mtime2str(time.time()))
-            for f in only1 + different + same:
-                monaff.AffCar()
-                (shortname, extension) = os.path.splitext(os.path.basename(f))
-                if not (extension in IgnoreExtensions) and (scanning.dict[f].tag == xfl.TAG_FILE):
-                    # Ignorer les fichiers trop r�cents (risque de prendre une image iso en cours de t�l�chargement)
-                    # et les fichiers trop �mis
-                    # if abs(float(DRef.dict[f].get(xfl.ATTR_MTIME))-float(DRef.dict[f].get(ATTR_LASTVIEW)))>60 \
-                    # and int(DRef.dict[f].get(ATTR_NBSEND))<MinFileRedundancy:
-                    if int(DRef.dict[f].get(ATTR_NBSEND)) < MinFileRedundancy:
-                        monfichier = {"iteration": int(DRef.dict[f].get(ATTR_NBSEND)), "file": f}
-                        FileToSend.append(monfichier)
-                    debug(" +-- " + f)
-            Console.Print_temp("%s - Priorisation des fichiers a emettre" % mtime2str(time.time()))
-            FileToSend = sortDictBy(FileToSend, "iteration")
-            debug("Nombre de fichiers a synchroniser : %d" % len(FileToSend))
-            if len(FileToSend) == 0:
-                AllFileSendMax = True
-            boucleemission = LimiteurDebit(options.debit)
-            boucleemission.depart_chrono()
-            print("%s - Emission des donnees " % mtime2str(time.time()))
-            # Set TransmitDelay from min 300 to max time needed to identify data to send
-            TransmitDelay = time.time() - float(scanning.et.get(xfl.ATTR_TIME))
-            if TransmitDelay < 300:
-                TransmitDelay = 300
-            # Boucle 2 d'�mission temporelle
-            FileLessRedundancy = 0
-            LastFileSendMax = False
-            while (boucleemission.temps_total() < TransmitDelay * 4) and (not (LastFileSendMax)):
-                if len(FileToSend) != 0:
-                    item = FileToSend.pop(0)
-                    f = item["file"]
-                    i = item["iteration"]
-                    debug("Iteration:* %d *" % i)
-                    if sys.platform == "win32":
-                        separator = "\\"
-                    else:
-                        separator = "/"
-                    fullpathfichier = directory + separator + f
-                    # Correction Bug Erreur si le fichier a �t� supprim�.
-                    if fullpathfichier.isfile():
-                        # Controle de stabilit� du fichier : v�rification des param�tres date et taille par rapport � la r�f�rence
-                        #   �jecter le fichier s'il a chang�
-                        # bug 4901	Non transmission de fichiers timestamp en mode boucle sur gros volume
-                        # modif : pas de v�rif de stabilit� pour les petits fichiers ou le fichier de synchro
-                        stable = fullpathfichier.getmtime() == float(
-                            DRef.dict[f].get(xfl.ATTR_MTIME)
-                        ) and fullpathfichier.getsize() == int(DRef.dict[f].get(xfl.ATTR_SIZE))
-                        if not stable:
-                            DRef.dict[f].set(ATTR_CRC, "0")
-                            DRef.dict[f].set(ATTR_NBSEND, "0")
-                        if stable or fullpathfichier.getsize() < 1024 or f == "BFTPsynchro.xml":
+                    for attr in (xfl.ATTR_NAME, xfl.ATTR_MTIME, xfl.ATTR_SIZE):
+                        DRef.dict[parent][index].set(attr, scanning.dict[f].get(attr))
+                    for attr in (ATTR_LASTSEND, ATTR_CRC, ATTR_NBSEND):
+                        DRef.dict[parent][index].set(attr, str(0))
+                    DRef.dict[parent][index].set(ATTR_LASTVIEW, (scanning.et.get(xfl.ATTR_TIME)))
+                else:
+                    DRef.dict[parent][index].set(xfl.ATTR_NAME, scanning.dict[f].get(xfl.ATTR_NAME))
+            # index mis � jour sans reconstruire tout le dictionnaire
+            DRef.dict[f] = newET
+        Console.Print_temp("%s - Processing modified files" % mtime2str(time.time()))
+        debug("\n========== Differents  ========== ")
+        for f in different:
+            monaff.AffCar()
+            debug("D  " + f)
+            if scanning.dict[f].tag == xfl.TAG_FILE:
+                # Mise � jour des donn�es
+                for attr in (xfl.ATTR_MTIME, xfl.ATTR_SIZE):
+                    DRef.dict[f].set(attr, str(scanning.dict[f].get(attr)))
+                for attr in (ATTR_LASTSEND, ATTR_CRC, ATTR_NBSEND):
+                    DRef.dict[f].set(attr, str(0))
+                DRef.dict[f].set(ATTR_LASTVIEW, scanning.et.get(xfl.ATTR_TIME))
+        Console.Print_temp("%s - Handling identical files" % mtime2str(time.time()))
+        debug("\n========== identical  ========== ")
+        for f in same:
+            monaff.AffCar()
+            debug("I  " + f)
+            if scanning.dict[f].tag == xfl.TAG_FILE:
+                if DRef.dict[f].get(ATTR_LASTVIEW) == None:
+                    for attr in (ATTR_LASTSEND, ATTR_CRC, ATTR_NBSEND):
+                        DRef.dict[f].set(attr, str(0))
+                DRef.dict[f].set(ATTR_LASTVIEW, scanning.et.get(xfl.ATTR_TIME))
+        if not incremental or time.time() - derniere_sauvegarde > SAUVEGARDE_DELAI:
+            sauvegarder_reprise()
+            derniere_sauvegarde = time.time()
+        debug("%s - Selection des fichiers les moins emis " % mtime2str(time.time()))
+        Console.Print_temp("%s - Selection des fichiers a emettre" % mtime2str(time.time()))
+        if not incremental:
+            a_envoyer = set()
+        a_envoyer.difference_update(only2)
+        for f in only1 + different + same:
+            monaff.AffCar()
+            (shortname, extension) = os.path.splitext(os.path.basename(f))
+            if not (extension in IgnoreExtensions) and (scanning.dict[f].tag == xfl.TAG_FILE):
+                a_envoyer.add(f)
+                debug(" +-- " + f)
+            else:
+                a_envoyer.discard(f)
+        FileToSend = []
+        for f in sorted(a_envoyer):
+            # Ignorer les fichiers trop r�cents (risque de prendre une image iso en cours de t�l�chargement)
+            # et les fichiers trop �mis
+            # if abs(float(DRef.dict[f].get(xfl.ATTR_MTIME))-float(DRef.dict[f].get(ATTR_LASTVIEW)))>60 \
+            # and int(DRef.dict[f].get(ATTR_NBSEND))<MinFileRedundancy:
+            if int(DRef.dict[f].get(ATTR_NBSEND)) < MinFileRedundancy:
+                monfichier = {"iteration": int(DRef.dict[f].get(ATTR_NBSEND)), "file": f}
+                FileToSend.append(monfichier)
+        # les fichiers �mis MinFileRedundancy fois ne sont plus relus, jusqu'� leur modification
+        a_envoyer = set(monfichier["file"] for monfichier in FileToSend)
+        Console.Print_temp("%s - Priorisation des fichiers a emettre" % mtime2str(time.time()))
+        FileToSend = sortDictBy(FileToSend, "iteration")
+        debug("Nombre de fichiers a synchroniser : %d" % len(FileToSend))
+        if len(FileToSend) == 0:
+            AllFileSendMax = True
+        boucleemission = LimiteurDebit(options.debit)
+        boucleemission.depart_chrono()
+        print("%s - Emission des donnees " % mtime2str(time.time()))
+        # Set TransmitDelay from min 300 to max time needed to identify data to send
+        TransmitDelay = time.time() - float(scanning.et.get(xfl.ATTR_TIME))
+        if TransmitDelay < 300:
+            TransmitDelay = 300
+        # Boucle 2 d'�mission temporelle
+        FileLessRedundancy = 0
+        LastFileSendMax = False
+        while (boucleemission.temps_total() < TransmitDelay * 4) and (not (LastFileSendMax)):
+            if len(FileToSend) != 0:
+                item = FileToSend.pop(0)
+                f = item["file"]
+                i = item["iteration"]
+                debug("Iteration:* %d *" % i)
+                if sys.platform == "win32":
+                    separator = "\\"
+                else:
+                    separator = "/"
+                fullpathfichier = directory + separator + f
+                # Correction Bug Erreur si le fichier a �t� supprim�.
+                if fullpathfichier.isfile():
+                    # Controle de stabilit� du fichier : v�rification des param�tres date et taille par rapport � la r�f�rence
+                    #   �jecter le fichier s'il a chang�
+                    # bug 4901	Non transmission de fichiers timestamp en mode boucle sur gros volume
+                    # modif : pas de v�rif de stabilit� pour les petits fichiers ou le fichier de synchro
+                    stable = fullpathfichier.getmtime() == float(
+                        DRef.dict[f].get(xfl.ATTR_MTIME)
+                    ) and fullpathfichier.getsize() == int(DRef.dict[f].get(xfl.ATTR_SIZE))
+                    if not stable:
+                        DRef.dict[f].set(ATTR_CRC, "0")
+                        DRef.dict[f].set(ATTR_NBSEND, "0")
+                    if stable or fullpathfichier.getsize() < 1024 or f == "BFTPsynchro.xml":
+                        crc_lot = None
+                        if lots is not None and fullpathfichier.getsize() <= Bundle.TAILLE_MAX_FICHIER:
+                            # petit fichier: ajout� au lot en cours, sans calcul de CRC32 ni envoi s�par�s
+                            crc_lot = lots.ajouter(fullpathfichier, f)
+                        if crc_lot is not None:
+                            DRef.dict[f].set(ATTR_CRC, str(crc_lot))
+                            envoye = True
+                        else:
                             if DRef.dict[f].get(ATTR_CRC) == "0":
                                 current_CRC = str(CalcCRC(fullpathfichier))
                                 DRef.dict[f].set(ATTR_CRC, current_CRC)
-                            if send(fullpathfichier, f, limiteur_debit, crc=int(DRef.dict[f].get(ATTR_CRC))) != -1:
-                                DRef.dict[f].set(ATTR_LASTSEND, str(time.time()))
-                                DRef.dict[f].set(ATTR_NBSEND, str(int(DRef.dict[f].get(ATTR_NBSEND)) + 1))
-                                if int(DRef.dict[f].get(ATTR_NBSEND)) > MinFileRedundancy:
-                                    LastFileSendMax = True
-                                    if FileLessRedundancy == 0:
-                                        AllFileSendMax = True
-                                else:
-                                    FileLessRedundancy += 1
+                            # mode delta: seulement les blocs modifi�s depuis la derni�re version envoy�e
+                            envoyer = send_delta if options.delta else send
+                            envoye = (
+                                envoyer(
+                                    fullpathfichier,
+                                    f,
+                                    limiteur_debit,
+                                    crc=int(DRef.dict[f].get(ATTR_CRC)),
+                                    passage=int(DRef.dict[f].get(ATTR_NBSEND)),
+                                )
+                                != -1
+                            )
+                        if envoye:
+                            DRef.dict[f].set(ATTR_LASTSEND, str(time.time()))
+                            DRef.dict[f].set(ATTR_NBSEND, str(int(DRef.dict[f].get(ATTR_NBSEND)) + 1))
+                            if int(DRef.dict[f].get(ATTR_NBSEND)) > MinFileRedundancy:
+                                LastFileSendMax = True
+                                if FileLessRedundancy == 0:
+                                    AllFileSendMax = True
+                            else:
+                                FileLessRedundancy += 1
+                    else:
+                        debug("Fichier non stable - out")
+                        # doit on r�initialiser les donn�es de r�f�rence ?
+                        # fichier non �mis donc � r��mettre ult�rieurement
+                        FileLessRedundancy += 1
+                    # fin du controle
+            # Liste vide : rien � transmettre
+            else:
+                # permet de sortir de la boucle 2
+                LastFileSendMax = True
+                if lots is not None:
+                    # dernier lot, avant l'attente
+                    lots.envoyer()
+                # On temporise si on est en mode boucle
+                if options.boucle:
+                    attente = options.pause - boucleemission.temps_total()
+                    if attente > 0:
+                        print("%s - Attente avant nouvelle scrutation" % mtime2str(time.time()))
+                        if surveillance is not None:
+                            # nouvelle scrutation d�s qu'un fichier change
+                            surveillance.attendre(attente)
                         else:
-                            debug("Fichier non stable - out")
-                            # doit on r�initialiser les donn�es de r�f�rence ?
-                            # fichier non �mis donc � r��mettre ult�rieurement
-                            FileLessRedundancy += 1
-                        # fin du controle
-                # Liste vide : rien � transmettre
-                else:
-                    # permet de sortir de la boucle 2
-                    LastFileSendMax = True
-                    # On temporise si on est en mode boucle
-                    if options.boucle:
-                        attente = options.pause - boucleemission.temps_total()
-                        if attente > 0:
-                            print("%s - Attente avant nouvelle scrutation" % mtime2str(time.time()))
                             time.sleep(attente)
-            Console.Print_temp("%s - Sauvegarde du fichier de reprise" % mtime2str(time.time()))
-            DRef.et.set(xfl.ATTR_TIME, str(time.time()))
-            if XFLFile == "BFTPsynchro.xml":
-                if os.path.isfile(XFLFile):
-                    try:
-                        os.rename(XFLFile, XFLFileBak)
-                    except:
-                        os.remove(XFLFileBak)
-                        os.rename(XFLFile, XFLFileBak)
-            DRef.write_file(XFLFile)
-        debug("Tous les fichiers ont ete emis")
+        if lots is not None:
+            lots.envoyer()
+        if not incremental or time.time() - derniere_sauvegarde > SAUVEGARDE_DELAI:
+            sauvegarder_reprise()
+            derniere_sauvegarde = time.time()
+    debug("Tous les fichiers ont ete emis")
+
+
+def sauvegarder_reprise():
+    "pour enregistrer DRef dans le fichier de reprise (l'ancien est gard� dans XFLFileBak)."
+    Console.Print_temp("%s - Sauvegarde du fichier de reprise" % mtime2str(time.time()))
+    DRef.et.set(xfl.ATTR_TIME, str(time.time()))
+    if XFLFile == "BFTPsynchro.xml":
+        if os.path.isfile(XFLFile):
+            try:
+                os.rename(XFLFile, XFLFileBak)
+            except:
+                os.remove(XFLFileBak)
+                os.rename(XFLFile, XFLFileBak)
+    DRef.write_file(XFLFile)
 
 
 # ------------------------------------------------------------------------------
@@ -1282,7 +3189,151 @@ def analyse_options():
         "-a", dest="adresse", default="localhost", help="Adresse destination: Adresse IP ou nom de machine"
     )
     parseur.add_option("-p", dest="port_UDP", help="Port UDP", type="int", default=36016)
+    parseur.add_option(
+        "-n",
+        "--stripes",
+        dest="stripes",
+        help="Stripe the packets over N consecutive UDP ports (and over the addresses of -a, separated by commas), "
+        "received by one process per port",
+        type="int",
+        default=1,
+    )
     parseur.add_option("-l", dest="debit", help="Rate limit (Kbps)", type="int", default=8000)
+    parseur.add_option(
+        "-B", dest="rafale", help="Burst size of the rate limiter (KB)", type="int", default=RAFALE // 1024
+    )
+    parseur.add_option(
+        "-k",
+        "--pacing",
+        dest="pacing",
+        type="choice",
+        choices=Transport.PACINGS,
+        default=Transport.PACING_PYTHON,
+        help="Pacing backend: python (pauses), fq (SO_MAX_PACING_RATE) or txtime (SO_TXTIME), "
+        "fq and txtime need the fq qdisc on the interface",
+    )
+    parseur.add_option(
+        "-f",
+        "--fec",
+        dest="fec",
+        help="Send one XOR parity packet per N file packets (0: no FEC)",
+        type="int",
+        default=0,
+    )
+    parseur.add_option(
+        "-F",
+        "--fountain",
+        dest="fontaine",
+        help="Fountain mode: send RATIO x N coded symbols per file and per pass, instead of the N packets (e.g. 1.1)",
+        type="float",
+        default=0,
+    )
+    parseur.add_option(
+        "-C",
+        "--checksum",
+        action="store_true",
+        dest="checksum",
+        default=False,
+        help="Send the CRC32 of each packet data (file, FEC parity or fountain symbol), so that the receiver "
+        "drops corrupted packets",
+    )
+    parseur.add_option(
+        "-z",
+        "--compress",
+        dest="compression",
+        type="choice",
+        choices=sorted(Compression.METHODES),
+        default=None,
+        help="Compress the files with zlib or lzma before sending them (content already compressed is sent raw)",
+    )
+    parseur.add_option(
+        "-D",
+        "--dedup",
+        action="store_true",
+        dest="dedup",
+        default=False,
+        help="Deduplication: send only the chunks of the files not sent yet (content-defined chunking), "
+        "and the recipe of each file",
+    )
+    parseur.add_option(
+        "--purge-store",
+        action="store_true",
+        dest="purger_magasin",
+        default=False,
+        help="Reception: delete the chunks of the deduplication store that no waiting recipe references "
+        "(they are sent again on the last send of each recipe, or on each send if the sender deletes its file "
+        "BFTPchunks.idx)",
+    )
+    parseur.add_option(
+        "-u",
+        "--delta",
+        action="store_true",
+        dest="delta",
+        default=False,
+        help="Delta mode (with -s or -S): send only the blocks of the modified files which changed since "
+        "the last version sent",
+    )
+    parseur.add_option(
+        "-g",
+        "--bundle",
+        action="store_true",
+        dest="lots",
+        default=False,
+        help="Bundle mode (with -s or -S): send the small files (up to %d bytes) grouped in shared packets"
+        % Bundle.TAILLE_MAX_FICHIER,
+    )
+    parseur.add_option(
+        "-i",
+        "--ids",
+        action="store_true",
+        dest="identifiants",
+        default=False,
+        help="File ID mode: the file packets carry a 32-bit file ID instead of the file name, "
+        "bound to the name by announcement packets repeated during the send",
+    )
+    parseur.add_option(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        help="Scan the tree with N threads listing directories concurrently (with -s or -S, for network "
+        "mounted sources; 0: one directory at a time)",
+        type="int",
+        default=0,
+    )
+    parseur.add_option(
+        "-m",
+        "--mtu",
+        dest="mtu",
+        help="MTU of the link (with -e, -s or -S): the packets are sized to be sent without IP fragmentation "
+        "('auto': MTU of the path known by the system, default: packets of %d bytes). "
+        "A file whose name does not fit in a packet with its extensions is not sent." % PACKAGE_SIZE,
+        default=None,
+    )
+    parseur.add_option(
+        "-W",
+        "--watch",
+        action="store_true",
+        dest="surveiller",
+        default=False,
+        help="Watch mode (with -s or -S and -b, Linux): the changes of the tree are detected with inotify and "
+        "sent at once, the tree is only scanned entirely at start, when events are lost and once a day",
+    )
+    parseur.add_option(
+        "-w",
+        "--workers",
+        dest="workers",
+        help="Receive with N worker threads, the packets of a file always going to the same worker "
+        "(0: single thread)",
+        type="int",
+        default=0,
+    )
+    parseur.add_option(
+        "--asyncio",
+        action="store_true",
+        dest="asyncio",
+        default=False,
+        help="Receive with the asyncio engine (with -w, N executors for the file writes)",
+    )
     parseur.add_option("-d", "--debug", action="store_true", dest="debug", default=False, help="Mode Debug")
     parseur.add_option(
         "-b", "--boucle", action="store_true", dest="boucle", default=False, help="Looping files"
@@ -1308,6 +3359,42 @@ def analyse_options():
         parseur.error("You must indicate one and only one action. (%s -h pour l'aide complete)" % NOM_SCRIPT)
     if len(args) != 1:
         parseur.error("You must specify one and only one file/directory. (%s -h pour l'aide complete)" % NOM_SCRIPT)
+    if not 0 <= options.fec <= 0xFFFF:
+        parseur.error("The FEC group size must be between 0 and 65535.")
+    if options.fontaine and options.fontaine < 1:
+        parseur.error("The fountain ratio must be at least 1.")
+    if options.fontaine and options.fec:
+        parseur.error("FEC and fountain modes cannot be used together.")
+    if options.workers < 0:
+        parseur.error("The number of workers must be positive.")
+    if options.jobs < 0:
+        parseur.error("The number of scan threads must be positive.")
+    if options.surveiller:
+        if not (options.synchro_arbo or options.synchro_arbo_stricte) or not options.boucle:
+            parseur.error("The watch mode needs a tree synchronization in loop mode (-s or -S, and -b).")
+        if not Watcher.disponible():
+            parseur.error("The watch mode needs Linux inotify.")
+    if options.stripes < 1:
+        parseur.error("The number of ports must be at least 1.")
+    if options.recevoir and options.stripes > 1:
+        if options.workers or options.asyncio:
+            parseur.error("Reception on several ports cannot be used with workers or asyncio.")
+        if not hasattr(os, "pwrite"):
+            parseur.error("Reception on several ports is not available on this system.")
+    if options.delta and options.dedup:
+        parseur.error("Delta and deduplication modes cannot be used together.")
+    if not Transport.LINUX:
+        if options.pacing != Transport.PACING_PYTHON:
+            parseur.error("The %s pacing is only available on Linux." % options.pacing)
+        if options.mtu == "auto":
+            parseur.error("The MTU 'auto' is only available on Linux, give a number of bytes.")
+    if options.mtu is not None and options.mtu != "auto":
+        try:
+            options.mtu = int(options.mtu)
+        except ValueError:
+            parseur.error("The MTU must be a number of bytes or 'auto'.")
+        if options.mtu < MTU_MIN:
+            parseur.error("The MTU must be at least %d bytes." % MTU_MIN)
     return (options, args)
 
 
@@ -1322,8 +3409,6 @@ if __name__ == "__main__":
     PORT = options.port_UDP
     MODE_DEBUG = options.debug
 
-    stats = Stats()
-
     logging.basicConfig(
         level=logging.DEBUG,
         format="%(asctime)s %(levelname)-8s %(message)s",
@@ -1336,8 +3421,19 @@ if __name__ == "__main__":
 
     # Emission de messages heartbeat
     hb_sender = HeartBeat()
-    hb_reciver = HeartBeat()
     if not (options.recevoir):
+        # one long-lived socket for files, heartbeats and delete notifications
+        get_transport()
+        if options.mtu == "auto":
+            taille = get_transport().taille_datagramme()
+            if taille is None:
+                print("MTU of the path unknown, packets of %d bytes" % PACKAGE_SIZE)
+            else:
+                PACKAGE_SIZE = min(taille, PACKAGE_SIZE)
+        elif options.mtu:
+            # paquets envoy�s sans fragmentation IP: la perte d'un fragment perd le paquet entier
+            PACKAGE_SIZE = min(options.mtu - Transport.ENTETES_IP_UDP, 65500)
+        debug("Taille des paquets : %d octets" % PACKAGE_SIZE)
         hb_sender.start_hb_sender()
 
     if options.pitch:
@@ -1356,7 +3452,7 @@ if __name__ == "__main__":
             XFLFileBak = "BFTPsynchro.bak"
         else:
             XFLFile_id, XFLFile = tempfile.mkstemp(prefix="BFTP_", suffix=".xml")
-        DRef = xfl.DirTree()
+        DRef = xfl.DirTree(owner=False, workers=options.jobs)
         if XFLFile_id:
             debug("Session resume file : %s" % XFLFile)
             DRef.read_disk(target, working.AffCar)
@@ -1366,6 +3462,21 @@ if __name__ == "__main__":
                 DRef.read_file(XFLFile)
             except:
                 DRef.read_disk(target, working.AffCar)
+        if options.delta:
+            # signatures des versions envoy�es, � c�t� du fichier de reprise
+            signatures_envoyees = Delta.Signatures(os.path.splitext(XFLFile)[0] + Delta.EXTENSION_SIGNATURES)
+        if options.surveiller:
+            # les fichiers de travail de l'�metteur peuvent �tre dans l'arborescence
+            fichiers_travail = [XFLFile, Dedup.FICHIER_ENVOYES]
+            if options.reprise:
+                fichiers_travail.append(XFLFileBak)
+            if options.delta:
+                fichiers_travail.append(signatures_envoyees.repertoire)
+            try:
+                surveillance = Watcher.Surveillance(target, fichiers_travail)
+            except OSError as e:
+                print("Watch mode unavailable (%s): full tree scans" % e)
+                logging.warning("Watch mode unavailable: %s" % e)
         if options.boucle:
             while True:
                 try:
@@ -1386,12 +3497,22 @@ if __name__ == "__main__":
             # os.close(XFLFileBak_id)
             os.remove(XFLFile)
             # os.remove(XFLFileBak)
+            if options.delta:
+                shutil.rmtree(signatures_envoyees.repertoire, True)
     elif options.recevoir:
         CHEMIN_DEST = path(args[0])
         # on commence par augmenter la priorit� du processus de r�ception:
         augmenter_priorite()
-        # thread de timeout des heartbeat
-        hb_reciver.Th_checktimeout_heartbeatT()
+        if options.purger_magasin:
+            nb_morceaux, octets = Dedup.purger_magasin(CHEMIN_DEST)
+            msg = "%d morceaux supprimes du magasin (%d octets)." % (nb_morceaux, octets)
+            print(msg)
+            logging.info(msg)
         # puis on se met en r�ception:
-        receive(CHEMIN_DEST)
+        if options.asyncio:
+            asyncio.run(receive_async(CHEMIN_DEST))
+        elif options.stripes > 1:
+            receive_ports(CHEMIN_DEST, options.stripes)
+        else:
+            receive(CHEMIN_DEST)
     logging.info("Stop BlindFTP")
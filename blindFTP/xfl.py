@@ -19,11 +19,15 @@ License: CeCILL v2, open-source (GPL compatible)
 # 2007-08-15 v0.04 PL: - improved dir callback
 # 2007-08-15 v0.05 PL: - added file callback, added element to callbacks
 # 2008-02-06 v0.06 PL: - first public release
+# 2026-10-18 v0.07    : - scan with os.scandir (one stat per file), owner
+#                         names cached by uid, owner collection optional
+#                       - parallel scan with a pool of threads (option -j)
+#                       - update of some paths only (changes given by inotify)
 
 #------------------------------------------------------------------------------
 # TODO:
 # + store timestamps with XML-Schema dateTime format
-# - options to store owner
+# + options to store owner
 # + add simple methods like isfile, isdir, which take a path as arg
 # + handle exceptions file-by-file and store them in the XML
 # ? replace callback functions by DirTree methods which may be overloaded ?
@@ -31,7 +35,12 @@ License: CeCILL v2, open-source (GPL compatible)
 # - DirTree options to handle owner, hash, ...
 
 #--- IMPORTS ------------------------------------------------------------------
-import sys, time
+import sys, os, stat, time
+import concurrent.futures
+try:
+    import pwd
+except ImportError:
+    pwd = None
 
 # path module to easily handle files and dirs:
 try:
@@ -78,11 +87,21 @@ class DirTree:
     that can be written or read from an XML file.
     """
 
-    def __init__(self, rootpath=""):
+    def __init__(self, rootpath="", owner=True, workers=0):
         """
         DirTree constructor.
+        owner: store the owner of each file (one lookup per owner, but one
+        system call per file on Windows).
+        workers: number of threads listing directories concurrently
+        (0 or 1: one directory at a time).
         """
         self.rootpath = path(rootpath)
+        # index of the objects by their paths (cf. pathdict):
+        self.dict = None
+        self.owner = owner
+        self.workers = workers
+        # cache of the owner names, by uid:
+        self._owners = {}
 
     def read_disk(self, rootpath=None, callback_dir=None, callback_file=None):
         """
@@ -90,12 +109,16 @@ class DirTree:
         """
         # creation of the root ElementTree:
         self.et = ET.Element(TAG_DIRTREE)
+        self.dict = None
         if rootpath:
             self.rootpath = path(rootpath)
         # name attribute = rootpath
         self.et.set(ATTR_NAME, self.rootpath)
         # time attribute = time of scan
         self.et.set(ATTR_TIME, str(time.time()))
+        if self.workers > 1:
+            self._scan_parallel(callback_dir, callback_file)
+            return
         try: self._scan_dir(self.rootpath, self.et, callback_dir, callback_file)
         except:print(" Error : unable to scan the directory %s " % self.rootpath)
 
@@ -104,25 +127,153 @@ class DirTree:
         to scan a dir on the disk (recursive scan).
         (this is a private method)
         """
+        for d, e in self._add_entries(dir, parent, self._list_dir(dir), callback_dir, callback_file):
+            try: self._scan_dir(d, e, callback_dir, callback_file)
+            except: print("Error : unable to scan the subdirectory %s " % d)
+
+    def _scan_parallel(self, callback_dir=None, callback_file=None):
+        """
+        to scan the tree with a pool of threads: the directories are listed
+        and their files stat()ed concurrently, and the tree is built by the
+        calling thread from the listings, so it does not depend on the order
+        in which they complete.
+        (this is a private method)
+        """
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+            pending = {pool.submit(self._list_dir, self.rootpath): (self.rootpath, self.et)}
+            while pending:
+                done = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)[0]
+                for future in done:
+                    dir, parent = pending.pop(future)
+                    try:
+                        listing = future.result()
+                    except:
+                        if dir is self.rootpath:
+                            print(" Error : unable to scan the directory %s " % dir)
+                        else:
+                            print("Error : unable to scan the subdirectory %s " % dir)
+                        continue
+                    for d, e in self._add_entries(dir, parent, listing, callback_dir, callback_file):
+                        pending[pool.submit(self._list_dir, d)] = (d, e)
+
+    def update(self, paths):
+        """
+        to update the DirTree from the disk for some paths only (relative to
+        the root, e.g. given by Watcher): each path is read again, a dir with
+        its whole subtree, and removed from the tree if it does not exist
+        anymore.
+        """
+        if self.dict is None:
+            self.pathdict()
+        # parents first: a new dir is scanned with its files
+        for p in sorted(set(paths)):
+            self._update_path(path(p))
+        self.et.set(ATTR_TIME, str(time.time()))
+
+    def _update_path(self, p):
+        """
+        to update one path of the DirTree from the disk.
+        (this is a private method)
+        """
+        parent, name = p.splitpath()
+        if parent == "":
+            parent_et = self.et
+        else:
+            parent_et = self.dict.get(parent)
+            if parent_et is None or parent_et.tag != TAG_DIR:
+                # parent not in the tree yet: read it with its subtree
+                self._update_path(parent)
+                return
+        old = self.dict.pop(p, None)
+        if old is not None:
+            parent_et.remove(old)
+            if old.tag == TAG_DIR:
+                prefix = p + "/"
+                for key in [k for k in self.dict if k.startswith(prefix)]:
+                    del self.dict[key]
+        try:
+            st = os.stat(self.rootpath / p)
+        except OSError:
+            return
+        if stat.S_ISDIR(st.st_mode):
+            e = ET.SubElement(parent_et, TAG_DIR)
+            e.set(ATTR_NAME, name)
+            try: self._scan_dir(self.rootpath / p, e)
+            except: print("Error : unable to scan the subdirectory %s " % p)
+            self.dict[p] = e
+            self._pathdict_dir(p, e)
+        elif stat.S_ISREG(st.st_mode):
+            self._add_entries(self.rootpath / parent, parent_et, ([(name, st)], []))
+            self.dict[p] = parent_et[-1]
+
+    def _list_dir(self, dir):
+        """
+        to list a dir on the disk: returns the list of (name, stat) of its
+        files and the list of the names of its subdirs, sorted by name.
+        os.scandir: the type of each entry comes with the listing, and its
+        stat() is done once for size, mtime and owner.
+        (this is a private method)
+        """
+        files = []
+        dirs = []
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        dirs.append(entry.name)
+                    elif entry.is_file():
+                        files.append((entry.name, entry.stat()))
+                except OSError:
+                    # file removed during the scan
+                    pass
+        files.sort()
+        dirs.sort()
+        return files, dirs
+
+    def _add_entries(self, dir, parent, listing, callback_dir=None, callback_file=None):
+        """
+        to add the files and subdirs of a dir listing to its element:
+        returns the list of (path, element) of the subdirs to scan.
+        (this is a private method)
+        """
         if callback_dir:
         	callback_dir(dir, parent)
-        for f in dir.files():
+        files, dirs = listing
+        for name, st in files:
             e = ET.SubElement(parent, TAG_FILE)
-            e.set(ATTR_NAME, f.name)
-            e.set(ATTR_SIZE, str(f.getsize()))
-            e.set(ATTR_MTIME, str(f.getmtime()))
-            try:
-                e.set(ATTR_OWNER, f.get_owner())
-            except:
-                pass
+            e.set(ATTR_NAME, name)
+            e.set(ATTR_SIZE, str(st.st_size))
+            e.set(ATTR_MTIME, str(st.st_mtime))
+            if self.owner:
+                try:
+                    owner = self._get_owner(dir / name, st)
+                    if owner is not None:
+                        e.set(ATTR_OWNER, owner)
+                except:
+                    pass
             if callback_file:
-                callback_file(f, e)
-        for d in dir.dirs():
-            #print d
+                callback_file(dir / name, e)
+        subdirs = []
+        for name in dirs:
             e = ET.SubElement(parent, TAG_DIR)
-            e.set(ATTR_NAME, d.name)
-            try: self._scan_dir(d, e, callback_dir, callback_file)
-            except: print("Error : unable to scan the subdirectory %s " % d)
+            e.set(ATTR_NAME, name)
+            subdirs.append((dir / name, e))
+        return subdirs
+
+    def _get_owner(self, f, st):
+        """
+        to get the owner name of a file from its stat, looked up once per uid
+        (None if the uid has no name).
+        (this is a private method)
+        """
+        if pwd is None:
+            return f.get_owner()
+        if st.st_uid not in self._owners:
+            try:
+                self._owners[st.st_uid] = pwd.getpwuid(st.st_uid).pw_name
+            except KeyError:
+                self._owners[st.st_uid] = None
+        return self._owners[st.st_uid]
 
     def write_file(self, filename, encoding="utf-8"):
         """
@@ -137,6 +288,7 @@ class DirTree:
         """
         tree = ET.parse(filename)
         self.et = tree.getroot()
+        self.dict = None
         self.rootpath = self.et.get(ATTR_NAME)
 
     def pathdict(self):
@@ -146,6 +298,20 @@ class DirTree:
         self.dict = {}
         self._pathdict_dir(path(""), self.et)
 
+    def subpaths(self, p):
+        """
+        to list the paths of the files and dirs under the dir p, from the
+        elements of the tree (without going through the other paths).
+        """
+        paths = []
+        for e in self.dict[p]:
+            if e.tag in (TAG_DIR, TAG_FILE):
+                epath = p / e.get(ATTR_NAME)
+                paths.append(epath)
+                if e.tag == TAG_DIR:
+                    paths.extend(self.subpaths(epath))
+        return paths
+
     def _pathdict_dir(self, base, et):
         """
         (private method)
@@ -202,6 +368,8 @@ def compare_DT (dirTree1, dirTree2):
     dirTree2.pathdict()
     paths1 = dirTree1.dict.keys()
     paths2 = dirTree2.dict.keys()
+    # paths of dt2 not seen in dt1 (a set: removal in constant time)
+    restants = set(paths2)
     for p in paths1:
         if p in paths2:
             # path is in the 2 DT, we have to compare file info
@@ -212,11 +380,44 @@ def compare_DT (dirTree1, dirTree2):
                 same.append(p)
             else:
                 different.append(p)
-            paths2.remove(p)
+            restants.discard(p)
         else:
             only1.append(p)
-    # now paths2 should contain only files and dirs that weren't in paths1
-    only2 = paths2
+    # files and dirs that weren't in paths1
+    only2 = [p for p in paths2 if p in restants]
+    return same, different, only1, only2
+
+def compare_paths (dirTree1, dirTree2, paths):
+    """
+    to compare two DirTrees for some paths only (e.g. given by Watcher), a
+    dir with its whole subtree, without going through the other paths.
+    The dicts of both DirTrees must be up to date (cf. pathdict, update).
+    returns the same 4 lists of paths as compare_DT.
+    """
+    same = []
+    different = []
+    only1 = []
+    only2 = []
+    checked = set()
+    for p in paths:
+        p = path(p)
+        for dt in (dirTree1, dirTree2):
+            e = dt.dict.get(p)
+            if e is not None:
+                checked.add(p)
+                if e.tag == TAG_DIR:
+                    checked.update(dt.subpaths(p))
+    for p in checked:
+        f1 = dirTree1.dict.get(p)
+        f2 = dirTree2.dict.get(p)
+        if f2 is None:
+            only1.append(p)
+        elif f1 is None:
+            only2.append(p)
+        elif compare_files(f1, f2):
+            same.append(p)
+        else:
+            different.append(p)
     return same, different, only1, only2
 
 def callback_dir_print(dir, element):
@@ -250,11 +451,15 @@ def callback_file_print(file, element):
 
 if __name__ == "__main__":
 
+    workers = 0
+    if len(sys.argv) > 2 and sys.argv[1] == "-j":
+        workers = int(sys.argv[2])
+        del sys.argv[1:3]
     if len(sys.argv) < 3:
         print (__doc__)
-        print ("usage: python %s <root path> <xml file> [previous xml file]" % path(sys.argv[0]).name)
+        print ("usage: python %s [-j threads] <root path> <xml file> [previous xml file]" % path(sys.argv[0]).name)
         sys.exit(1)
-    d = DirTree()
+    d = DirTree(workers=workers)
     d.read_disk(sys.argv[1], callback_dir_print, callback_file_print)
     d.write_file(sys.argv[2])
     if len(sys.argv)>3: